@@ -0,0 +1,249 @@
+"""
+The journaled batch backend to the image-titler script.
+
+Unlike process_images and save_copies, which hold a whole batch in memory,
+a journaled batch saves each image as soon as it is processed and records
+the result in an append-only journal. Failed images are reported rather than
+aborting the batch, and an interrupted batch can be resumed from its journal.
+"""
+import json
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Set
+
+from imagetitler.constants import *
+from imagetitler.draw import Titler, _list_batch_inputs
+from imagetitler.metrics import FAILURES, increment
+from imagetitler.store import save_copy
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+def run_batch(**kwargs) -> dict:
+    """
+    Processes and saves a batch of images one at a time while journaling the results.
+    The typical list of options apply (see parse_input), and images are saved exactly
+    like save_copies would name them.
+
+    With the resume option, images which the journal records as done are skipped.
+    Failed images are retried. With the shard option, only the images of that
+    shard are processed, and the shard keeps a journal of its own. If SIGINT or
+    SIGTERM is received, the image in flight is finished and journaled before
+    the batch stops.
+
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a report of the batch (lists of done, failed, and skipped paths plus errors by path)
+    """
+    kwargs[KEY_PATH] = kwargs.get(KEY_PATH) or TRC_IMAGES
+    kwargs[KEY_BATCH] = True
+    journal_path = _get_journal_path(**kwargs)
+    completed = _load_completed(journal_path) if kwargs.get(KEY_RESUME) else set()
+    titler = Titler(**kwargs)
+    report = {STATUS_DONE: list(), STATUS_FAILED: list(), "skipped": list(), "errors": dict(), "interrupted": False}
+    stop = threading.Event()
+    with open(journal_path, "a" if kwargs.get(KEY_RESUME) else "w") as journal, _stop_on_signals(stop):
+        for index, input_path in _list_batch_inputs(**kwargs):
+            if stop.is_set():
+                report["interrupted"] = True
+                break
+            if _get_relative_path(input_path, **kwargs) in completed or input_path in completed:
+                report["skipped"].append(input_path)
+                continue
+            entry = _process_entry(titler, index, input_path, **kwargs)
+            _append_entry(journal, entry)
+            report[entry["status"]].append(input_path)
+            if entry["error"]:
+                report["errors"][input_path] = entry["error"]
+    _log_report(report, journal_path)
+    return report
+
+
+def _process_entry(titler: Titler, index: int, input_path: str, **kwargs) -> dict:
+    """
+    Processes and saves a single image of a batch. Any error is caught
+    and recorded, so one bad image can't abort the batch.
+
+    :param titler: the titler of the batch
+    :param index: the index of the image in the batch
+    :param input_path: the path of the image
+    :param kwargs: a set of options
+    :return: a journal entry
+    """
+    entry = {
+        "index": index,
+        "path": input_path,
+        "relative_path": _get_relative_path(input_path, **kwargs),
+        "status": STATUS_DONE,
+        "outputs": [],
+        "error": None
+    }
+    try:
+        edited_image = titler.render(input_path)
+        entry["outputs"] = save_copy(edited_image, index, **kwargs)
+    except Exception as error:  # isolate failures (e.g. corrupt or unreadable files)
+        entry.update(status=STATUS_FAILED, error=f"{type(error).__name__}: {error}")
+        increment(FAILURES, size=kwargs.get(KEY_SIZE) or DEFAULT_SIZE)
+    entry["time"] = time.time()
+    return entry
+
+
+def _append_entry(journal, entry: dict) -> None:
+    """
+    Appends an entry to the journal and forces it to disk. Each entry is
+    a single JSON line written at once, so a crash can at worst leave
+    a truncated final line (which is ignored when resuming).
+
+    :param journal: the open journal file
+    :param entry: the journal entry
+    :return: None
+    """
+    journal.write(json.dumps(entry) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def _get_relative_path(input_path: str, **kwargs) -> str:
+    """
+    Gets the path of an input relative to the batch folder, which identifies
+    the input wherever the batch folder is mounted (see merge_journals).
+
+    :param input_path: the path of the image
+    :param kwargs: a set of options
+    :return: the relative path of the image
+    """
+    return os.path.relpath(input_path, kwargs.get(KEY_PATH) or os.curdir)
+
+
+def _load_completed(journal_path: str) -> Set[str]:
+    """
+    Loads the inputs which a journal records as done. Like merge_journals,
+    inputs are identified by their relative path (or their path in older journals).
+
+    :param journal_path: the path of the journal
+    :return: a set of relative (or input) paths
+    """
+    completed = set()
+    for entry in load_journal(journal_path):
+        if entry.get("status") == STATUS_DONE:
+            completed.add(entry.get("relative_path") or entry.get("path"))
+    return completed
+
+
+def load_journal(journal_path: str) -> List[dict]:
+    """
+    Loads the entries of a journal. Missing journals have no entries,
+    and truncated lines (e.g. from a crash mid-write) are skipped.
+
+    :param journal_path: the path of the journal
+    :return: a list of journal entries
+    """
+    entries = list()
+    try:
+        with open(journal_path) as journal:
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def merge_journals(journal_paths: List[str]) -> dict:
+    """
+    Merges the journals of several shards (or runs) into one report. Inputs are
+    matched by their path relative to the batch folder (like shards are assigned),
+    so shards run on nodes with different mount points still merge. If an input
+    appears more than once, the entry recorded last wins, whatever the order of
+    the journals. Outputs claimed by more than one input are reported as collisions.
+
+    :param journal_paths: a list of journal paths
+    :return: a report with done and failed entries (in batch order), counts, and collisions
+    """
+    latest = dict()
+    for journal_path in journal_paths:
+        for entry in load_journal(journal_path):
+            key = entry.get("relative_path") or entry.get("path")  # older journals only record the path
+            if key not in latest or entry.get("time", 0) >= latest[key].get("time", 0):
+                latest[key] = entry
+    entries = sorted(latest.values(), key=lambda entry: entry.get("index", 0))
+    done = [entry for entry in entries if entry.get("status") == STATUS_DONE]
+    failed = [entry for entry in entries if entry.get("status") == STATUS_FAILED]
+    owners = dict()
+    for entry in done:
+        for output in entry.get("outputs", []):
+            owners.setdefault(output, list()).append(entry.get("path"))
+    return {
+        "journals": journal_paths,
+        "counts": {STATUS_DONE: len(done), STATUS_FAILED: len(failed)},
+        STATUS_DONE: done,
+        STATUS_FAILED: failed,
+        "collisions": {output: paths for output, paths in owners.items() if len(paths) > 1}
+    }
+
+
+def _get_journal_path(**kwargs) -> str:
+    """
+    Gets the path of the journal, which is kept in the output folder.
+    Each shard has its own journal, so shards can share an output folder.
+
+    :param kwargs: a set of options
+    :return: the path of the journal
+    """
+    file_name = JOURNAL_FILE_NAME
+    if shard := kwargs.get(KEY_SHARD):
+        file_name = SHARD_JOURNAL_FILE_NAME.format(index=shard[0], count=shard[1])
+    return os.path.join(kwargs.get(KEY_OUTPUT_PATH) or "", file_name)
+
+
+@contextmanager
+def _stop_on_signals(stop: threading.Event):
+    """
+    Sets an event instead of raising when SIGINT or SIGTERM is received, so work
+    in flight can finish cleanly. Signal handlers can only be installed from the
+    main thread, so elsewhere this does nothing.
+
+    :param stop: the event to set
+    :return: a context manager which restores the previous handlers on exit
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    signals = [signal.SIGINT, signal.SIGTERM]
+    previous_handlers = {signum: signal.getsignal(signum) for signum in signals}
+
+    def _handle(signum, _):
+        logger.warning(f"Received {signal.Signals(signum).name}, stopping after the current image")
+        stop.set()
+
+    for signum in signals:
+        signal.signal(signum, _handle)
+    try:
+        yield
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+
+def _log_report(report: dict, journal_path: str) -> None:
+    """
+    Logs a summary of a batch along with every failure.
+
+    :param report: the report of the batch
+    :param journal_path: the path of the journal
+    :return: None
+    """
+    logger.info(
+        f"{len(report[STATUS_DONE])} done, {len(report[STATUS_FAILED])} failed, "
+        f"{len(report['skipped'])} skipped{' (interrupted)' if report['interrupted'] else ''} "
+        f"(journal: {journal_path})"
+    )
+    for input_path, error in report["errors"].items():
+        logger.error(f"Failed {input_path}: {error}")
@@ -0,0 +1,617 @@
+"""
+Benchmarks for the image-titler script.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from PIL import Image
+
+from imagetitler.constants import *
+from imagetitler.draw import Titler, process_images, _draw_overlay, _get_base_image, _resize_image
+from imagetitler.store import encode_copy, _encode_image, _generate_version_exif, _write_file
+
+try:
+    import resource
+except ImportError:  # resource is only available on Unix
+    resource = None
+
+DEFAULT_BENCHMARK_QUALITIES = [100, 90, 80, 70]
+DEFAULT_BENCHMARK_WIDTHS = [1920, 3840, 6000, 8000]
+DEFAULT_BENCHMARK_REPEAT = 3
+DEFAULT_BENCHMARK_WORKERS = [2 ** i for i in range(int(math.log2(os.cpu_count() or 1)) + 1)]
+DEFAULT_BENCHMARK_MEGAPIXELS = [1, 12, 48]
+DEFAULT_BENCHMARK_TITLE_LENGTHS = [16, 64]
+DEFAULT_BENCHMARK_IMAGES = 8
+BENCHMARK_STAGES = ["read", "resize", "overlay", "encode", "write"]
+BENCHMARK_PARAMETERS = ["workers", "megapixels", "size", "title_length"]
+TITLE_WORDS = "the quick brown fox jumps over a lazy dog while coding in python".split()
+
+
+def main() -> None:
+    """
+    The benchmark main function.
+
+    :return: None
+    """
+    args = _parse_benchmark_input()
+    args.benchmark(args)
+
+
+def _parse_benchmark_input() -> argparse.Namespace:
+    """
+    Parses the command line input of the benchmarks.
+
+    :return: the processed command line arguments
+    """
+    parser = argparse.ArgumentParser(description="benchmarks for the image-titler")
+    subparsers = parser.add_subparsers(required=True, metavar="benchmark")
+    _add_encode_benchmark(subparsers)
+    _add_resample_benchmark(subparsers)
+    _add_titler_benchmark(subparsers)
+    _add_scaling_benchmark(subparsers)
+    return parser.parse_args()
+
+
+def _add_encode_benchmark(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the encode benchmark and its options.
+
+    :param subparsers: the benchmark subparsers
+    :return: None
+    """
+    encode_parser = subparsers.add_parser("encode", help="compare output encoders on the bundled images")
+    encode_parser.add_argument(
+        "-p",
+        f"--{KEY_PATH}",
+        default=TRC_IMAGES,
+        help="select a folder of images to benchmark"
+    )
+    encode_parser.add_argument(
+        "-F",
+        f"--{KEY_FORMAT}",
+        nargs="+",
+        type=str.upper,
+        choices=FORMAT_MAP.keys(),
+        default=list(FORMAT_MAP.keys()),
+        help="select the output formats to benchmark"
+    )
+    encode_parser.add_argument(
+        "-q",
+        f"--{KEY_QUALITY}",
+        nargs="+",
+        type=int,
+        default=DEFAULT_BENCHMARK_QUALITIES,
+        help="select the quality levels to benchmark"
+    )
+    encode_parser.set_defaults(benchmark=_run_encode_benchmark)
+
+
+def _add_resample_benchmark(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the resample benchmark and its options.
+
+    :param subparsers: the benchmark subparsers
+    :return: None
+    """
+    resample_parser = subparsers.add_parser("resample", help="compare resampling modes across image sizes")
+    resample_parser.add_argument(
+        "-p",
+        f"--{KEY_PATH}",
+        default=TRC_IMAGE,
+        help="select an image to benchmark (it is scaled to each width)"
+    )
+    resample_parser.add_argument(
+        "-w",
+        "--widths",
+        nargs="+",
+        type=int,
+        default=DEFAULT_BENCHMARK_WIDTHS,
+        help="select the source image widths to benchmark"
+    )
+    resample_parser.add_argument(
+        "-s",
+        f"--{KEY_SIZE}",
+        choices=SIZE_MAP.keys(),
+        default=DEFAULT_SIZE,
+        help="select the output size to benchmark"
+    )
+    resample_parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=DEFAULT_BENCHMARK_REPEAT,
+        help="select the number of times each resize is repeated"
+    )
+    resample_parser.set_defaults(benchmark=_run_resample_benchmark)
+
+
+def _add_titler_benchmark(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the titler benchmark and its options.
+
+    :param subparsers: the benchmark subparsers
+    :return: None
+    """
+    titler_parser = subparsers.add_parser("titler", help="measure the per-call overhead of the titling API")
+    titler_parser.add_argument(
+        "-p",
+        f"--{KEY_PATH}",
+        default=TRC_IMAGE,
+        help="select an image to benchmark"
+    )
+    titler_parser.add_argument(
+        "-l",
+        f"--{KEY_LOGO_PATH}",
+        default=TRC_ICON,
+        help="select a logo to benchmark"
+    )
+    titler_parser.add_argument(
+        "-n",
+        "--repeat",
+        type=int,
+        default=DEFAULT_BENCHMARK_REPEAT * 10,
+        help="select the number of calls to measure"
+    )
+    titler_parser.set_defaults(benchmark=_run_titler_benchmark)
+
+
+def _add_scaling_benchmark(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the scaling benchmark and its options.
+
+    :param subparsers: the benchmark subparsers
+    :return: None
+    """
+    scaling_parser = subparsers.add_parser("scaling", help="measure batch throughput across workers, inputs, and sizes")
+    scaling_parser.add_argument(
+        "-w",
+        "--workers",
+        nargs="+",
+        type=int,
+        default=DEFAULT_BENCHMARK_WORKERS,
+        help="select the worker counts to benchmark"
+    )
+    scaling_parser.add_argument(
+        "-m",
+        "--megapixels",
+        nargs="+",
+        type=float,
+        default=DEFAULT_BENCHMARK_MEGAPIXELS,
+        help="select the input sizes (in megapixels) to benchmark"
+    )
+    scaling_parser.add_argument(
+        "-s",
+        f"--{KEY_SIZE}",
+        nargs="+",
+        choices=SIZE_MAP.keys(),
+        default=list(SIZE_MAP.keys()),
+        help="select the output sizes to benchmark"
+    )
+    scaling_parser.add_argument(
+        "-t",
+        "--title_lengths",
+        nargs="+",
+        type=int,
+        default=DEFAULT_BENCHMARK_TITLE_LENGTHS,
+        help="select the title lengths (in characters) to benchmark"
+    )
+    scaling_parser.add_argument(
+        "-n",
+        "--images",
+        type=int,
+        default=DEFAULT_BENCHMARK_IMAGES,
+        help="select the number of images per run"
+    )
+    scaling_parser.add_argument(
+        "-o",
+        f"--{KEY_OUTPUT_PATH}",
+        help="save the results to a .csv or .json file"
+    )
+    scaling_parser.add_argument(
+        "-c",
+        "--compare",
+        help="compare the results to an earlier .csv or .json results file"
+    )
+    scaling_parser.set_defaults(benchmark=_run_scaling_benchmark)
+
+
+def _run_encode_benchmark(args: argparse.Namespace) -> None:
+    """
+    Runs the encoder benchmark and prints the results as a table.
+
+    :param args: the processed command line arguments
+    :return: None
+    """
+    results = benchmark_encoders(args.path, args.format, args.quality)
+    _print_table(results, ["format", "quality", "images", "bytes", "mean_bytes", "seconds", "mean_ms"])
+
+
+def benchmark_encoders(path: str, image_formats: List[str], qualities: List[int]) -> List[dict]:
+    """
+    Encodes every image in a folder once per format and quality level. Images are
+    titled ahead of time, so only encoding is measured. PNG is lossless, so it is
+    only measured once regardless of quality.
+
+    :param path: a folder of images
+    :param image_formats: a list of keys of FORMAT_MAP
+    :param qualities: a list of quality levels
+    :return: a list of result rows (one per format and quality level)
+    """
+    images = process_images(path=path, batch=True)
+    results = list()
+    for image_format in image_formats:
+        for quality in qualities if image_format != "PNG" else [None]:
+            total_bytes = 0
+            start = time.perf_counter()
+            for image in images:
+                exif = _generate_version_exif(image)
+                total_bytes += len(_encode_image(image, image_format, exif, quality=quality))
+            seconds = time.perf_counter() - start
+            results.append({
+                "format": image_format,
+                "quality": quality if quality else "-",
+                "images": len(images),
+                "bytes": total_bytes,
+                "mean_bytes": total_bytes // len(images),
+                "seconds": round(seconds, 3),
+                "mean_ms": round(seconds / len(images) * 1000, 1)
+            })
+    return results
+
+
+def _run_resample_benchmark(args: argparse.Namespace) -> None:
+    """
+    Runs the resample benchmark and prints the results as a table.
+
+    :param args: the processed command line arguments
+    :return: None
+    """
+    results = benchmark_resampling(args.path, args.widths, args.size, args.repeat)
+    _print_table(results, ["mode", "source", "megapixels", "mean_ms", "megapixels_per_second", "speedup"])
+
+
+def benchmark_resampling(path: str, widths: List[int], size_key: str, repeat: int) -> List[dict]:
+    """
+    Resizes an image scaled to several widths once per resampling mode. The source
+    images are decoded up front, so only resizing is measured. Speedups are relative
+    to the default mode at the same source size.
+
+    :param path: the path of an image
+    :param widths: a list of source image widths
+    :param size_key: a key of SIZE_MAP
+    :param repeat: the number of times each resize is repeated
+    :return: a list of result rows (one per mode and source size)
+    """
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+    results = list()
+    for width in widths:
+        source = img.resize((width, round(img.height * width / img.width)), Image.BICUBIC)
+        megapixels = source.width * source.height / 1_000_000
+        timings = dict()
+        for resample_key in RESAMPLE_MAP:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                _resize_image(source, size=size_key, resample=resample_key)
+            timings[resample_key] = (time.perf_counter() - start) / repeat
+        for resample_key, seconds in timings.items():
+            results.append({
+                "mode": resample_key,
+                "source": f"{source.width}x{source.height}",
+                "megapixels": round(megapixels, 1),
+                "mean_ms": round(seconds * 1000, 1),
+                "megapixels_per_second": round(megapixels / seconds, 1),
+                "speedup": round(timings[DEFAULT_RESAMPLE] / seconds, 2)
+            })
+    return results
+
+
+def _run_titler_benchmark(args: argparse.Namespace) -> None:
+    """
+    Runs the titler benchmark and prints the results as a table.
+
+    :param args: the processed command line arguments
+    :return: None
+    """
+    results = benchmark_titler(args.path, args.logo_path, args.repeat)
+    _print_table(results, ["api", "calls", "mean_ms", "overhead_ms"])
+
+
+def benchmark_titler(path: str, logo_path: str, repeat: int) -> List[dict]:
+    """
+    Titles an image over and over, once through process_images (which sets everything
+    up per call) and once through a long-lived Titler. Overhead is the time spent beyond
+    decoding and resizing the image, which every call has to pay for.
+
+    :param path: the path of an image
+    :param logo_path: the path of a logo
+    :param repeat: the number of calls to measure
+    :return: a list of result rows (one per API)
+    """
+    titler = Titler(logo_path=logo_path)
+    calls = {
+        "resize only": lambda: _resize_image(Image.open(path)),
+        "process_images": lambda: process_images(path=path, logo_path=logo_path),
+        "Titler.render": lambda: titler.render(path)
+    }
+    timings = dict()
+    for api, call in calls.items():
+        call()  # warm up the shared caches
+        start = time.perf_counter()
+        for _ in range(repeat):
+            call()
+        timings[api] = (time.perf_counter() - start) / repeat
+    return [
+        {
+            "api": api,
+            "calls": repeat,
+            "mean_ms": round(seconds * 1000, 2),
+            "overhead_ms": round((seconds - timings["resize only"]) * 1000, 2)
+        }
+        for api, seconds in timings.items()
+    ]
+
+
+def _run_scaling_benchmark(args: argparse.Namespace) -> None:
+    """
+    Runs the scaling benchmark, saves the results, and prints them as a table.
+
+    :param args: the processed command line arguments
+    :return: None
+    """
+    results = benchmark_scaling(args.workers, args.megapixels, args.size, args.title_lengths, args.images)
+    if args.output_path:
+        _save_results(results, args.output_path)
+    columns = BENCHMARK_PARAMETERS + ["images_per_second", "speedup", "efficiency", "p50_ms", "p90_ms", "p99_ms"]
+    columns += [f"{stage}_ms" for stage in BENCHMARK_STAGES] + ["peak_rss_mb"]
+    if args.compare:
+        results = compare_results(_load_results(args.compare), results)
+        columns += ["baseline_images_per_second", "change"]
+    _print_table(results, columns)
+
+
+def benchmark_scaling(
+        workers: List[int],
+        megapixels: List[float],
+        size_keys: List[str],
+        title_lengths: List[int],
+        image_count: int
+) -> List[dict]:
+    """
+    Runs the batch pipeline over a generated corpus once per combination of worker count,
+    input size, output size, and title length. Every image gets a unique title, so each
+    overlay is rendered. The mean time of each stage is reported along with throughput,
+    so the stage which stops scaling (e.g. decoding and resizing, the overlay, encoding,
+    or I/O) stands out as its mean time grows with the worker count.
+
+    Speedup and efficiency are relative to the smallest worker count of the same
+    combination. Peak RSS is the peak of the whole process so far, so it only grows.
+
+    :param workers: a list of worker counts
+    :param megapixels: a list of input sizes in megapixels
+    :param size_keys: a list of keys of SIZE_MAP
+    :param title_lengths: a list of title lengths in characters
+    :param image_count: the number of images per run
+    :return: a list of result rows (one per combination)
+    """
+    results = list()
+    with tempfile.TemporaryDirectory(prefix="image-titler-bench-") as corpus_path:
+        for mp in megapixels:
+            input_paths = _generate_corpus(Path(corpus_path, f"{mp}mp"), mp, image_count)
+            for size_key, title_length in itertools.product(size_keys, title_lengths):
+                baseline_workers, baseline_ips = None, None
+                for worker_count in sorted(workers):
+                    row = _benchmark_pipeline(input_paths, worker_count, size_key, title_length, corpus_path)
+                    baseline_workers = baseline_workers or worker_count
+                    baseline_ips = baseline_ips or row["images_per_second"]
+                    speedup = row["images_per_second"] / baseline_ips
+                    results.append({
+                        "workers": worker_count,
+                        "megapixels": mp,
+                        "size": size_key,
+                        "title_length": title_length,
+                        **row,
+                        "speedup": round(speedup, 2),
+                        "efficiency": round(speedup * baseline_workers / worker_count, 2)
+                    })
+    return results
+
+
+def _benchmark_pipeline(
+        input_paths: List[Path],
+        worker_count: int,
+        size_key: str,
+        title_length: int,
+        corpus_path: str
+) -> dict:
+    """
+    Titles and saves a corpus with a pool of workers, timing each stage of every image.
+
+    :param input_paths: the paths of the corpus
+    :param worker_count: the number of workers
+    :param size_key: a key of SIZE_MAP
+    :param title_length: the length of the titles in characters
+    :param corpus_path: a scratch folder for the outputs
+    :return: a partial result row
+    """
+    titler = Titler(size=size_key)
+    output_path = Path(corpus_path, "output")
+    output_path.mkdir(exist_ok=True)
+
+    def _process(index: int, input_path: Path) -> dict:
+        timings = dict()
+        start = time.perf_counter()
+        data = input_path.read_bytes()
+        timings["read"] = time.perf_counter()
+        base_image = _get_base_image(Image.open(io.BytesIO(data)), **titler.options)
+        timings["resize"] = time.perf_counter()
+        edited_image = _draw_overlay(base_image, _generate_title(index, title_length), titler.spec)
+        timings["overlay"] = time.perf_counter()
+        data = encode_copy(edited_image, "JPEG", **titler.options)
+        timings["encode"] = time.perf_counter()
+        _write_file(str(output_path / f"{worker_count}-{index}.jpg"), data)
+        timings["write"] = time.perf_counter()
+        previous = start
+        for stage in BENCHMARK_STAGES:
+            timings[stage], previous = timings[stage] - previous, timings[stage]
+        timings["total"] = previous - start
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        timings = list(executor.map(_process, range(len(input_paths)), input_paths))
+    seconds = time.perf_counter() - start
+    latencies = sorted(timing["total"] * 1000 for timing in timings)
+    return {
+        "images": len(timings),
+        "seconds": round(seconds, 3),
+        "images_per_second": round(len(timings) / seconds, 2),
+        "p50_ms": round(_get_percentile(latencies, 50), 1),
+        "p90_ms": round(_get_percentile(latencies, 90), 1),
+        "p99_ms": round(_get_percentile(latencies, 99), 1),
+        **{f"{stage}_ms": round(statistics.mean(t[stage] for t in timings) * 1000, 1) for stage in BENCHMARK_STAGES},
+        "peak_rss_mb": _get_peak_rss_mb()
+    }
+
+
+def _generate_corpus(corpus_path: Path, megapixels: float, image_count: int) -> List[Path]:
+    """
+    Generates a corpus of noisy 3:2 JPEG images of a given size. Noise keeps
+    the images from being unrealistically easy to decode and encode.
+
+    :param corpus_path: the folder of the corpus
+    :param megapixels: the size of each image in megapixels
+    :param image_count: the number of images
+    :return: the paths of the images
+    """
+    corpus_path.mkdir(parents=True)
+    width = round(math.sqrt(megapixels * 1_000_000 * 3 / 2))
+    height = round(width * 2 / 3)
+    noise = Image.effect_noise((width, height), 64)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", [noise, gradient, Image.blend(noise, gradient, 0.5)])
+    paths = [corpus_path / f"image-{index}.jpg" for index in range(image_count)]
+    image.save(paths[0], quality=90)
+    for path in paths[1:]:
+        path.write_bytes(paths[0].read_bytes())
+    return paths
+
+
+def _generate_title(index: int, length: int) -> str:
+    """
+    Generates a unique title of a given length.
+
+    :param index: the index of the image
+    :param length: the length of the title in characters
+    :return: the title
+    """
+    words = itertools.cycle(TITLE_WORDS)
+    title = str(index)
+    while len(title) < length:
+        title += f" {next(words)}"
+    return title[:length].strip()
+
+
+def _get_percentile(values: List[float], percentile: float) -> float:
+    """
+    Computes a percentile of sorted values with the nearest-rank method.
+
+    :param values: a sorted list of values
+    :param percentile: the percentile (0 to 100)
+    :return: the value at that percentile
+    """
+    return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    """
+    Gets the peak resident set size of the process.
+
+    :return: the peak RSS in MiB or None if it can't be measured
+    """
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)  # bytes on macOS, KiB elsewhere
+
+
+def compare_results(baseline: List[dict], results: List[dict]) -> List[dict]:
+    """
+    Compares the throughput of two benchmark runs. Rows are matched by
+    their parameters, and rows without a match are compared to nothing.
+
+    :param baseline: the result rows of the earlier run
+    :param results: the result rows of the later run
+    :return: the later result rows with the baseline throughput and the relative change
+    """
+    baseline = {tuple(str(row[key]) for key in BENCHMARK_PARAMETERS): row for row in baseline}
+    compared = list()
+    for row in results:
+        baseline_row = baseline.get(tuple(str(row[key]) for key in BENCHMARK_PARAMETERS))
+        baseline_ips = float(baseline_row["images_per_second"]) if baseline_row else None
+        compared.append({
+            **row,
+            "baseline_images_per_second": baseline_ips or "-",
+            "change": f"{row['images_per_second'] / baseline_ips - 1:+.1%}" if baseline_ips else "-"
+        })
+    return compared
+
+
+def _save_results(results: List[dict], output_path: str) -> None:
+    """
+    Saves result rows as CSV or JSON depending on the extension of the path.
+
+    :param results: a list of result rows
+    :param output_path: the path of a .csv or .json file
+    :return: None
+    """
+    with open(output_path, "w", newline="") as output_file:
+        if output_path.lower().endswith(".csv"):
+            writer = csv.DictWriter(output_file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, output_file, indent=2)
+
+
+def _load_results(results_path: str) -> List[dict]:
+    """
+    Loads result rows saved as CSV or JSON.
+
+    :param results_path: the path of a .csv or .json file
+    :return: a list of result rows
+    """
+    with open(results_path, newline="") as results_file:
+        if results_path.lower().endswith(".csv"):
+            return list(csv.DictReader(results_file))
+        return json.load(results_file)
+
+
+def _print_table(rows: List[dict], columns: List[str]) -> None:
+    """
+    Prints a list of result rows as an aligned table.
+
+    :param rows: a list of result rows
+    :param columns: the keys of each row to print
+    :return: None
+    """
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).rjust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+An on-disk cache of resized base images for the image-titler script.
+
+Base images are stored as raw pixel files, so a cache hit can be memory-mapped
+and wrapped in an image without decoding the original file. Thumbnails (e.g. for
+the GUI gallery) are small, so they are stored as quickly compressed PNG files.
+"""
+import hashlib
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from imagetitler.constants import *
+
+CACHE_EXTENSION = ".raw"
+THUMBNAIL_EXTENSION = ".png"
+DIGEST_CHUNK_SIZE = 1 << 20
+
+# Maps image modes to raw modes which Pillow can map without copying (RGB is padded to four bytes)
+RAW_MODES = {
+    "RGB": "RGBX",
+    "RGBA": "RGBA",
+    "L": "L",
+    "CMYK": "CMYK"
+}
+
+
+def load_base_image(input_path: str, size_key: str, resample_key: str, cache_path: str) -> Optional[Image.Image]:
+    """
+    Loads a resized base image from the cache. The returned image is a read-only
+    view of a memory-mapped file, so Pillow copies it on the first modification.
+    Padded RGB entries are converted up front instead, which costs the same copy.
+
+    :param input_path: the path of the original image
+    :param size_key: a key of SIZE_MAP
+    :param resample_key: a key of RESAMPLE_MAP
+    :param cache_path: the cache directory
+    :return: the cached base image or None if there is no usable cache entry
+    """
+    size = SIZE_MAP.get(size_key)
+    digest = _get_digest(input_path)
+    for mode, raw_mode in RAW_MODES.items():
+        entry = Path(cache_path) / _get_entry_name(digest, size_key, resample_key, size, mode)
+        try:
+            with open(entry, "rb") as entry_file:
+                if os.fstat(entry_file.fileno()).st_size != size[0] * size[1] * Image.getmodebands(raw_mode):
+                    raise ValueError(f"{entry} is not the size of its image")
+                mapped = mmap.mmap(entry_file.fileno(), 0, access=mmap.ACCESS_READ)
+            image = Image.frombuffer(mode, size, mapped, "raw", raw_mode, 0, 1)
+        except FileNotFoundError:
+            continue
+        except (ValueError, OSError):  # a damaged entry (e.g. truncated by a crash) is a miss
+            _discard_entry(entry)
+            continue
+        _touch_entry(entry)
+        return image if image.mode == mode else image.convert(mode)
+    return None
+
+
+def store_base_image(image: Image.Image, input_path: str, size_key: str, resample_key: str, cache_path: str) -> None:
+    """
+    Stores a resized base image in the cache and evicts stale entries.
+    Images in modes which can't be mapped (e.g. palette images) are not cached.
+
+    :param image: the resized base image
+    :param input_path: the path of the original image
+    :param size_key: a key of SIZE_MAP
+    :param resample_key: a key of RESAMPLE_MAP
+    :param cache_path: the cache directory
+    :return: None
+    """
+    if not (raw_mode := RAW_MODES.get(image.mode)):
+        return
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    entry = Path(cache_path) / _get_entry_name(_get_digest(input_path), size_key, resample_key, image.size, image.mode)
+    temp_entry = entry.with_suffix(f".{os.getpid()}.tmp")
+    temp_entry.write_bytes(image.tobytes("raw", raw_mode))
+    os.replace(temp_entry, entry)
+    evict_base_images(cache_path)
+
+
+def evict_base_images(
+        cache_path: str,
+        max_age: float = DEFAULT_CACHE_MAX_AGE,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+) -> None:
+    """
+    Removes cache entries which haven't been used in max_age seconds. Then,
+    removes the least recently used entries until the cache fits in max_bytes.
+
+    :param cache_path: the cache directory
+    :param max_age: the maximum age of an entry in seconds
+    :param max_bytes: the maximum total size of the cache in bytes
+    :return: None
+    """
+    _evict_entries(cache_path, CACHE_EXTENSION, max_age, max_bytes)
+
+
+def load_thumbnail(input_path: str, max_size: tuple, cache_path: str) -> Optional[Image.Image]:
+    """
+    Loads a thumbnail from the cache. Unlike base images, thumbnails are keyed by
+    the path, size, and modification time of the original file rather than by its
+    contents, so a lookup never reads the original file.
+
+    :param input_path: the path of the original image
+    :param max_size: the bounding box of the thumbnail
+    :param cache_path: the cache directory
+    :return: the cached thumbnail or None if there is no cache entry
+    """
+    try:
+        entry = Path(cache_path) / _get_thumbnail_entry_name(input_path, max_size)
+        with Image.open(entry) as thumbnail:
+            thumbnail.load()
+    except OSError:
+        return None
+    _touch_entry(entry)
+    return thumbnail
+
+
+def store_thumbnail(thumbnail: Image.Image, input_path: str, max_size: tuple, cache_path: str) -> None:
+    """
+    Stores a thumbnail in the cache. Thumbnails are stored by the thousand,
+    so stale ones are evicted separately (see evict_thumbnails).
+
+    :param thumbnail: the thumbnail
+    :param input_path: the path of the original image
+    :param max_size: the bounding box of the thumbnail
+    :param cache_path: the cache directory
+    :return: None
+    """
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    entry = Path(cache_path) / _get_thumbnail_entry_name(input_path, max_size)
+    temp_entry = entry.with_suffix(f".{os.getpid()}.tmp")
+    thumbnail.save(temp_entry, "PNG", compress_level=1)
+    os.replace(temp_entry, entry)
+
+
+def evict_thumbnails(
+        cache_path: str,
+        max_age: float = DEFAULT_CACHE_MAX_AGE,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+) -> None:
+    """
+    Removes stale thumbnails like evict_base_images removes stale base images.
+
+    :param cache_path: the cache directory
+    :param max_age: the maximum age of a thumbnail in seconds
+    :param max_bytes: the maximum total size of the thumbnails in bytes
+    :return: None
+    """
+    _evict_entries(cache_path, THUMBNAIL_EXTENSION, max_age, max_bytes)
+
+
+def _touch_entry(entry: Path) -> None:
+    """
+    Marks a cache entry as used, since entries age from their last use.
+    Read-only caches can't be marked, but their entries are still served.
+
+    :param entry: the path of the entry
+    :return: None
+    """
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+
+
+def _discard_entry(entry: Path) -> None:
+    """
+    Removes a damaged cache entry if the cache allows it, so it's stored again.
+
+    :param entry: the path of the entry
+    :return: None
+    """
+    try:
+        entry.unlink()
+    except OSError:
+        pass
+
+
+def _evict_entries(cache_path: str, extension: str, max_age: float, max_bytes: int) -> None:
+    """
+    Removes the stale entries of one kind from a cache directory (see evict_base_images).
+
+    :param cache_path: the cache directory
+    :param extension: the extension of the entries
+    :param max_age: the maximum age of an entry in seconds
+    :param max_bytes: the maximum total size of the entries in bytes
+    :return: None
+    """
+    now = time.time()
+    entries = list()
+    with os.scandir(cache_path) as scanner:
+        for entry in scanner:
+            if entry.name.endswith(extension):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        if now - mtime <= max_age and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+
+def _get_entry_name(digest: str, size_key: str, resample_key: str, size: tuple, mode: str) -> str:
+    """
+    Generates the file name of a cache entry. The name carries everything
+    needed to map the entry, so entries don't need a header.
+
+    :param digest: the digest of the original image
+    :param size_key: a key of SIZE_MAP
+    :param resample_key: a key of RESAMPLE_MAP
+    :param size: the size of the base image
+    :param mode: the mode of the base image
+    :return: the file name of the cache entry
+    """
+    name = SEPARATOR.join([digest, size_key, resample_key, f"{size[0]}x{size[1]}", mode])
+    return f"{name}{CACHE_EXTENSION}"
+
+
+def _get_thumbnail_entry_name(input_path: str, max_size: tuple) -> str:
+    """
+    Generates the file name of a thumbnail cache entry. Changing the original file
+    changes its modification time (and usually its size), which changes the name.
+
+    :param input_path: the path of the original image
+    :param max_size: the bounding box of the thumbnail
+    :return: the file name of the cache entry
+    """
+    stat = os.stat(input_path)
+    key = f"{os.path.abspath(input_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return f"{digest}{SEPARATOR}{max_size[0]}x{max_size[1]}{THUMBNAIL_EXTENSION}"
+
+
+def _get_digest(input_path: str) -> str:
+    """
+    Computes a digest of the contents of a file.
+
+    :param input_path: the path of a file
+    :return: the digest as a hex string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(input_path, "rb") as input_file:
+        while chunk := input_file.read(DIGEST_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,10 +1,22 @@
 """
 The commandline interface for the image-titler script.
 """
+import json
+import logging
+import sys
+from contextlib import nullcontext
+from pathlib import Path
 
-from imagetitler.draw import process_images
+from imagetitler.batch import run_batch, merge_journals
+from imagetitler.constants import *
+from imagetitler.draw import iterate_images, process_images
+from imagetitler.jobs import run_jobs
+from imagetitler.metrics import export_metrics
 from imagetitler.parse import parse_input
-from imagetitler.store import save_copies
+from imagetitler.plan import plan_images
+from imagetitler.store import archive_copies, save_copies
+from imagetitler.variants import title_variants
+from imagetitler.watch import watch_folder
 
 
 def main() -> None:
@@ -13,9 +25,65 @@ def main() -> None:
 
     :return: None
     """
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
     args = vars(parse_input())
-    images = process_images(**args)
-    save_copies(images, **args)
+    with export_metrics(args.get(KEY_METRICS_FILE), args.get(KEY_METRICS_INTERVAL)):
+        _run(**args)
+
+
+def _run(**kwargs) -> None:
+    """
+    Runs the command (or mode) selected by the options.
+
+    :param kwargs: the parsed options
+    :return: None
+    """
+    if kwargs.get(KEY_COMMAND) == "merge":
+        _merge(**kwargs)
+        return
+    if kwargs.get(KEY_COMMAND) == "watch":
+        watch_folder(**kwargs)
+        return
+    if jobs_from := kwargs.get(KEY_JOBS_FROM):
+        with (open(jobs_from) if jobs_from != "-" else nullcontext(sys.stdin)) as jobs:
+            run_jobs(jobs, sys.stdout, **kwargs)
+        return
+    if titles_from := kwargs.get(KEY_TITLES_FROM):
+        with (open(titles_from) if titles_from != "-" else nullcontext(sys.stdin)) as titles:
+            title_variants((title.strip() for title in titles), **kwargs)
+        return
+    if kwargs.get(KEY_DRY_RUN):
+        print(json.dumps(plan_images(**kwargs), indent=2))
+        return
+    if kwargs.get(KEY_BATCH) and (kwargs.get(KEY_JOURNAL) or kwargs.get(KEY_RESUME) or kwargs.get(KEY_SHARD)):
+        run_batch(**kwargs)
+        return
+    if archive := kwargs.get(KEY_ARCHIVE):
+        archive_copies(iterate_images(**kwargs), archive, **kwargs)
+        return
+    images = process_images(**kwargs)
+    save_copies(images, **kwargs)
+
+
+def _merge(**kwargs) -> None:
+    """
+    Merges the journals of a sharded batch into one report. Folders
+    are searched for journals.
+
+    :param kwargs: the merge options
+    :return: None
+    """
+    journal_paths = list()
+    for manifest in kwargs.get(KEY_MANIFESTS):
+        if os.path.isdir(manifest):
+            journal_paths.extend(sorted(str(path) for path in Path(manifest).glob(".image-titler-journal*.jsonl")))
+        else:
+            journal_paths.append(manifest)
+    report = json.dumps(merge_journals(journal_paths), indent=2)
+    if output_path := kwargs.get(KEY_OUTPUT_PATH):
+        Path(output_path).write_text(report)
+    else:
+        print(report)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,7 @@
 import os
 
+from PIL import Image
+
 KEY_BATCH = "batch"
 KEY_FONT = "font"
 KEY_LOGO_PATH = "logo_path"
@@ -8,14 +10,47 @@ KEY_TIER = "tier"
 KEY_TITLE = "title"
 KEY_OUTPUT_PATH = "output_path"
 KEY_SIZE = "size"
+KEY_FORMAT = "format"
+KEY_QUALITY = "quality"
+KEY_COMPRESS_LEVEL = "compress_level"
+KEY_MAX_BYTES = "max_bytes"
+KEY_CACHE_PATH = "cache_path"
+KEY_RESAMPLE = "resample"
+KEY_DRY_RUN = "dry_run"
+KEY_JOURNAL = "journal"
+KEY_RESUME = "resume"
+KEY_SHARD = "shard"
+KEY_COMMAND = "command"
+KEY_MANIFESTS = "manifests"
+KEY_INTERVAL = "interval"
+KEY_POLLING = "polling"
+KEY_JOBS_FROM = "jobs_from"
+KEY_METRICS_FILE = "metrics_file"
+KEY_METRICS_INTERVAL = "metrics_interval"
+KEY_ARCHIVE = "archive"
+KEY_TITLES_FROM = "titles_from"
+
+STYLE_KEYS = [KEY_FONT, KEY_TIER, KEY_LOGO_PATH, KEY_SIZE, KEY_RESAMPLE, KEY_CACHE_PATH]  # options which set up a titler
 
-FILE_TYPES = [('image files', ('.png', '.jpg', '.jpeg'))]
+FILE_TYPES = [('image files', ('.png', '.jpg', '.jpeg', '.gif', '.webp'))]
 
 SEPARATOR = "-"
 
+JOURNAL_FILE_NAME = ".image-titler-journal.jsonl"
+SHARD_JOURNAL_FILE_NAME = ".image-titler-journal-{index}-of-{count}.jsonl"
+WATCH_JOURNAL_FILE_NAME = ".image-titler-journal-watch.jsonl"
+
 DEFAULT_BATCH_MODE = False
 DEFAULT_FONT = os.path.join(os.path.dirname(__file__), "assets/fonts/BERNHC.TTF")
 DEFAULT_SIZE = "WordPress"
+DEFAULT_QUALITY = 100
+DEFAULT_RESAMPLE = "balanced"
+DEFAULT_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # one week in seconds
+DEFAULT_CACHE_MAX_BYTES = 1 << 30  # one gibibyte
+DEFAULT_WATCH_INTERVAL = 1.0  # seconds
+DEFAULT_THUMBNAIL_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "image-titler", "thumbnails"
+)
 
 GOLD = (255, 215, 0)
 SILVER = (211, 211, 211)
@@ -32,6 +67,30 @@ SIZE_MAP = {
     "YouTube": (1280, 720)  # Featured image size according to: https://blog.snappa.com/wordpress-featured-image-size/
 }
 
+RESAMPLE_MAP = {
+    "fast": (Image.BILINEAR, 1.0),  # Reduces by whole factors as far as possible before filtering
+    "balanced": (Image.BICUBIC, 2.0),  # Matches the defaults of Image.thumbnail
+    "best": (Image.LANCZOS, None)  # Filters the full resolution image
+}
+
+FORMAT_MAP = {
+    "GIF": ".gif",
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp"
+}
+
+ARCHIVE_MODE_MAP = {
+    ".tar": "w|",
+    ".tar.gz": "w|gz",
+    ".tgz": "w|gz",
+    ".tar.bz2": "w|bz2",
+    ".tbz2": "w|bz2",
+    ".tar.xz": "w|xz",
+    ".txz": "w|xz",
+    ".zip": None  # Zip archives are written by zipfile rather than tarfile
+}
+
 TRC_ICON = os.path.join(os.path.dirname(__file__), 'assets/icons/the-renegade-coder-sample-icon.png')
 TRC_IMAGE = os.path.join(os.path.dirname(__file__), 'assets/images/welcome-to-the-image-titler-by-the-renegade-coder.jpg')
 TRC_IMAGES = os.path.join(os.path.dirname(__file__), 'assets/images/')
@@ -1,24 +1,63 @@
 """
 The functional backend to the image-titler script.
 """
+import functools
+import hashlib
+import io
+import math
+import re
+import threading
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Iterable, Iterator, NamedTuple
 
 from PIL import Image
+from PIL import ImageChops
 from PIL import ImageDraw
 from PIL import ImageFont
 from titlecase import titlecase
 
+from imagetitler.cache import load_base_image, store_base_image
 from imagetitler.constants import *
+from imagetitler.metrics import CACHE_REQUESTS, IMAGES, RENDER_SECONDS, increment, register_cache, timed
+from imagetitler.store import encode_copy
 
 TEXT_FILL = (255, 255, 255)
 RECTANGLE_FILL = (201, 2, 41)
 WHITE = (255, 255, 255, 0)
+TRANSPARENT = (0, 0, 0, 0)
 
 TOP_RECTANGLE_Y = 20
 X_OFFSET = TOP_RECTANGLE_Y
 LOGO_PADDING = TOP_RECTANGLE_Y
 
+OVERLAY_CACHE_SIZE = 16
+LAYOUT_CACHE_SIZE = 1024
+FONT_CACHE_SIZE = 256
+GLYPH_CACHE_SIZE = 1 << 16
+GLYPH_MASK_CACHE_SIZE = 4096
+MIN_FONT_SIZE = 12
+
+FONT_LOCK = threading.RLock()
+
+# Pillow 9.1 moved the layout constants into an enum (and later dropped the old names)
+BASIC_LAYOUT = ImageFont.Layout.BASIC if hasattr(ImageFont, "Layout") else ImageFont.LAYOUT_BASIC
+
+
+class RenderSpec(NamedTuple):
+    """
+    The layout settings of a render, computed once per job (see _get_render_spec)
+    instead of being looked up in the options by every drawing helper. Specs are
+    immutable and hashable, so they double as cache keys for layout results.
+    """
+    size: tuple  # the (width, height) of the output image
+    bar_height: int
+    top_y: int  # the y position of the top bar
+    x_offset: int  # the padding between the text and the edge of its bar
+    logo_padding: int
+    tier_color: Optional[tuple]  # the border color of the bars
+    bar_color: tuple
+    font: str  # the path to the font file
+
 
 def process_images(**kwargs) -> List[Image.Image]:
     """
@@ -26,62 +65,323 @@ def process_images(**kwargs) -> List[Image.Image]:
     will never return an empty list. If no settings are provided,
     this function will return a default image with a default title.
 
+    This is a thin wrapper around a Titler, which is set up once per call.
+    Embedding applications should keep a Titler around instead.
+
     :return: None
     """
-    is_batch: bool = kwargs.get(KEY_BATCH)
-    images = list()
-    if is_batch:
-        kwargs[KEY_PATH] = kwargs.get(KEY_PATH) if kwargs.get(KEY_PATH) else TRC_IMAGES
-        images = _process_batch(**kwargs)
+    return list(iterate_images(**kwargs))
+
+
+def iterate_images(**kwargs) -> Iterator[Image.Image]:
+    """
+    The streaming counterpart of process_images: images are titled
+    one at a time as they're consumed, so only one is held at a time
+    (e.g. while streaming a large batch into an archive).
+
+    :return: an iterator of edited images
+    """
+    titler = Titler(**kwargs)
+    if kwargs.get(KEY_BATCH):
+        yield from titler.render_many(_list_batch_paths(kwargs.get(KEY_PATH) or TRC_IMAGES))
     else:
-        kwargs[KEY_PATH] = kwargs.get(KEY_PATH) if kwargs.get(KEY_PATH) else TRC_IMAGE
-        kwargs[KEY_TITLE] = kwargs.get(KEY_TITLE) if kwargs.get(KEY_TITLE) else _convert_file_name_to_title(**kwargs)
-        images.append(_process_image(**kwargs))
-    return images
+        yield titler.render(kwargs.get(KEY_PATH) or TRC_IMAGE)
+
+
+class Titler:
+    """
+    A reusable image titler. Style options (e.g. font, tier, logo, size, and resample)
+    are set once, and everything which only depends on them (e.g. the logo and its
+    dominant color) is prepared up front. Fonts and overlays are cached between
+    titlers, so a long-lived titler only pays for the resize and composite of each image.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Sets up a titler. A title option titles every image. Otherwise, titles
+        are given per image or derived from file names.
+
+        :param kwargs: a set of options (see parse_input for options)
+        """
+        self.options = kwargs.copy()
+        self.options[KEY_SIZE] = kwargs.get(KEY_SIZE) or DEFAULT_SIZE
+        self.options[KEY_FONT] = kwargs.get(KEY_FONT) or DEFAULT_FONT
+        self.options[KEY_RESAMPLE] = kwargs.get(KEY_RESAMPLE) or DEFAULT_RESAMPLE
+        self.logo = None
+        if logo_path := kwargs.get(KEY_LOGO_PATH):
+            with Image.open(logo_path) as logo:
+                self.spec = _get_render_spec(_get_best_top_color(logo), **self.options)
+                logo.thumbnail(_get_logo_size(self.spec), *_retrieve_resample_from_options(**self.options))
+                self.logo = logo
+        else:
+            self.spec = _get_render_spec(**self.options)
+
+    def render(
+            self,
+            image,
+            title: Optional[str] = None,
+            image_format: Optional[str] = None,
+            name: Optional[str] = None
+    ):
+        """
+        Titles a single image. The input image is never modified, and images
+        which aren't given by path are processed without touching the disk.
+
+        :param image: the path of an image, its encoded bytes, a file-like object, or an opened image
+        :param title: the title (defaults to the title option, then to the name or file name of the image)
+        :param image_format: a key of FORMAT_MAP to get the encoded image (see encode_copy)
+        :param name: the file name of the image (e.g. of an upload) for images which aren't given by path
+        :return: the edited image (or a read-only view of its bytes if a format is given)
+        """
+        img = _open_image(image)
+        filename = name or getattr(img, "filename", None)
+        if not (title := title or self.options.get(KEY_TITLE)) and name:
+            title = _convert_name_to_title(name)
+        elif not title:
+            title = _convert_file_name_to_title(path=filename)
+        size_key = self.options[KEY_SIZE]
+        if getattr(img, "is_animated", False):
+            with timed(RENDER_SECONDS, stage="animation", size=size_key):
+                edited_image = self._render_animation(img, title)
+        else:
+            with timed(RENDER_SECONDS, stage="resize", size=size_key):
+                edited_image = _get_base_image(img, **self.options)
+            with timed(RENDER_SECONDS, stage="overlay", size=size_key):
+                if self.logo:
+                    _draw_logo(edited_image, self.logo, self.spec)
+                edited_image = _draw_overlay(edited_image, title, self.spec)
+        increment(IMAGES, size=size_key)
+        if filename:
+            edited_image.filename = filename  # Ensures filename data is transferred to updated copy
+        if image_format:
+            return memoryview(encode_copy(edited_image, image_format, **self.options))
+        return edited_image
+
+    def _render_animation(self, img: Image.Image, title: Optional[str]) -> Image.Image:
+        """
+        Titles an animated image. The logo and overlay are combined into a single layer
+        up front, so each frame only costs a resize and a composite. The first frame is
+        titled right away, and the rest are titled lazily as they are encoded (see
+        _AnimationFrames), so they are available from the frames attribute of the result.
+
+        :param img: an animated image
+        :param title: the title
+        :return: the titled first frame
+        """
+        layer = Image.new("RGBA", self.spec.size, TRANSPARENT)
+        if self.logo:
+            logo_size = _get_logo_size(self.spec)
+            position = (self.spec.logo_padding, self.spec.size[1] - logo_size[1] - self.spec.logo_padding)
+            layer.alpha_composite(self.logo.convert("RGBA"), position)
+        if title:
+            layer.alpha_composite(_render_overlay(title, self.spec))
+        frames = _AnimationFrames(img, layer, threading.Lock(), **self.options)
+        edited_image = _render_frame(img, 0, layer, frames.lock, **self.options)
+        edited_image.frames = frames
+        return edited_image
+
+    def render_many(self, images: Iterable, image_format: Optional[str] = None) -> Iterator:
+        """
+        Titles several images lazily, one at a time.
+
+        :param images: an iterable of images (see render) or (image, title) pairs
+        :param image_format: a key of FORMAT_MAP to get the encoded images (see encode_copy)
+        :return: an iterator of edited images (or views of their bytes if a format is given)
+        """
+        for image in images:
+            image, title = image if isinstance(image, tuple) else (image, None)
+            yield self.render(image, title, image_format)
+
+
+class _AnimationFrames:
+    """
+    The frames of a titled animation after the first. Encoders seek through these
+    frames like they would through an animated image (see ImageSequence), and each
+    frame is titled as it is sought, so frames are streamed rather than held. To
+    encode the frames again (e.g. in another format), use a fresh cursor (see rewind).
+    """
+
+    def __init__(self, source: Image.Image, layer: Image.Image, lock: threading.Lock, **kwargs):
+        """
+        Sets up the frames of a titled animation.
+
+        :param source: the animated image
+        :param layer: the RGBA layer composited onto every frame
+        :param lock: a lock which guards seeking the animated image
+        :param kwargs: a set of options
+        """
+        self.source = source
+        self.layer = layer
+        self.lock = lock
+        self.options = kwargs
+        self.n_frames = source.n_frames - 1
+        self.loop = source.info.get("loop")
+        self._durations = None
+        self._frame = None
+        self._index = 0
+
+    @property
+    def durations(self) -> List[int]:
+        """
+        Collects the duration of every frame (the first included) in milliseconds.
+        Only frame headers are read, except for WebP, which only reads frame timing
+        as each frame is decoded (one at a time).
+
+        :return: a list of durations
+        """
+        if self._durations is None:
+            durations = list()
+            with self.lock:
+                for index in range(self.source.n_frames):
+                    self.source.seek(index)
+                    if self.source.format == "WEBP":
+                        self.source.load()
+                    durations.append(self.source.info.get("duration", 0))
+            self._durations = durations
+        return self._durations
+
+    def rewind(self) -> "_AnimationFrames":
+        """
+        Creates an independent cursor over the same frames.
+
+        :return: the frames
+        """
+        frames = _AnimationFrames(self.source, self.layer, self.lock, **self.options)
+        frames._durations = self._durations
+        return frames
+
+    def seek(self, index: int) -> None:
+        """
+        Titles a frame and makes it the current frame.
+
+        :param index: the index of the frame (after the first)
+        :return: None
+        """
+        if not 0 <= index < self.n_frames:
+            raise EOFError("no more frames")
+        self._frame = _render_frame(self.source, index + 1, self.layer, self.lock, **self.options)
+        self._index = index
+
+    def tell(self) -> int:
+        """
+        Gets the index of the current frame.
+
+        :return: the index of the current frame
+        """
+        return self._index
+
+    def __getattr__(self, name: str):
+        """
+        Forwards everything else (e.g. mode, size, load, and tobytes) to the current frame.
+
+        :param name: the name of an attribute
+        :return: the attribute of the current frame
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._frame, name)
+
+
+def _render_frame(source: Image.Image, index: int, layer: Image.Image, lock: threading.Lock, **kwargs) -> Image.Image:
+    """
+    Titles a single frame of an animated image.
+
+    :param source: the animated image
+    :param index: the index of the frame
+    :param layer: the RGBA layer composited onto the frame
+    :param lock: a lock which guards seeking the animated image
+    :param kwargs: a set of options
+    :return: the titled frame
+    """
+    with lock:
+        source.seek(index)
+        frame = source.convert("RGBA")
+    frame = _resize_image(frame, **kwargs)
+    frame.alpha_composite(layer)
+    return frame
 
 
-def _process_batch(**kwargs) -> List[Image.Image]:
+def _open_image(image) -> Image.Image:
     """
-    Processes a batch of images.
+    Opens an image from any of the inputs a Titler accepts. Only paths are read from disk.
 
-    :pre: kwargs.get(KEY_PATH) != None
-    :return: None
+    :param image: the path of an image, its encoded bytes, a file-like object, or an opened image
+    :return: an opened image
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    elif not isinstance(image, (str, os.PathLike)) and not hasattr(image, "read"):
+        raise TypeError(f"cannot title an image from {type(image).__name__}")
+    return Image.open(image)
+
+
+def _list_batch_paths(input_path: str) -> List[str]:
+    """
+    Lists the files of a batch in a stable (sorted) order.
+
+    :param input_path: the folder of the batch
+    :return: a list of file paths
+    """
+    return sorted(os.path.join(input_path, path) for path in os.listdir(input_path))
+
+
+def _list_batch_inputs(**kwargs) -> Iterator[tuple]:
+    """
+    Lists the inputs of a batch along with their indices in the whole batch.
+    If a shard is given as an (index, count) pair, only the inputs which
+    belong to that shard are listed. Indices stay global, so outputs of
+    different shards never collide.
+
+    :param kwargs: a set of options
+    :return: an iterator of (index, input path) pairs
     """
-    edited_images = list()
     input_path = kwargs.get(KEY_PATH)
-    for path in os.listdir(input_path):
-        absolute_path = os.path.join(input_path, path)
-        image_kwargs = kwargs.copy()
-        image_kwargs[KEY_PATH] = absolute_path
-        image_kwargs[KEY_TITLE] = kwargs.get(KEY_TITLE) if kwargs.get(KEY_TITLE) else _convert_file_name_to_title(**image_kwargs)
-        edited_image = _process_image(**image_kwargs)
-        edited_images.append(edited_image)
-    return edited_images
-
-
-def _process_image(**kwargs) -> Image.Image:
-    """
-    Processes a single image.
-
-    :pre: kwargs.get(KEY_PATH) != None and kwargs.get(KEY_TITLE) != None
-    :return: the edited image or None
-    """
-    input_path = kwargs.get(KEY_PATH)  # TODO: might be able to speed things up by caching this
-    img: Image.Image = Image.open(input_path)
-    cropped_img: Image.Image = _resize_image(img, **kwargs)
-    if hasattr(img, "filename"):
-        cropped_img.filename = img.filename  # Ensures filename data is transferred to updated copy
-    color = RECTANGLE_FILL
-    if logo_path := kwargs.get(KEY_LOGO_PATH):
-        logo: Image.Image = Image.open(logo_path)
-        color = _get_best_top_color(logo)
-        _draw_logo(cropped_img, logo, **kwargs)
-    edited_image = _draw_overlay(
-        cropped_img,
-        color,
-        **kwargs
-    )
-    return edited_image
+    shard = kwargs.get(KEY_SHARD)
+    for index, absolute_path in enumerate(_list_batch_paths(input_path)):
+        if not shard or _get_shard(os.path.relpath(absolute_path, input_path), shard[1]) == shard[0]:
+            yield index, absolute_path
+
+
+def _get_shard(relative_path: str, count: int) -> int:
+    """
+    Assigns an input to a shard based on a hash of its path relative to the
+    batch folder, so every node assigns every input to the same shard.
+
+    :param relative_path: the path of the input relative to the batch folder
+    :param count: the number of shards
+    :return: the index of the shard
+    """
+    digest = hashlib.blake2b(relative_path.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def _get_base_image(img: Image.Image, **kwargs) -> Image.Image:
+    """
+    A helper function which retrieves the resized image to draw on. If a cache
+    path is set, the resized image is loaded from the cache without decoding
+    the original image (only its header is read). Otherwise, the image is
+    resized and stored in the cache for future runs.
+
+    :param img: an opened image
+    :param kwargs: a set of options
+    :return: a resized image
+    """
+    cache_path = kwargs.get(KEY_CACHE_PATH)
+    size_key = kwargs.get(KEY_SIZE) or DEFAULT_SIZE
+    resample_key = kwargs.get(KEY_RESAMPLE) or DEFAULT_RESAMPLE
+    cache_path = cache_path if getattr(img, "filename", None) else None  # only files can be cached
+    if cache_path:
+        cached_img = load_base_image(img.filename, size_key, resample_key, cache_path)
+        increment(CACHE_REQUESTS, cache="base_image", result="hit" if cached_img else "miss")
+        if cached_img:
+            cached_img.info.update(img.info)
+            return cached_img
+    cropped_img = _resize_image(img, **kwargs)
+    if cache_path:
+        store_base_image(cropped_img, img.filename, size_key, resample_key, cache_path)
+    return cropped_img
 
 
 def _resize_image(img: Image.Image, **kwargs) -> Image.Image:
@@ -90,14 +390,23 @@ def _resize_image(img: Image.Image, **kwargs) -> Image.Image:
     by its width. Then, any excess height is cropped until the desired aspect
     ratio is achieved. See "size" option for more details.
 
+    Both steps happen in a single resample: only the part of the image which
+    survives the crop is resampled, and the original image is left untouched.
+    Images are never enlarged, so small images are padded instead.
+
     :param img: an image to be resized
     :param kwargs: a set of options
     :return: a resized image
     """
-    size = _retrieve_size_from_options(**kwargs)
-    img.thumbnail((size[0], img.size[1]))
-    cropped_img: Image = img.crop((0, 0, size[0], size[1]))
-    return cropped_img
+    width, height = _retrieve_size_from_options(**kwargs)
+    resample, reducing_gap = _retrieve_resample_from_options(**kwargs)
+    scale = min(width / img.width, 1)
+    box = (0, 0, img.width, min(img.height, height / scale))
+    resized_size = (min(width, img.width), min(height, round(box[3] * scale)))
+    resized_img = img.resize(resized_size, resample, box=box, reducing_gap=reducing_gap)
+    if resized_img.size != (width, height):
+        resized_img = resized_img.crop((0, 0, width, height))
+    return resized_img
 
 
 def _retrieve_size_from_options(**kwargs) -> tuple:
@@ -113,6 +422,16 @@ def _retrieve_size_from_options(**kwargs) -> tuple:
     return size
 
 
+def _retrieve_resample_from_options(**kwargs) -> tuple:
+    """
+    A helper function for retrieving a resampling filter and reducing gap from the RESAMPLE_MAP.
+
+    :param kwargs: a set of options
+    :return: a (filter, reducing gap) tuple
+    """
+    return RESAMPLE_MAP.get(kwargs.get(KEY_RESAMPLE) or DEFAULT_RESAMPLE)
+
+
 def _convert_file_name_to_title(**kwargs) -> Optional[str]:
     """
     A helper method which converts file names into titles. If the necessary arguments aren't supplied,
@@ -123,54 +442,71 @@ def _convert_file_name_to_title(**kwargs) -> Optional[str]:
     title: Optional[str] = kwargs.get(KEY_TITLE)
     path: Optional[str] = kwargs.get(KEY_PATH)
     if not title and path:
-        file_path = Path(path).resolve().stem
-        title = titlecase(file_path.replace(kwargs.get("separator", SEPARATOR), ' '))
+        title = _convert_name_to_title(Path(path).resolve().name, kwargs.get("separator", SEPARATOR))
     return title
 
 
-def _get_bar_height(**kwargs) -> int:
+def _convert_name_to_title(name: str, separator: str = SEPARATOR) -> str:
+    """
+    A helper method which converts a file name (e.g. of an upload) into a title.
+
+    :param name: a file name (e.g. hello-world.jpg)
+    :param separator: the separator of the words in the file name
+    :return: a title string (e.g. Hello World)
     """
-    A helper function which retrieves the bar height based on the size of the image.
+    return titlecase(Path(name).stem.replace(separator, ' '))
 
+
+def _get_render_spec(color: tuple = RECTANGLE_FILL, **kwargs) -> RenderSpec:
+    """
+    A helper function which computes the layout settings of a render from a set of options.
+
+    :param color: the color of the overlay bars
     :param kwargs: a set of options
-    :return: the bar height in pixels
+    :return: a render spec
     """
     image_size = _retrieve_size_from_options(**kwargs)
-    return image_size[1] // 7
+    return RenderSpec(
+        size=image_size,
+        bar_height=image_size[1] // 7,
+        top_y=TOP_RECTANGLE_Y,
+        x_offset=X_OFFSET,
+        logo_padding=LOGO_PADDING,
+        tier_color=TIER_MAP.get(kwargs.get(KEY_TIER), None),
+        bar_color=color,
+        font=kwargs.get(KEY_FONT) or DEFAULT_FONT
+    )
 
 
-def _draw_rectangle(
-        draw: ImageDraw,
-        position: int,
-        width: int,
-        color: tuple = RECTANGLE_FILL,
-        **kwargs
-):
+def _draw_rectangle(draw: ImageDraw, position: int, width: int, spec: RenderSpec):
     """
     Draws a rectangle over the image given a ImageDraw object and the intended
-    position, width, and tier.
+    position, width, and render spec.
 
-    :param color: the color of the overlay bar
     :param draw: an picture we're editing
     :param position: the position of the rectangle to be added
     :param width: the width of the rectangle to be added
+    :param spec: the render spec
     :return: nothing
     """
-    image_width = _retrieve_size_from_options(**kwargs)[0]
+    image_width = spec.size[0]
     draw.rectangle(
         (
-            (image_width - width - X_OFFSET * 2, position),
-            (image_width, position + _get_bar_height(**kwargs))
+            (image_width - width - spec.x_offset * 2, position),
+            (image_width, position + spec.bar_height)
         ),
-        fill=color,
-        outline=TIER_MAP.get(kwargs.get(KEY_TIER), None),
+        fill=spec.bar_color,
+        outline=spec.tier_color,
         width=4
     )
 
 
 def _draw_text(draw: ImageDraw, position: tuple, text: str, font: ImageFont):
     """
-    Draws text on the image.
+    Draws text on the image. With basic layout, the text is assembled from
+    cached glyphs (see _get_glyph_layout), which renders exactly like
+    ImageDraw.text without rasterizing every glyph of every title again.
+    Other layouts (e.g. Raqm, which shapes text) fall back to ImageDraw.text.
 
     :param draw: the picture to edit
     :param position: the position of the text as an (x, y) tuple
@@ -178,15 +514,33 @@ def _draw_text(draw: ImageDraw, position: tuple, text: str, font: ImageFont):
     :param font: the font of the text
     :return: nothing
     """
-    draw.text(
-        position,
-        text,
-        fill=TEXT_FILL,
-        font=font
-    )
-
-
-def _get_text_position(text_width, text_height, text_ascent, y_offset, **kwargs) -> tuple:
+    if font.layout_engine != BASIC_LAYOUT or not text:
+        draw.text(
+            position,
+            text,
+            fill=TEXT_FILL,
+            font=font
+        )
+        return
+    # Like ImageDraw.text, the fraction of the position shifts the pen (in 1/64 pixels)
+    x, y = int(position[0]), int(position[1])
+    start_x, start_y = round(math.modf(position[0])[0] * 64), round(math.modf(position[1])[0] * 64)
+    y -= (32 - start_y) >> 6
+    glyphs = [
+        (mask, x + ((start_x + pen + 32) >> 6) + offset[0], y + offset[1])
+        for mask, pen, offset in _get_glyph_layout(text, font)
+    ]
+    left, top = min(glyph[1] for glyph in glyphs), min(glyph[2] for glyph in glyphs)
+    right = max(glyph_x + mask.width for mask, glyph_x, _ in glyphs)
+    bottom = max(glyph_y + mask.height for mask, _, glyph_y in glyphs)
+    text_mask = Image.new("L", (right - left, bottom - top), 0)
+    for mask, glyph_x, glyph_y in glyphs:
+        box = (glyph_x - left, glyph_y - top, glyph_x - left + mask.width, glyph_y - top + mask.height)
+        text_mask.paste(ImageChops.lighter(text_mask.crop(box), mask), box)  # glyphs may overlap
+    draw.bitmap((left, top), text_mask, fill=TEXT_FILL)
+
+
+def _get_text_position(text_width, text_height, text_ascent, y_offset, spec: RenderSpec) -> tuple:
     """
     A helper function which places the text safely within the title block.
 
@@ -196,12 +550,12 @@ def _get_text_position(text_width, text_height, text_ascent, y_offset, **kwargs)
     :param text_height: the height of the text without the ascent
     :param text_ascent: the height of the ascent
     :param y_offset: the y location of the title block
+    :param spec: the render spec
     :return: a tuple containing the x, y pixel coordinates of the text
     """
-    image_width = _retrieve_size_from_options(**kwargs)[0]
     return (
-        image_width - text_width - X_OFFSET,
-        y_offset - text_ascent + (_get_bar_height(**kwargs) - text_height) / 2
+        spec.size[0] - text_width - spec.x_offset,
+        y_offset - text_ascent + (spec.bar_height - text_height) / 2
     )
 
 
@@ -214,102 +568,300 @@ def _get_text_metrics(text: str, font: ImageFont):
     :return: a tuple consisting of four sections of the text (top offset, text, bottom offset)
     """
     ascent, descent = font.getmetrics()
-    (width, _), (_, offset_y) = font.font.getsize(text)
+    if font.layout_engine != BASIC_LAYOUT or not text:
+        (width, _), (_, offset_y) = font.font.getsize(text)
+        return width, offset_y, ascent - offset_y, descent
+    glyphs = [(mask, ((pen + 32) >> 6) + offset[0], offset[1]) for mask, pen, offset in _get_glyph_layout(text, font)]
+    width = max(glyph_x + mask.width for mask, glyph_x, _ in glyphs) - min(glyph[1] for glyph in glyphs)
+    offset_y = min(glyph[2] for glyph in glyphs)
     return width, offset_y, ascent - offset_y, descent
 
 
-def _get_appropriate_font_size(**kwargs) -> ImageFont:
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _get_appropriate_font_size(title: str, spec: RenderSpec) -> ImageFont:
     """
-    A helper function which computes the font size given a set of options.
+    A helper function which computes the font size of a title.
+    This is the smallest font size whose rendered title is at least as tall
+    as the bar (minus some padding). Text height grows with font size, so
+    the size is found with a binary search over cached glyph heights.
 
-    :param kwargs: a set of options
+    :param title: the title
+    :param spec: the render spec
     :return: a font of the appropriate size
     """
-    bar_height = _get_bar_height(**kwargs)
-    font = kwargs.get(KEY_FONT, DEFAULT_FONT)
-    font = font if font else DEFAULT_FONT
-    title = kwargs.get(KEY_TITLE)
-    font_size = 12
-    while ImageFont.truetype(font, font_size).getsize(title)[1] < bar_height - 10:
-        font_size += 1
+    chars = set(title)
+    target_height = spec.bar_height - 10
+    low, high = MIN_FONT_SIZE, max(MIN_FONT_SIZE, spec.bar_height)
+    while _get_text_height(spec.font, high, chars) < target_height:
+        low, high = high + 1, high * 2
+    while low < high:
+        font_size = (low + high) // 2
+        if _get_text_height(spec.font, font_size, chars) < target_height:
+            low = font_size + 1
+        else:
+            high = font_size
+    return _load_font(spec.font, low)
+
+
+def _get_text_height(font: str, font_size: int, chars: Iterable[str]) -> int:
+    """
+    Computes the height of some text (including the offset from the top of
+    the line). The height of a line is set by its tallest glyph, so it only
+    depends on which characters appear in the text.
+
+    :param font: the path to a font file
+    :param font_size: the size of the font
+    :param chars: the characters of the text to measure
+    :return: the height of the text in pixels
+    """
+    return max(_get_glyph_bottom(font, font_size, char) for char in chars)
+
+
+@functools.lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def _get_glyph_bottom(font: str, font_size: int, char: str) -> int:
+    """
+    Measures how far a single glyph reaches below the top of the line.
+
+    :param font: the path to a font file
+    :param font_size: the size of the font
+    :param char: the character to measure
+    :return: the bottom of the glyph in pixels
+    """
+    return _load_font(font, font_size).getbbox(char)[3]
+
+
+def _get_glyph_layout(text: str, font: ImageFont.FreeTypeFont) -> List[tuple]:
+    """
+    Lays out a line of text from cached glyphs the way FreeType's basic layout
+    does (see _get_advance_prefix_sums). Pen positions are kept in 1/64 pixels
+    and rounded per glyph, so glyphs land on exactly the same pixels as they
+    would in ImageDraw.text.
+
+    :param text: the text to lay out
+    :param font: the font of the text
+    :return: a list of (glyph mask, pen position, glyph offset) tuples
+    """
+    pens = _get_advance_prefix_sums(text, font)
+    return [
+        (mask, pen, offset)
+        for (mask, offset, _), pen in zip((_get_glyph(font.path, font.size, char) for char in text), pens)
+    ]
+
+
+def _get_advance_prefix_sums(text: str, font: ImageFont.FreeTypeFont) -> List[int]:
+    """
+    Computes the pen position of every character of some text: the sum of the
+    advances before it, adjusted by the kerning of each pair of characters.
+    Advances and kerning come from the glyph cache, so this is cheap, and the
+    advance width of any slice of the text is a single subtraction.
+
+    :param text: the text
+    :param font: the font of the text
+    :return: a list of pen positions in 1/64 pixels (plus the end of the text)
+    """
+    font_path, font_size = font.path, font.size
+    pens, pen, previous = [], 0, None
+    for char in text:
+        if previous is not None:
+            pen += _get_kerning(font_path, font_size, previous + char)
+        pens.append(pen)
+        pen += _get_glyph(font_path, font_size, char)[2]
+        previous = char
+    pens.append(pen)
+    return pens
+
+
+@functools.lru_cache(maxsize=GLYPH_MASK_CACHE_SIZE)
+def _get_glyph(font: str, font_size: int, char: str) -> tuple:
+    """
+    Rasterizes a single glyph. Glyphs are cached, so a batch of distinct
+    titles only rasterizes each character once per font size.
+
+    Note: the returned mask is shared between calls, so it must never be modified.
+
+    :param font: the path to a font file
+    :param font_size: the size of the font
+    :param char: the character to rasterize
+    :return: a tuple of the glyph mask, its offset from the pen, and its advance in 1/64 pixels
+    """
+    loaded_font = _load_font(font, font_size)
+    size, offset = loaded_font.font.getsize(char)
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).text((-offset[0], -offset[1]), char, fill=255, font=loaded_font)
+    return mask, offset, round(loaded_font.getlength(char) * 64)
+
+
+@functools.lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def _get_kerning(font: str, font_size: int, pair: str) -> int:
+    """
+    Measures the kerning of a pair of characters: how much closer (or further)
+    the second glyph sits than the advance of the first alone would place it.
+
+    :param font: the path to a font file
+    :param font_size: the size of the font
+    :param pair: the two characters
+    :return: the kerning in 1/64 pixels (zero for most pairs)
+    """
+    loaded_font = _load_font(font, font_size)
+    return round(loaded_font.getlength(pair) * 64) - sum(_get_glyph(font, font_size, char)[2] for char in pair)
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def _load_font(font: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """
+    Loads a font at a given size. Fonts are cached, since the same
+    handful of sizes are loaded over and over again.
+
+    :param font: the path to a font file
+    :param font_size: the size of the font
+    :return: the font
+    """
     return ImageFont.truetype(font, font_size)
 
 
-def _draw_overlay(image: Image.Image, color: tuple, **kwargs) -> Image:
+def _draw_overlay(image: Image.Image, title: Optional[str], spec: RenderSpec) -> Image:
     """
-    Draws text over an image.
+    Draws text over an image. The overlay itself is rendered once per title
+    and render spec (see _render_overlay) and composited onto the image.
 
     :param image: an image
+    :param title: the title to draw (nothing is drawn without one)
+    :param spec: the render spec
     :return: the updated image
     """
-    draw = ImageDraw.Draw(image)
-    font = _get_appropriate_font_size(**kwargs)
-
-    if title := kwargs.get(KEY_TITLE):
-        # Detect space (precondition for split)
-        if len(title.split()) > 1:
-            top_half_text, bottom_half_text = _split_string_by_nearest_middle_space(title)
+    if title:
+        overlay = _render_overlay(title, spec)
+        if image.mode == "RGBA":
+            image.alpha_composite(overlay)
         else:
-            top_half_text, bottom_half_text = title, None
+            image.paste(overlay, (0, 0), overlay)
+    return image
 
-        # Draw top
-        width, top_offset, height, _ = _get_text_metrics(top_half_text, font)
-        top_position = _get_text_position(width, height, top_offset, TOP_RECTANGLE_Y, **kwargs)
-        _draw_rectangle(draw, TOP_RECTANGLE_Y, width, color, **kwargs)
-        _draw_text(draw, top_position, top_half_text, font)
 
-        bottom_rectangle_y = TOP_RECTANGLE_Y + _get_bar_height(**kwargs) + TOP_RECTANGLE_Y
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def _render_overlay(title: str, spec: RenderSpec) -> Image.Image:
+    """
+    Renders the title bars and text onto a transparent layer the size of the output image.
+    Layers are cached, so a batch sharing one title only pays for a single render.
 
-        # Draw bottom
-        if bottom_half_text:
-            width, top_offset, height, _ = _get_text_metrics(bottom_half_text, font)
-            bottom_position = _get_text_position(width, height, top_offset, bottom_rectangle_y, **kwargs)
-            _draw_rectangle(draw, bottom_rectangle_y, width, color, **kwargs)
-            _draw_text(draw, bottom_position, bottom_half_text, font)
+    Note: the returned layer is shared between calls, so it must never be modified.
+    Layers are rendered one at a time, so titlers can be shared by threads.
 
-    return image
+    :param title: the title to draw
+    :param spec: the render spec
+    :return: an RGBA layer containing the overlay
+    """
+    with FONT_LOCK:  # fonts are shared between threads, but FreeType faces are not thread-safe
+        overlay = Image.new("RGBA", spec.size, TRANSPARENT)
+        draw = ImageDraw.Draw(overlay)
+        font, lines = _layout_title(title, spec)
+        for index, line in enumerate(lines):
+            rectangle_y = spec.top_y + index * (spec.bar_height + spec.top_y)
+            width, top_offset, height, _ = _get_text_metrics(line, font)
+            position = _get_text_position(width, height, top_offset, rectangle_y, spec)
+            _draw_rectangle(draw, rectangle_y, width, spec)
+            _draw_text(draw, position, line, font)
+
+        return overlay
 
 
-def _get_logo_size(**kwargs) -> tuple:
+def _get_logo_size(spec: RenderSpec) -> tuple:
     """
     A helper function that retrieves the size of the logo based on the size of the bars.
 
-    :param kwargs: a set of options
+    :param spec: the render spec
     :return: a logo size tuple
     """
-    bar_height = _get_bar_height(**kwargs)
-    return bar_height, bar_height
+    return spec.bar_height, spec.bar_height
 
 
-def _draw_logo(img: Image.Image, logo: Image.Image, **kwargs):
+def _draw_logo(img: Image.Image, logo: Image.Image, spec: RenderSpec):
     """
-    Adds a logo to the image if a path is provided.
+    Adds a logo to the image. The logo must already fit within the logo size.
 
     :param img: an image to be modified
-    :param logo: the logo file to be added
+    :param logo: the logo to be added
+    :param spec: the render spec
     :return: nothing
     """
-    logo_size = _get_logo_size(**kwargs)
-    logo.thumbnail(logo_size)
+    logo_size = _get_logo_size(spec)
     _, height = img.size
-    img.paste(logo, (LOGO_PADDING, height - logo_size[1] - LOGO_PADDING), logo)
+    img.paste(logo, (spec.logo_padding, height - logo_size[1] - spec.logo_padding), logo)
+
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _layout_title(title: str, spec: RenderSpec) -> tuple:
+    """
+    Lays out a title: picks its font and breaks it into the lines of the bars.
+    Titles with spaces are broken into two lines of balanced width. If the
+    widest line would still run off the image, the title is broken into more
+    lines (as many as fit above the logo), and if that isn't enough either,
+    the font shrinks until the title fits. Text never overflows the image.
+
+    :param title: the title
+    :param spec: the render spec
+    :return: a tuple of the font and the lines of the title
+    """
+    max_width = spec.size[0] - spec.x_offset * 2
+    word_count = len(title.split())
+    line_counts = range(2, max(2, min(word_count, _get_max_lines(spec))) + 1) if word_count > 1 else [1]
+    with FONT_LOCK:
+        font = _get_appropriate_font_size(title, spec)
+        while True:
+            for line_count in line_counts:
+                lines = _break_lines(title, font, line_count)
+                width = max(_get_text_metrics(line, font)[0] for line in lines)
+                if width <= max_width:
+                    return font, lines
+            if font.size == 1:
+                return font, lines
+            font = _load_font(spec.font, max(1, min(font.size - 1, font.size * max_width // width)))
 
 
-def _split_string_by_nearest_middle_space(input_string: str) -> tuple:
+def _get_max_lines(spec: RenderSpec) -> int:
     """
-    Splits a string by the nearest middle space. Assumes space is in string.
+    Computes how many bars fit between the top of the image and the logo.
 
-    :param input_string: some string
-    :return: a pair of strings
+    :param spec: the render spec
+    :return: the maximum number of lines of a title (at least two)
     """
-    index = len(input_string) // 2
-    curr_char = input_string[index]
-    count = 1
-    while not curr_char.isspace():
-        index += (-1) ** (count + 1) * count  # thanks wolfram alpha (1, -2, 3, -4, ...)
-        curr_char = input_string[index]
-        count += 1
-    return input_string[:index], input_string[index + 1:]
+    available_height = spec.size[1] - _get_logo_size(spec)[1] - spec.logo_padding * 2
+    return max(2, available_height // (spec.bar_height + spec.top_y))
+
+
+def _break_lines(text: str, font: ImageFont.FreeTypeFont, line_count: int) -> tuple:
+    """
+    Breaks text into lines at spaces, so that its widest line is as narrow
+    as possible. The width of any run of words is a subtraction of advance
+    prefix sums (see _get_advance_prefix_sums), and the best breaks are found
+    with dynamic programming, so no candidate line is ever rendered or measured.
+
+    :param text: the text to break
+    :param font: the font of the text
+    :param line_count: the number of lines (fewer if the text has fewer words)
+    :return: a tuple of lines
+    """
+    words = [(match.start(), match.end()) for match in re.finditer(r"\S+", text)]
+    if not words:
+        return text,
+    pens = _get_advance_prefix_sums(text, font)
+    line_count = min(line_count, len(words))
+    # widest[lines][end] is the narrowest widest line of the first end words broken into lines
+    widest = [[math.inf] * (len(words) + 1) for _ in range(line_count + 1)]
+    breaks = [[0] * (len(words) + 1) for _ in range(line_count + 1)]
+    widest[0][0] = 0
+    for lines in range(1, line_count + 1):
+        for end in range(lines, len(words) + 1):
+            for start in range(lines - 1, end):
+                width = max(widest[lines - 1][start], pens[words[end - 1][1]] - pens[words[start][0]])
+                if width < widest[lines][end]:
+                    widest[lines][end], breaks[lines][end] = width, start
+    result, end = list(), len(words)
+    for lines in range(line_count, 0, -1):
+        start = breaks[lines][end]
+        result.insert(0, text[words[start][0]:words[end - 1][1]])
+        end = start
+    return tuple(result)
 
 
 def _get_best_top_color(image: Image.Image) -> tuple:
@@ -324,3 +876,8 @@ def _get_best_top_color(image: Image.Image) -> tuple:
     while (color := next(curr_color)[1]) == WHITE:
         pass
     return color
+
+
+register_cache("overlay", _render_overlay)
+register_cache("layout", _layout_title)
+register_cache("glyph", _get_glyph)
@@ -2,20 +2,24 @@
 The GUI interface for the image-titler script.
 """
 
+import queue
+import threading
+import time
 import tkinter as tk
 import tkinter.ttk as ttk
 from pathlib import Path
 from tkinter import filedialog
-from typing import Optional, List
+from typing import Callable, Dict, Iterable, Optional, List
 
 import pkg_resources
 from PIL import ImageTk, Image
 from matplotlib import font_manager
 
+from imagetitler.cache import evict_thumbnails, load_thumbnail, store_thumbnail
 from imagetitler.constants import *
-from imagetitler.draw import process_images
+from imagetitler.draw import Titler, _list_batch_paths
 from imagetitler.parse import parse_input
-from imagetitler.store import save_copies
+from imagetitler.store import save_copy
 
 FONTS = {
     f"{f.name} ({f.style}, {f.variant}, {f.weight}, {f.stretch})": f.fname
@@ -32,6 +36,15 @@ LOGO_OPTION_LABEL = "Logo:"
 
 COLUMN_WIDTH = 8
 
+THUMBNAIL_SIZE = (96, 96)
+GALLERY_PADDING = 4
+GALLERY_CELL_WIDTH = THUMBNAIL_SIZE[0] + GALLERY_PADDING * 2
+GALLERY_CELL_HEIGHT = THUMBNAIL_SIZE[1] + GALLERY_PADDING * 2
+GALLERY_POLL_MS = 50
+GALLERY_SCROLL_UNITS = 2
+SELECTED_OUTLINE = "#c90229"
+SAVE_POLL_MS = 100
+
 
 class ImageTitlerMain(tk.Tk):
     """
@@ -42,9 +55,14 @@ class ImageTitlerMain(tk.Tk):
     def __init__(self, options):
         super().__init__()
         self.options = options
+        self.save_cancel = threading.Event()
+        self.save_updates: queue.SimpleQueue = queue.SimpleQueue()
+        self.save_worker: Optional[threading.Thread] = None
         self.menu = ImageTitlerMenuBar(self, self.options)
         self.gui = ImageTitlerGUI(self, self.menu, self.options)
+        self.save_bar = ImageTitlerSaveBar(self, self.save_cancel.set)
         self.gui.pack(anchor=tk.W)
+        self.save_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
 
     def update_view(self) -> None:
         """
@@ -54,6 +72,14 @@ class ImageTitlerMain(tk.Tk):
         """
         self.gui.update_view()
 
+    def is_saving(self) -> bool:
+        """
+        Checks whether a save is running in the background.
+
+        :return: True if a save is running
+        """
+        return self.save_worker is not None
+
     def save_as(self) -> None:
         """
         A save method which saves our preview. This has to exist because the menu
@@ -61,12 +87,123 @@ class ImageTitlerMain(tk.Tk):
         into main window. That way, we at least decouple the child to parent
         relationship (i.e. children have to concept of siblings, etc.).
 
+        In batch mode, the preview only holds the selected image, so the batch
+        is streamed instead: each image is rendered and saved before the next.
+
+        Saving runs on a background thread with a snapshot of the options, so the
+        window stays responsive and the preview stays editable while it runs.
+        Progress is reported in the save bar, which can also cancel the save.
+
         :return: None
         """
-        save_copies(
-            self.menu.current_edit,
-            **self.options
-        )
+        options = self.options.copy()
+        if options.get(KEY_BATCH):
+            titler, title = self.gui.get_titler(), options.get(KEY_TITLE)  # the cached titler has no title
+            items, render = list(enumerate(self.gui.batch_paths)), lambda path: titler.render(path, title)
+        else:
+            items, render = [(0, self.menu.current_edit[0])], lambda edited_image: edited_image
+        self.save_cancel.clear()
+        self.save_bar.start(len(items))
+        self.save_worker = threading.Thread(target=self._save_all, args=(items, render, options), daemon=True)
+        self.save_worker.start()
+        self.after(SAVE_POLL_MS, self._poll_save)
+
+    def _save_all(self, items: Iterable[tuple], render: Callable, options: dict) -> None:
+        """
+        Saves images one at a time on the background thread. Cancelling stops between
+        images, so every image is either saved in every format or not at all (each
+        file is written atomically). Like a journaled batch, failures are counted
+        rather than stopping the save.
+
+        :param items: (index, item) pairs where items are rendered into edited images
+        :param render: the function which renders an item
+        :param options: the snapshot of the options
+        :return: None
+        """
+        start = time.perf_counter()
+        saved, failed = 0, 0
+        for index, item in items:
+            if self.save_cancel.is_set():
+                break
+            try:
+                save_copy(render(item), index, **options)
+                saved += 1
+            except Exception:  # isolate failures (e.g. corrupt or unreadable files)
+                failed += 1
+            self.save_updates.put((saved, failed, time.perf_counter() - start, False))
+        self.save_updates.put((saved, failed, time.perf_counter() - start, True))
+
+    def _poll_save(self) -> None:
+        """
+        Shows the progress of the background save. Tk isn't thread-safe,
+        so the save bar is only ever updated here on the main thread.
+
+        :return: None
+        """
+        update = None
+        while not self.save_updates.empty():
+            update = self.save_updates.get()
+        if update:
+            saved, failed, elapsed, finished = update
+            self.save_bar.update_progress(saved, failed, elapsed)
+            if finished:
+                self.save_bar.finish(self.save_cancel.is_set())
+                self.save_worker = None
+                return
+        self.after(SAVE_POLL_MS, self._poll_save)
+
+
+class ImageTitlerSaveBar(ttk.Frame):
+    """
+    The save bar shows the progress and throughput of a background save and lets it be cancelled.
+    """
+
+    def __init__(self, parent, on_cancel: Callable[[], None], **kw):
+        super().__init__(parent, **kw)
+        self.total = 0
+        self.status = tk.StringVar()
+        self.progress = ttk.Progressbar(self, orient=tk.HORIZONTAL, mode="determinate")
+        self.cancel_button = ttk.Button(self, text="Cancel", command=on_cancel, state=tk.DISABLED)
+        self.progress.pack(side=tk.LEFT, expand=tk.YES, fill=tk.X)
+        ttk.Label(self, textvariable=self.status, width=40).pack(side=tk.LEFT, padx=10)
+        self.cancel_button.pack(side=tk.LEFT)
+
+    def start(self, total: int) -> None:
+        """
+        Resets the save bar for a new save.
+
+        :param total: the number of images to save
+        :return: None
+        """
+        self.total = total
+        self.progress.config(maximum=max(1, total), value=0)
+        self.status.set(f"Saving 0 of {total} images")
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def update_progress(self, saved: int, failed: int, elapsed: float) -> None:
+        """
+        Shows how far the save is along and how fast it's going.
+
+        :param saved: the number of saved images
+        :param failed: the number of images which failed
+        :param elapsed: the time since the save started in seconds
+        :return: None
+        """
+        self.progress.config(value=saved + failed)
+        rate = saved / elapsed if elapsed else 0
+        failures = f", {failed} failed" if failed else ""
+        self.status.set(f"Saved {saved} of {self.total} images{failures} ({rate:.1f} images/s)")
+
+    def finish(self, cancelled: bool) -> None:
+        """
+        Marks the save as done (or cancelled).
+
+        :param cancelled: True if the save was cancelled
+        :return: None
+        """
+        if cancelled:
+            self.status.set(f"{self.status.get()}, cancelled")
+        self.cancel_button.config(state=tk.DISABLED)
 
 
 class ImageTitlerGUI(ttk.Frame):
@@ -79,6 +216,17 @@ class ImageTitlerGUI(ttk.Frame):
         self.menu = menu
         self.options = options
         self.logo_path = None
+        self.titler: Optional[Titler] = None
+        self.titler_key: Optional[tuple] = None
+        self.batch_path: Optional[str] = None
+        self.batch_paths: List[str] = list()
+        self.selected_index = 0
+        cache_path = options.get(KEY_CACHE_PATH)
+        self.gallery = ImageTitlerGallery(
+            self,
+            self._select_image,
+            os.path.join(cache_path, "thumbnails") if cache_path else DEFAULT_THUMBNAIL_CACHE_PATH
+        )
         self.option_pane = ImageTitlerOptionPane(self, self.options)
         self.preview = ImageTitlerPreviewPane(self,
                                               text=f"Select a file using '{FILE_TAB_LABEL}' > '{NEW_IMAGE_LABEL}'")
@@ -102,23 +250,79 @@ class ImageTitlerGUI(ttk.Frame):
 
         :return: None
         """
+        if self.options.get(KEY_BATCH):
+            self.gallery.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=5)
         self.preview.pack(side=tk.RIGHT, expand=tk.YES, fill=tk.BOTH, padx=5, pady=5)
         self.option_pane.pack(side=tk.LEFT, anchor=tk.NW, padx=5, pady=5)
 
+    def get_titler(self) -> Titler:
+        """
+        Retrieves a titler for the current style options. The titler is only set up
+        again when a style option (e.g. the logo) changes, not when the title does.
+
+        :return: a titler
+        """
+        titler_key = tuple(self.options.get(style_key) for style_key in STYLE_KEYS)
+        if titler_key != self.titler_key:
+            self.titler = Titler(**{**self.options, KEY_TITLE: None})
+            self.titler_key = titler_key
+        return self.titler
+
+    def _get_preview_path(self) -> Optional[str]:
+        """
+        Retrieves the path of the image to preview. In batch mode, this is the
+        selected image of the folder, which is only listed when the folder changes.
+
+        :return: the path of the image to preview (None for an empty folder)
+        """
+        if not self.options.get(KEY_BATCH):
+            return self.options[KEY_PATH]
+        if self.options[KEY_PATH] != self.batch_path:
+            self.batch_path = self.options[KEY_PATH]
+            self.batch_paths = _list_batch_paths(self.batch_path)
+            self.selected_index = 0
+            self.gallery.set_paths(self.batch_paths)
+        if not self.batch_paths:
+            return None
+        return self.batch_paths[self.selected_index]
+
+    def _select_image(self, index: int) -> None:
+        """
+        Previews another image of the batch (e.g. when it's picked in the gallery).
+
+        :param index: the index of the image in the batch
+        :return: None
+        """
+        self.selected_index = index
+        self.gallery.select(index)
+        self.update_view()
+
     def _render_preview(self) -> None:
         """
         Renders a preview of the edited image in the child preview pane.
+        Only the previewed image is rendered, even in batch mode (see save_as).
 
         :return: None
         """
-        self.menu.current_edit = process_images(**self.options)
+        preview_path = self._get_preview_path()
+        if not preview_path:
+            return
+        self.menu.current_edit = [self.get_titler().render(preview_path, self.options.get(KEY_TITLE))]
         maxsize = (1028, 1028)
         small_image = self.menu.current_edit[0].copy()
-        small_image.thumbnail(maxsize, Image.ANTIALIAS)
+        small_image.thumbnail(maxsize, *self._get_resample())
         image = ImageTk.PhotoImage(small_image)
         self.preview.config(image=image)
         self.preview.image = image
 
+    def _get_resample(self) -> tuple:
+        """
+        Retrieves the resampling filter and reducing gap for preview thumbnails.
+
+        :return: a (filter, reducing gap) tuple
+        """
+        return RESAMPLE_MAP.get(self.options.get(KEY_RESAMPLE) or DEFAULT_RESAMPLE)
+
     def _render_logo(self) -> None:
         """
         Renders a preview of the logo in the options pane.
@@ -130,7 +334,7 @@ class ImageTitlerGUI(ttk.Frame):
             self.logo_path = logo_path
             maxsize = (50, 50)
             small_image = Image.open(logo_path)
-            small_image.thumbnail(maxsize, Image.ANTIALIAS)
+            small_image.thumbnail(maxsize, *self._get_resample())
             image = ImageTk.PhotoImage(small_image)
             self.option_pane.logo_value.config(image=image)
             self.option_pane.logo_value.image = image
@@ -148,6 +352,163 @@ class ImageTitlerPreviewPane(ttk.Label):
         super().__init__(parent, **kw)
 
 
+class ImageTitlerGallery(ttk.Frame):
+    """
+    The gallery is a scrollable strip of thumbnails of the images in a batch folder.
+    The strip is virtualized: only the cells in view are drawn, and only their thumbnails
+    are held as Tk images, so memory depends on the width of the window rather than the
+    size of the folder. Thumbnails are loaded from the disk cache or generated by a
+    background thread, most recently requested first, so what's in view comes first.
+    """
+
+    def __init__(self, parent, on_select: Callable[[int], None], cache_path: str, **kw):
+        super().__init__(parent, **kw)
+        self.on_select = on_select
+        self.cache_path = cache_path
+        self.paths: List[str] = list()
+        self.selected_index = 0
+        self.generation = 0  # bumped for every folder, so late thumbnails of an old folder are dropped
+        self.visible: range = range(0)
+        self.photos: Dict[int, ImageTk.PhotoImage] = dict()
+        self.requests: queue.LifoQueue = queue.LifoQueue()
+        self.results: queue.SimpleQueue = queue.SimpleQueue()
+        self.wanted: frozenset = frozenset()
+        self.worker: Optional[threading.Thread] = None
+        self.canvas = tk.Canvas(self, height=GALLERY_CELL_HEIGHT, highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self._scroll)
+        self.canvas.config(xscrollcommand=self.scrollbar.set)
+        self.canvas.pack(side=tk.TOP, fill=tk.X)
+        self.scrollbar.pack(side=tk.TOP, fill=tk.X)
+        self.canvas.bind("<Configure>", self._refresh)
+        self.canvas.bind("<Button-1>", self._click)
+        self.canvas.bind("<MouseWheel>", lambda event: self._scroll(tk.SCROLL, -event.delta // 120, tk.UNITS))
+        self.canvas.bind("<Button-4>", lambda _: self._scroll(tk.SCROLL, -1, tk.UNITS))
+        self.canvas.bind("<Button-5>", lambda _: self._scroll(tk.SCROLL, 1, tk.UNITS))
+
+    def set_paths(self, paths: List[str]) -> None:
+        """
+        Shows the images of another folder. Nothing is read until its cells come into view.
+
+        :param paths: the paths of the images
+        :return: None
+        """
+        self.generation += 1
+        self.paths = paths
+        self.selected_index = 0
+        self.visible = range(0)
+        self.photos.clear()
+        self.canvas.delete(tk.ALL)
+        self.canvas.config(
+            scrollregion=(0, 0, len(paths) * GALLERY_CELL_WIDTH, GALLERY_CELL_HEIGHT),
+            xscrollincrement=GALLERY_CELL_WIDTH // GALLERY_SCROLL_UNITS
+        )
+        self.canvas.xview_moveto(0)
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._generate_thumbnails, daemon=True)
+            self.worker.start()
+            self.after(GALLERY_POLL_MS, self._poll)
+        self._refresh()
+
+    def select(self, index: int) -> None:
+        """
+        Highlights the selected image.
+
+        :param index: the index of the image
+        :return: None
+        """
+        self.canvas.itemconfig(f"cell{self.selected_index}", outline="")
+        self.selected_index = index
+        self.canvas.itemconfig(f"cell{index}", outline=SELECTED_OUTLINE)
+
+    def _scroll(self, *args) -> None:
+        """
+        Scrolls the strip (e.g. from the scrollbar or the mouse wheel) and draws the cells in view.
+
+        :param args: the arguments of Canvas.xview
+        :return: None
+        """
+        self.canvas.xview(*args)
+        self._refresh()
+
+    def _click(self, event) -> None:
+        """
+        Selects the image under the cursor.
+
+        :param event: the click event
+        :return: None
+        """
+        index = int(self.canvas.canvasx(event.x)) // GALLERY_CELL_WIDTH
+        if index < len(self.paths):
+            self.on_select(index)
+
+    def _refresh(self, *_) -> None:
+        """
+        Draws the cells which came into view and drops the ones which left it.
+        Thumbnails are requested for new cells only.
+
+        :return: None
+        """
+        left = int(self.canvas.canvasx(0))
+        right = int(self.canvas.canvasx(self.canvas.winfo_width()))
+        visible = range(left // GALLERY_CELL_WIDTH, min(len(self.paths), right // GALLERY_CELL_WIDTH + 1))
+        for index in self.visible:
+            if index not in visible:
+                self.canvas.delete(f"item{index}")
+                self.photos.pop(index, None)
+        for index in visible:
+            if index not in self.visible:
+                x = index * GALLERY_CELL_WIDTH
+                self.canvas.create_rectangle(
+                    x + 1, 1, x + GALLERY_CELL_WIDTH - 1, GALLERY_CELL_HEIGHT - 1,
+                    outline=SELECTED_OUTLINE if index == self.selected_index else "",
+                    width=2,
+                    tags=(f"item{index}", f"cell{index}")
+                )
+                self.requests.put((self.generation, index, self.paths[index]))
+        self.visible = visible
+        self.wanted = frozenset((self.generation, index) for index in visible)
+
+    def _poll(self) -> None:
+        """
+        Places the thumbnails which the background thread finished. Tk isn't
+        thread-safe, so Tk images are only ever made here on the main thread.
+
+        :return: None
+        """
+        while True:
+            try:
+                generation, index, thumbnail = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation or index not in self.visible:
+                continue
+            center = (index * GALLERY_CELL_WIDTH + GALLERY_CELL_WIDTH // 2, GALLERY_CELL_HEIGHT // 2)
+            if thumbnail is None:  # e.g. files which aren't images
+                self.canvas.create_text(*center, text="?", tags=f"item{index}")
+                continue
+            self.photos[index] = ImageTk.PhotoImage(thumbnail)
+            self.canvas.create_image(*center, image=self.photos[index], tags=f"item{index}")
+            self.canvas.tag_raise(f"cell{index}")
+        self.after(GALLERY_POLL_MS, self._poll)
+
+    def _generate_thumbnails(self) -> None:
+        """
+        Serves thumbnail requests in the background. Requests for cells
+        which scrolled out of view before their turn are skipped.
+
+        :return: None
+        """
+        try:
+            Path(self.cache_path).mkdir(parents=True, exist_ok=True)
+            evict_thumbnails(self.cache_path)
+        except OSError:  # thumbnails still work without a cache
+            pass
+        while True:
+            generation, index, path = self.requests.get()
+            if (generation, index) in self.wanted:
+                self.results.put((generation, index, _get_thumbnail(path, self.cache_path)))
+
+
 class ImageTitlerMenuBar(tk.Menu):
     """
     The menu bar for interactions like loading files and logos.
@@ -182,7 +543,10 @@ class ImageTitlerMenuBar(tk.Menu):
 
         :return: None
         """
-        self.options[KEY_PATH] = filedialog.askopenfilename(filetypes=FILE_TYPES)
+        if self.options.get(KEY_BATCH):
+            self.options[KEY_PATH] = filedialog.askdirectory()
+        else:
+            self.options[KEY_PATH] = filedialog.askopenfilename(filetypes=FILE_TYPES)
         self.parent.update_view()
 
     def _new_logo(self) -> None:
@@ -209,7 +573,7 @@ class ImageTitlerMenuBar(tk.Menu):
 
         :return: None
         """
-        if self.current_edit:
+        if self.current_edit and not self.parent.is_saving():
             self.file_menu.entryconfig(2, state=tk.NORMAL)  # TODO: make this not hardcoded
         else:
             self.file_menu.entryconfig(2, state=tk.DISABLED)
@@ -474,6 +838,32 @@ class ImageTitlerOptionPane(ttk.Frame):
             state.set(0)
 
 
+def _get_thumbnail(input_path: str, cache_path: str) -> Optional[Image.Image]:
+    """
+    Loads the thumbnail of an image from the cache or generates it. Images are
+    decoded at reduced resolution where the format allows it (e.g. JPEG decodes
+    straight to 1/2, 1/4, or 1/8 scale), so a thumbnail never costs a full decode.
+
+    :param input_path: the path of an image
+    :param cache_path: the thumbnail cache directory
+    :return: the thumbnail or None if the file isn't an image
+    """
+    try:
+        if thumbnail := load_thumbnail(input_path, THUMBNAIL_SIZE, cache_path):
+            return thumbnail
+        with Image.open(input_path) as img:
+            img.draft("RGB", THUMBNAIL_SIZE)
+            img.thumbnail(THUMBNAIL_SIZE, *RESAMPLE_MAP.get(DEFAULT_RESAMPLE))
+            thumbnail = img.convert("RGBA")
+    except OSError:  # includes files which aren't images
+        return None
+    try:
+        store_thumbnail(thumbnail, input_path, THUMBNAIL_SIZE, cache_path)
+    except OSError:  # e.g. a read-only cache, so the thumbnail is generated again next time
+        pass
+    return thumbnail
+
+
 def main():
     """
     The GUI main function.
@@ -0,0 +1,159 @@
+"""
+The job stream backend to the image-titler script.
+
+Jobs are read as newline-delimited JSON (one job per line) and processed
+concurrently in a single process, so fonts, overlays, and logos stay warm.
+A result line is written as soon as each job finishes, so results arrive
+in completion order and consumers can act on them before the stream ends.
+
+A job looks like this (only the path is required):
+
+{"id": "a1", "path": "path/to/image.jpg", "title": "Hello", "options": {"size": "YouTube"}, "output": "out.webp"}
+
+Options override the options of the run (see parse_input). Without an output,
+images are saved to the output path exactly like a batch would name them.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, TextIO
+
+from imagetitler.constants import *
+from imagetitler.draw import Titler
+from imagetitler.metrics import FAILURES, increment
+from imagetitler.store import save_copy, _get_format, _write_copy
+
+logger = logging.getLogger(__name__)
+
+
+def run_jobs(jobs: Iterable[str], results: TextIO, **kwargs) -> dict:
+    """
+    Processes a stream of NDJSON jobs and writes an NDJSON result line per job.
+    Each result holds the job id (defaulting to the line number), the input path,
+    the outputs with their sizes in bytes, timings in milliseconds, and an error
+    (None on success). Errors of jobs never stop the stream, but if results
+    can't be written (e.g. the consumer went away), no further jobs are read,
+    and the error is raised once the running jobs finish.
+
+    At most a couple of jobs per worker are read ahead, so jobs may be
+    streamed in as they are produced.
+
+    :param jobs: an iterable of job lines (e.g. a file or sys.stdin)
+    :param results: a text stream for the result lines (e.g. sys.stdout)
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a count of done and failed jobs
+    """
+    workers = os.cpu_count() or 1
+    slots = threading.BoundedSemaphore(workers * 2)
+    results_lock = threading.Lock()
+    titlers = _TitlerCache()
+    counts = {"done": 0, "failed": 0}
+    errors = list()
+
+    def _finish(job_number: int, line: str) -> None:
+        try:
+            result = _run_job(job_number, line, titlers, **kwargs)
+            with results_lock:
+                counts["failed" if result["error"] else "done"] += 1
+                results.write(json.dumps(result) + "\n")
+                results.flush()
+        except Exception as error:  # e.g. a broken pipe, so results can no longer be reported
+            errors.append(error)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job_number, line in enumerate(jobs):
+            if line.strip():
+                slots.acquire()
+                if errors:
+                    break
+                executor.submit(_finish, job_number, line)
+    if errors:
+        raise errors[0]
+    logger.info(f"{counts['done']} done, {counts['failed']} failed")
+    return counts
+
+
+def _run_job(job_number: int, line: str, titlers: "_TitlerCache", **kwargs) -> dict:
+    """
+    Processes a single job. Any error is caught and reported in the result.
+
+    :param job_number: the line number of the job
+    :param line: the job as a line of JSON
+    :param titlers: the titlers shared by every job
+    :param kwargs: the options of the run
+    :return: the result of the job
+    """
+    start = time.perf_counter()
+    result = {"id": job_number, "path": None, "outputs": [], "timings": {}, "error": None}
+    options = kwargs  # until the options of the job are known
+    try:
+        job = json.loads(line)
+        result["id"] = job.get("id", job_number)
+        result["path"] = job["path"]
+        options = _get_job_options(job, **kwargs)
+        edited_image = titlers.get(options).render(job["path"], options.get(KEY_TITLE))
+        rendered = time.perf_counter()
+        if output := job.get("output"):
+            image_format = (options.get(KEY_FORMAT) or [None])[0] or _get_format(output)
+            _write_copy(edited_image, output, image_format, **options)
+            outputs = [output]
+        else:
+            outputs = save_copy(edited_image, job_number, **options)
+        result["outputs"] = [{"path": output, "bytes": os.path.getsize(output)} for output in outputs]
+        result["timings"] = {
+            "render_ms": round((rendered - start) * 1000, 1),
+            "save_ms": round((time.perf_counter() - rendered) * 1000, 1)
+        }
+    except Exception as error:  # isolate failures (e.g. bad lines or unreadable files)
+        result["error"] = f"{type(error).__name__}: {error}"
+        increment(FAILURES, size=options.get(KEY_SIZE) or DEFAULT_SIZE)
+    result["timings"]["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def _get_job_options(job: dict, **kwargs) -> dict:
+    """
+    Merges the options of a job over the options of the run. A single format
+    may be given as a string. Jobs are saved like a batch, so jobs which share
+    a title (which also names their outputs) don't overwrite each other.
+
+    :param job: the job
+    :param kwargs: the options of the run
+    :return: the options of the job
+    """
+    options = {**kwargs, **job.get("options", {}), KEY_BATCH: True}
+    options[KEY_TITLE] = job.get("title") or options.get(KEY_TITLE)
+    if isinstance(image_formats := options.get(KEY_FORMAT), str):
+        options[KEY_FORMAT] = [image_formats]
+    if options.get(KEY_FORMAT):
+        options[KEY_FORMAT] = [image_format.upper() for image_format in options[KEY_FORMAT]]
+    return options
+
+
+class _TitlerCache:
+    """
+    A thread-safe cache of titlers by style options, so jobs which
+    share a style share a titler (and its prepared logo).
+    """
+
+    def __init__(self):
+        self._titlers = dict()
+        self._lock = threading.Lock()
+
+    def get(self, options: dict) -> Titler:
+        """
+        Gets the titler for a set of options, setting it up on first use.
+        Titles are given per render, so they aren't part of a titler.
+
+        :param options: a set of options
+        :return: a titler
+        """
+        key = tuple(options.get(style_key) for style_key in STYLE_KEYS)
+        with self._lock:
+            if key not in self._titlers:
+                self._titlers[key] = Titler(**{**options, KEY_TITLE: None})
+            return self._titlers[key]
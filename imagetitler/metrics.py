@@ -0,0 +1,256 @@
+"""
+The metrics backend to the image-titler script.
+
+Runs record what they do (images titled, failures, outputs and bytes written, cache
+hits, and the latency of each stage) in a process-wide registry. The registry can be
+written out in the Prometheus text exposition format, e.g. for the textfile collector
+of the node exporter. Recording only costs a lock and a few additions, so it's always on.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+IMAGES = "imagetitler_images_total"
+FAILURES = "imagetitler_failures_total"
+OUTPUTS = "imagetitler_outputs_total"
+WRITTEN_BYTES = "imagetitler_written_bytes_total"
+CACHE_REQUESTS = "imagetitler_cache_requests_total"
+RENDER_SECONDS = "imagetitler_render_seconds"
+SAVE_SECONDS = "imagetitler_save_seconds"
+
+FAMILIES = {
+    IMAGES: ("counter", "Images titled."),
+    FAILURES: ("counter", "Images which failed to be titled or saved."),
+    OUTPUTS: ("counter", "Output files written."),
+    WRITTEN_BYTES: ("counter", "Bytes of output files written."),
+    CACHE_REQUESTS: ("counter", "Cache lookups by cache and result (hit or miss)."),
+    RENDER_SECONDS: ("histogram", "Time spent titling an image by stage (resize, overlay, or animation)."),
+    SAVE_SECONDS: ("histogram", "Time spent saving an output by stage (encode or write).")
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_LOCK = threading.Lock()
+COUNTERS: Dict[tuple, float] = defaultdict(float)
+HISTOGRAMS: Dict[tuple, list] = dict()
+CACHES: Dict[str, Callable] = dict()
+
+logger = logging.getLogger(__name__)
+
+
+def increment(name: str, amount: float = 1, **labels) -> None:
+    """
+    Adds to a counter.
+
+    :param name: the name of the counter (see FAMILIES)
+    :param amount: the amount to add
+    :param labels: the labels of the sample (e.g. size and format)
+    :return: None
+    """
+    with METRICS_LOCK:
+        COUNTERS[name, tuple(labels.items())] += amount
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """
+    Records a latency in a histogram.
+
+    :param name: the name of the histogram (see FAMILIES)
+    :param seconds: the latency in seconds
+    :param labels: the labels of the sample (e.g. stage and size)
+    :return: None
+    """
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with METRICS_LOCK:
+        histogram = HISTOGRAMS.setdefault((name, tuple(labels.items())), [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+        histogram[bucket] += 1
+        histogram[-1] += seconds
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Records how long a block takes in a histogram (even if it raises).
+
+    :param name: the name of the histogram (see FAMILIES)
+    :param labels: the labels of the sample
+    :return: a context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def register_cache(name: str, cached_function: Callable) -> None:
+    """
+    Reports the hits and misses of an lru_cache alongside the recorded cache lookups.
+
+    :param name: the name of the cache (its label)
+    :param cached_function: a function wrapped by functools.lru_cache
+    :return: None
+    """
+    CACHES[name] = cached_function
+
+
+def reset_metrics() -> None:
+    """
+    Forgets every recorded sample (registered caches keep their own statistics).
+
+    :return: None
+    """
+    with METRICS_LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+
+
+def take_metrics() -> tuple:
+    """
+    Takes every recorded sample out of the registry (e.g. to hand the samples
+    of a worker process to its parent, see merge_metrics).
+
+    :return: a (counters, histograms) snapshot
+    """
+    with METRICS_LOCK:
+        snapshot = (dict(COUNTERS), dict(HISTOGRAMS))
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+    return snapshot
+
+
+def merge_metrics(snapshot: tuple) -> None:
+    """
+    Adds the samples of a snapshot (see take_metrics) to the registry.
+
+    :param snapshot: a (counters, histograms) snapshot
+    :return: None
+    """
+    counters, histograms = snapshot
+    with METRICS_LOCK:
+        for key, value in counters.items():
+            COUNTERS[key] += value
+        for key, histogram in histograms.items():
+            merged = HISTOGRAMS.setdefault(key, [0] * len(histogram))
+            for bucket, count in enumerate(histogram):
+                merged[bucket] += count
+
+
+def format_metrics() -> str:
+    """
+    Formats the registry in the Prometheus text exposition format. Histogram
+    buckets are cumulative and end with +Inf, followed by their sum and count.
+
+    :return: the exposition text
+    """
+    with METRICS_LOCK:
+        counters = dict(COUNTERS)
+        histograms = {key: list(histogram) for key, histogram in HISTOGRAMS.items()}
+    for cache, cached_function in CACHES.items():
+        info = cached_function.cache_info()
+        counters[CACHE_REQUESTS, (("cache", cache), ("result", "hit"))] = info.hits
+        counters[CACHE_REQUESTS, (("cache", cache), ("result", "miss"))] = info.misses
+    lines = list()
+    for name, (metric_type, description) in FAMILIES.items():
+        lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"])
+        for (sample_name, labels), value in sorted(counters.items()):
+            if sample_name == name:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (sample_name, labels), histogram in sorted(histograms.items()):
+            if sample_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram):
+                cumulative += count
+                bucket_labels = labels + (("le", "+Inf" if bound == float("inf") else str(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics_file: str) -> None:
+    """
+    Writes the registry to a file atomically, so a scraper
+    never reads a partially written file.
+
+    :param metrics_file: the path of the metrics file (e.g. ending in .prom)
+    :return: None
+    """
+    temp_path = f"{metrics_file}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(format_metrics())
+    os.replace(temp_path, metrics_file)
+
+
+@contextmanager
+def export_metrics(metrics_file: Optional[str], interval: Optional[float] = None):
+    """
+    Writes the registry to a file when a block ends (even if it raises) and,
+    given an interval, every interval in the meantime, so long runs can be
+    scraped while they run. Nothing is written without a metrics file.
+
+    :param metrics_file: the path of the metrics file or None
+    :param interval: the time between writes in seconds or None to only write at the end
+    :return: a context manager
+    """
+    if not metrics_file:
+        yield
+        return
+    stop = threading.Event()
+    writer = None
+    if interval:
+        def _write_periodically():
+            while not stop.wait(interval):
+                try:
+                    write_metrics(metrics_file)
+                except Exception as error:  # a failed write (e.g. a full disk) shouldn't end periodic writes
+                    logger.warning(f"Failed to write metrics to {metrics_file}: {error}")
+
+        writer = threading.Thread(target=_write_periodically, daemon=True)
+        writer.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        if writer:
+            writer.join()
+        write_metrics(metrics_file)
+
+
+def _format_labels(labels: tuple) -> str:
+    """
+    Formats the labels of a sample, escaping their values.
+
+    :param labels: a tuple of (name, value) pairs
+    :return: the labels in braces (or nothing without labels)
+    """
+    if not labels:
+        return ""
+    escaped = (f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value) -> str:
+    """
+    Escapes a label value (backslashes, double quotes, and newlines).
+
+    :param value: the label value
+    :return: the escaped value
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    """
+    Formats the value of a sample (whole numbers without a fraction).
+
+    :param value: the value
+    :return: the formatted value
+    """
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -18,7 +18,29 @@ def parse_input() -> argparse.Namespace:
     _add_batch_option(parser)
     _add_font_option(parser)
     _add_custom_size_option(parser)
+    _add_format_option(parser)
+    _add_quality_option(parser)
+    _add_compress_level_option(parser)
+    _add_max_bytes_option(parser)
+    _add_cache_path_option(parser)
+    _add_resample_option(parser)
+    _add_dry_run_option(parser)
+    _add_journal_option(parser)
+    _add_resume_option(parser)
+    _add_shard_option(parser)
+    _add_jobs_from_option(parser)
+    _add_metrics_file_option(parser)
+    _add_metrics_interval_option(parser)
+    _add_archive_option(parser)
+    _add_titles_from_option(parser)
+    subparsers = parser.add_subparsers(dest=KEY_COMMAND, metavar="command")
+    _add_merge_command(subparsers)
+    _add_watch_command(subparsers)
     args = parser.parse_args()
+    if args.journal or args.resume or args.shard:  # these only apply to batches, so they imply batch mode
+        args.batch = True
+    if args.archive and (conflicts := _get_archive_conflicts(args)):
+        parser.error(f"--{KEY_ARCHIVE} can't be combined with {', '.join(conflicts)}")
     return args
 
 
@@ -145,3 +167,376 @@ def _add_custom_size_option(parser: argparse.ArgumentParser) -> None:
         choices=SIZE_MAP.keys(),  # [f'{k} {v}' for k, v in SIZE_MAP.items()]
         help="change the default size of the output image"
     )
+
+
+def _add_format_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the format settings for the parser.
+    The format determines which encoders are used for output images.
+    Several formats may be listed to emit one copy of each image per format.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        "-F",
+        f'--{KEY_FORMAT}',
+        nargs="+",
+        type=str.upper,
+        choices=FORMAT_MAP.keys(),
+        help="select one or more output formats (defaults to the format of the input image)"
+    )
+
+
+def _add_quality_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the quality settings for the parser.
+    The quality is passed to the lossy encoders (i.e. JPEG and WebP).
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        "-q",
+        f'--{KEY_QUALITY}',
+        type=int,
+        choices=range(1, 101),
+        metavar="[1-100]",
+        help=f"change the quality of lossy output formats (default: {DEFAULT_QUALITY})"
+    )
+
+
+def _add_compress_level_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the compress level settings for the parser.
+    The compress level trades PNG encoding time for file size.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_COMPRESS_LEVEL}',
+        type=int,
+        choices=range(10),
+        metavar="[0-9]",
+        help="change the zlib compression level of PNG output (default: optimized)"
+    )
+
+
+def _add_max_bytes_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the max bytes settings for the parser.
+    The max bytes setting caps the file size of lossy outputs by lowering
+    their quality until they fit (e.g. to meet a platform's upload limit).
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_MAX_BYTES}',
+        type=_parse_positive_int,
+        help="limit the file size of JPEG and WebP output to a number of bytes"
+    )
+
+
+def _add_cache_path_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the cache path settings for the parser.
+    The cache path is a folder where resized images are kept, so later runs
+    on the same images (e.g. to try different titles) can skip resizing.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_CACHE_PATH}',
+        help="select a folder for caching resized images between runs"
+    )
+
+
+def _add_resample_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the resample settings for the parser.
+    The resample setting trades resizing quality for speed.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_RESAMPLE}',
+        choices=RESAMPLE_MAP.keys(),
+        help=f"change the quality of resizing (default: {DEFAULT_RESAMPLE})"
+    )
+
+
+def _add_dry_run_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the dry run settings for the parser.
+    The dry run setting prints the render plan as JSON instead of processing images.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_DRY_RUN}',
+        action='store_true',
+        help="print the render plan as JSON without processing any images"
+    )
+
+
+def _add_journal_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the journal settings for the parser.
+    In a journaled batch, each image is saved as soon as it's processed,
+    and the result is recorded in a journal in the output folder. Images
+    which fail are reported instead of stopping the batch (implies the
+    batch setting).
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_JOURNAL}',
+        action='store_true',
+        help="save batch images one at a time and record the results in a journal"
+    )
+
+
+def _add_resume_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the resume settings for the parser.
+    The resume setting skips the images which the journal of an earlier
+    batch records as done (implies the batch and journal settings).
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_RESUME}',
+        action='store_true',
+        help="resume a journaled batch, skipping images which are already done"
+    )
+
+
+def _add_shard_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the shard settings for the parser.
+    The shard setting splits a batch across several machines: each machine
+    processes the images whose path hashes to its shard (implies the batch
+    and journal settings, and each shard keeps its own journal).
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_SHARD}',
+        type=_parse_shard,
+        metavar="i/n",
+        help="process only shard i of n of a batch (e.g. 0/4)"
+    )
+
+
+def _add_jobs_from_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the jobs from settings for the parser.
+    The jobs from setting reads jobs as newline-delimited JSON from a file
+    (or standard input given -) and streams a JSON result line per job to
+    standard output. The remaining options apply to every job.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_JOBS_FROM}',
+        metavar="PATH",
+        help="process newline-delimited JSON jobs from a file (or - for standard input)"
+    )
+
+
+def _add_metrics_file_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the metrics file settings for the parser.
+    The metrics file receives the statistics of the run (e.g. images, failures,
+    bytes written, cache hits, and stage latencies) in the Prometheus text format.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_METRICS_FILE}',
+        metavar="PATH",
+        help="write run statistics to a file in the Prometheus text format (e.g. for the node exporter)"
+    )
+
+
+def _add_metrics_interval_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the metrics interval settings for the parser.
+    The metrics interval rewrites the metrics file periodically during a run,
+    so long runs (e.g. watches) can be scraped while they run.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_METRICS_INTERVAL}',
+        type=_parse_positive_float,
+        metavar="SECONDS",
+        help="rewrite the metrics file every so many seconds (default: only at the end of the run)"
+    )
+
+
+def _add_archive_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the archive settings for the parser.
+    The archive collects every output in a single tar or zip file (picked
+    by its extension) instead of one file per image in the output path.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_ARCHIVE}',
+        type=_parse_archive_path,
+        metavar="PATH",
+        help=f"stream outputs into a single archive instead of separate files ({', '.join(ARCHIVE_MODE_MAP)})"
+    )
+
+
+def _add_titles_from_option(parser: argparse.ArgumentParser) -> None:
+    """
+    A helper function which sets up the titles from settings for the parser.
+    The titles are read one per line, and the input image is titled once per
+    title (e.g. for A/B tests), sharing its resized background between processes.
+
+    :param parser: an argument parser
+    :return: None
+    """
+    parser.add_argument(
+        f'--{KEY_TITLES_FROM}',
+        metavar="FILE",
+        help="title the image once per line of a file (or - for stdin), e.g. to compare titles"
+    )
+
+
+def _parse_shard(value: str) -> tuple:
+    """
+    Converts a shard string (e.g. 0/4) into an (index, count) pair.
+
+    :param value: the shard string
+    :return: the shard as an (index, count) tuple
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/n (e.g. 0/4), not '{value}'")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 0 and {count - 1}")
+    return index, count
+
+
+def _parse_positive_int(value: str) -> int:
+    """
+    Converts a string into a positive integer (e.g. a byte budget).
+
+    :param value: the string
+    :return: the positive integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, not '{value}'")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, not {number}")
+    return number
+
+
+def _parse_positive_float(value: str) -> float:
+    """
+    Converts a string into a positive, finite number (e.g. an interval in seconds).
+
+    :param value: the string
+    :return: the positive number
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive number, not '{value}'")
+    if not 0 < number < float("inf"):
+        raise argparse.ArgumentTypeError(f"expected a positive number, not {number}")
+    return number
+
+
+def _parse_archive_path(value: str) -> str:
+    """
+    Checks that an archive path has an extension of a supported archive (see ARCHIVE_MODE_MAP).
+
+    :param value: the archive path
+    :return: the archive path
+    """
+    if not value.lower().endswith(tuple(ARCHIVE_MODE_MAP)):
+        raise argparse.ArgumentTypeError(f"archive must end in one of {', '.join(ARCHIVE_MODE_MAP)}, not '{value}'")
+    return value
+
+
+def _get_archive_conflicts(args: argparse.Namespace) -> list:
+    """
+    Lists the given options which save outputs on their own terms (e.g. one
+    at a time next to a journal), so they can't stream into an archive.
+
+    :param args: the parsed arguments
+    :return: a list of conflicting options (e.g. ["--journal"])
+    """
+    keys = [KEY_JOURNAL, KEY_RESUME, KEY_SHARD, KEY_JOBS_FROM, KEY_TITLES_FROM]
+    conflicts = [f"--{key}" for key in keys if getattr(args, key)]
+    if args.command == "watch":
+        conflicts.append("watch")
+    return conflicts
+
+
+def _add_merge_command(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the merge command. The merge command
+    combines the journals of several shards into one report.
+
+    :param subparsers: the command subparsers
+    :return: None
+    """
+    merge_parser = subparsers.add_parser("merge", help="combine the journals of a sharded batch into one report")
+    merge_parser.add_argument(
+        KEY_MANIFESTS,
+        nargs="+",
+        help="select the journals to merge (or the output folder which contains them)"
+    )
+    merge_parser.add_argument(
+        '-o',
+        f'--{KEY_OUTPUT_PATH}',
+        help="select a path for the merged report (printed by default)"
+    )
+
+
+def _add_watch_command(subparsers: argparse._SubParsersAction) -> None:
+    """
+    A helper function which sets up the watch command. The watch command
+    titles images as they are dropped into a folder (the remaining options,
+    such as the output path, are given before the command).
+
+    :param subparsers: the command subparsers
+    :return: None
+    """
+    watch_parser = subparsers.add_parser("watch", help="title images as they arrive in a folder")
+    watch_parser.add_argument(
+        KEY_PATH,
+        help="select the folder to watch"
+    )
+    watch_parser.add_argument(
+        f'--{KEY_INTERVAL}',
+        type=_parse_positive_float,
+        default=DEFAULT_WATCH_INTERVAL,
+        help="select how long (in seconds) a file must stay unchanged before it is titled"
+    )
+    watch_parser.add_argument(
+        f'--{KEY_POLLING}',
+        action="store_true",
+        help="scan the folder every interval instead of using inotify (e.g. for network drives)"
+    )
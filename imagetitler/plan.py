@@ -0,0 +1,77 @@
+"""
+The planning backend to the image-titler script.
+
+A plan describes what a run would do (titles, layout, and output paths)
+without decoding any pixels. Only image headers are read.
+"""
+from collections import Counter
+from typing import List
+
+from PIL import Image
+
+from imagetitler.constants import *
+from imagetitler.draw import RenderSpec, _convert_file_name_to_title, _get_render_spec, _layout_title, \
+    _list_batch_inputs
+from imagetitler.store import _generate_image_output_path
+
+
+def plan_images(**kwargs) -> List[dict]:
+    """
+    Computes the render plan for every input of a run. The same options
+    as process_images apply, and inputs are planned in processing order.
+    If a shard is given, only the inputs of that shard are planned.
+
+    Each entry of the plan holds the input path, whether it is a valid
+    image (and why not), its format and size, its title, the lines of the
+    title, the font size, and its output paths. Output paths which collide
+    with another output or with an existing file are listed as collisions.
+
+    :param kwargs: a set of options (see parse_input for options)
+    :return: a list of plan entries (one per input)
+    """
+    if kwargs.get(KEY_BATCH):
+        kwargs[KEY_PATH] = kwargs.get(KEY_PATH) or TRC_IMAGES
+        inputs = _list_batch_inputs(**kwargs)
+    else:
+        inputs = [(0, kwargs.get(KEY_PATH) or TRC_IMAGE)]
+    spec = _get_render_spec(**kwargs)
+    plan = [_plan_image(index, input_path, spec, **kwargs) for index, input_path in inputs]
+    output_counts = Counter(output for entry in plan for output in entry["outputs"])
+    for entry in plan:
+        entry["collisions"] = [
+            output for output in entry["outputs"]
+            if output_counts[output] > 1 or os.path.exists(output)
+        ]
+    return plan
+
+
+def _plan_image(index: int, input_path: str, spec: RenderSpec, **kwargs) -> dict:
+    """
+    Computes the render plan of a single input by reading its header.
+
+    :param index: the index of the input in the run
+    :param input_path: the path of the input
+    :param spec: the render spec of the run
+    :param kwargs: a set of options
+    :return: a plan entry
+    """
+    entry = {"index": index, "path": input_path, "valid": True, "error": None}
+    try:
+        with Image.open(input_path) as img:
+            entry["format"] = img.format
+            entry["source_size"] = list(img.size)
+            image_kwargs = kwargs.copy()
+            image_kwargs[KEY_PATH] = input_path
+            image_kwargs[KEY_TITLE] = kwargs.get(KEY_TITLE) or _convert_file_name_to_title(**image_kwargs)
+            font, lines = _layout_title(image_kwargs[KEY_TITLE], spec)
+            entry["title"] = image_kwargs[KEY_TITLE]
+            entry["lines"] = list(lines)
+            entry["split"] = len(lines) > 1
+            entry["font_size"] = font.size
+            entry["outputs"] = [
+                _generate_image_output_path(img, index, image_format, **kwargs)
+                for image_format in kwargs.get(KEY_FORMAT) or [None]
+            ]
+    except OSError as error:  # includes files which aren't images
+        entry.update(valid=False, error=str(error), outputs=[])
+    return entry
@@ -1,5 +1,15 @@
+import functools
+import io
+import logging
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterable, List, Optional
 
 import pathvalidate
 import piexif
@@ -8,6 +18,20 @@ import pkg_resources
 from PIL import Image
 
 from imagetitler.constants import *
+from imagetitler.metrics import OUTPUTS, SAVE_SECONDS, WRITTEN_BYTES, increment, timed
+
+PALETTE_SIZE = 256
+MAX_ENCODE_ATTEMPTS = 16
+SUBSAMPLING_QUALITY_THRESHOLD = 75
+ANIMATED_FORMATS = {"GIF", "WEBP"}
+
+EXIF_HEADER = b"Exif\x00\x00"
+MAX_SEGMENT_SIZE = 0xFFFF - 2  # the length field of a JPEG segment counts itself
+JPEG_SOI = b"\xff\xd8"
+JPEG_APP0 = b"\xff\xe0"
+JPEG_APP1 = b"\xff\xe1"
+
+logger = logging.getLogger(__name__)
 
 
 def save_copies(edited_images: List[Image.Image], **kwargs) -> List[str]:
@@ -25,40 +49,497 @@ def save_copies(edited_images: List[Image.Image], **kwargs) -> List[str]:
 
     {title}-featured-image-{software version}.{extension}
 
+    When several formats are requested, each image is saved once per format.
+    Encoding happens concurrently, but paths are returned in image order.
+
     :param edited_images: a list of edited images
     :param kwargs: a set of keyword arguments (see parse_input for options)
     :return: a list of storage paths
     """
-    storage_paths = list()
     if not kwargs.get(KEY_BATCH):  # batch must be turned on to process multiple images
         edited_images = edited_images[:1]
-    for index, edited_image in enumerate(edited_images):
-        storage_path = _generate_image_output_path(edited_image, index, **kwargs)
-        exif = _generate_version_exif(edited_image)
-        edited_image.save(storage_path, subsampling=0, quality=100, exif=exif)
-        storage_paths.append(storage_path)
+    image_formats = kwargs.get(KEY_FORMAT) or [None]
+    for edited_image in edited_images:
+        edited_image.load()  # lazily loaded images must not be decoded by several encoders at once
+    with ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(_save_copy, edited_image, index, image_format, **kwargs)
+            for index, edited_image in enumerate(edited_images)
+            for image_format in image_formats
+        ]
+        storage_paths = [future.result() for future in futures]
     return storage_paths
 
 
+def save_copy(edited_image: Image.Image, index: int, **kwargs) -> List[str]:
+    """
+    Saves a single Pillow image once per requested format. This is the streaming
+    counterpart of save_copies: the index of the image in its set is given
+    explicitly, so images can be saved one at a time as they are processed.
+
+    :param edited_image: the edited image
+    :param index: the index of this image in a set
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a list of storage paths (one per format)
+    """
+    image_formats = kwargs.get(KEY_FORMAT) or [None]
+    edited_image.load()
+    with ThreadPoolExecutor(max_workers=len(image_formats)) as executor:
+        futures = [
+            executor.submit(_save_copy, edited_image, index, image_format, **kwargs)
+            for image_format in image_formats
+        ]
+        storage_paths = [future.result() for future in futures]
+    return storage_paths
+
+
+def archive_copies(edited_images: Iterable[Image.Image], archive_path: str, **kwargs) -> List[str]:
+    """
+    Streams Pillow images into a single archive instead of one file per image,
+    which is far cheaper on network filesystems and sync tools. The type of
+    archive follows its extension (see ARCHIVE_MODE_MAP): tar (optionally
+    compressed) or zip. Members are named like the files save_copies would
+    create (without the output path).
+
+    Each image is encoded in memory and appended as soon as it's produced,
+    so nothing is staged on disk, and memory stays bounded as long as the
+    images are produced lazily (e.g. by Titler.render_many).
+
+    :param edited_images: an iterable of edited images
+    :param archive_path: the path of the archive to be created
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a list of member names
+    """
+    image_formats = kwargs.get(KEY_FORMAT) or [None]
+    options = {**kwargs, KEY_OUTPUT_PATH: None}
+    member_names = list()
+    with _open_archive(archive_path) as add_member:
+        for index, edited_image in enumerate(edited_images):
+            for image_format in image_formats:
+                member_name = _generate_image_output_path(edited_image, index, image_format, **options)
+                member_format = image_format or _get_format(member_name)
+                _write_copy(edited_image, member_name, member_format, write=add_member, **kwargs)
+                member_names.append(member_name)
+            if not kwargs.get(KEY_BATCH):  # batch must be turned on to process multiple images
+                break
+    return member_names
+
+
+def _save_copy(edited_image: Image.Image, index: int, image_format: Optional[str], **kwargs) -> str:
+    """
+    Encodes a single image in a single format and writes it to disk.
+
+    :param edited_image: the edited image
+    :param index: the index of this image in a set
+    :param image_format: a key of FORMAT_MAP or None to use the format of the input image
+    :param kwargs: a set of options
+    :return: the storage path
+    """
+    storage_path = _generate_image_output_path(edited_image, index, image_format, **kwargs)
+    _write_copy(edited_image, storage_path, image_format or _get_format(storage_path), **kwargs)
+    return storage_path
+
+
+def _write_copy(
+        edited_image: Image.Image,
+        storage_path: str,
+        image_format: str,
+        write: Optional[Callable[[str, bytes], None]] = None,
+        **kwargs
+) -> None:
+    """
+    Encodes a single image in a single format and writes it to a path,
+    recording the time of each stage and the bytes written (see metrics).
+
+    :param edited_image: the edited image
+    :param storage_path: the path of the file (or archive member) to be created
+    :param image_format: a key of FORMAT_MAP
+    :param write: a function which writes data to a path or None to write a file
+    :param kwargs: a set of options
+    :return: None
+    """
+    labels = {"size": kwargs.get(KEY_SIZE) or DEFAULT_SIZE, "format": image_format}
+    with timed(SAVE_SECONDS, stage="encode", **labels):
+        data = encode_copy(edited_image, image_format, **kwargs)
+    with timed(SAVE_SECONDS, stage="write", **labels):
+        (write or _write_file)(storage_path, data)
+    increment(OUTPUTS, **labels)
+    increment(WRITTEN_BYTES, len(data), **labels)
+
+
+def encode_copy(edited_image: Image.Image, image_format: Optional[str] = None, **kwargs) -> bytes:
+    """
+    Encodes a single Pillow image in memory exactly like it would be saved
+    (version EXIF data and encoder settings included), so images can be
+    served without touching the disk.
+
+    :param edited_image: the edited image
+    :param image_format: a key of FORMAT_MAP or None to use the format of the input image
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: the encoded image
+    """
+    image_format = image_format or _get_format(_get_extension(edited_image))
+    exif = _generate_version_exif(edited_image)
+    return _encode_image(edited_image, image_format, exif, **kwargs)
+
+
+def _write_file(storage_path: str, data: bytes) -> None:
+    """
+    Writes a file atomically. The data is written to a temporary file
+    which then replaces the destination, so readers (and resumed runs)
+    never see a partially written file.
+
+    :param storage_path: the path of the file to be created
+    :param data: the contents of the file
+    :return: None
+    """
+    temp_path = f"{storage_path}.{os.getpid()}-{threading.get_ident()}.part"
+    try:
+        with open(temp_path, "wb") as output_file:
+            output_file.write(data)
+        os.replace(temp_path, storage_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def _open_archive(archive_path: str):
+    """
+    Opens an archive for streaming and yields a function which appends a member
+    (a name and its data) to it. Like _write_file, the archive is written to a
+    temporary file which replaces the destination once it's complete, so a failed
+    run never leaves a truncated archive behind.
+
+    :param archive_path: the path of the archive to be created
+    :return: a context manager
+    """
+    mode = _get_archive_mode(archive_path)
+    temp_path = f"{archive_path}.{os.getpid()}.part"
+    try:
+        if mode:
+            with tarfile.open(temp_path, mode) as archive:
+                yield functools.partial(_add_tar_member, archive)
+        else:  # images are compressed already, so zip members are stored as is
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as archive:
+                yield functools.partial(_add_zip_member, archive)
+        os.replace(temp_path, archive_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def _get_archive_mode(archive_path: str) -> Optional[str]:
+    """
+    Gets the tarfile stream mode of an archive from its extension.
+
+    :param archive_path: the path of an archive
+    :return: a tarfile mode (e.g. w|gz) or None for zip archives
+    """
+    for extension, mode in ARCHIVE_MODE_MAP.items():
+        if archive_path.lower().endswith(extension):
+            return mode
+    raise ValueError(f"Unsupported archive extension: {archive_path} (try one of {', '.join(ARCHIVE_MODE_MAP)})")
+
+
+def _add_tar_member(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    """
+    Appends a file to a tar archive straight from memory.
+
+    :param archive: a tar archive open for writing
+    :param name: the name of the member
+    :param data: the contents of the member
+    :return: None
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(data))
+
+
+def _add_zip_member(archive: zipfile.ZipFile, name: str, data: bytes) -> None:
+    """
+    Appends a file to a zip archive straight from memory.
+
+    :param archive: a zip archive open for writing
+    :param name: the name of the member
+    :param data: the contents of the member
+    :return: None
+    """
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.external_attr = 0o644 << 16
+    archive.writestr(info, data)
+
+
+def _encode_image(edited_image: Image.Image, image_format: str, exif: bytes, **kwargs) -> bytes:
+    """
+    Encodes an image in memory using the encoder settings for its format.
+    If a byte budget is set, lossy formats are encoded at the highest
+    quality which fits within that budget.
+
+    JPEG output is encoded without metadata, and the exif data is spliced
+    in afterwards as an APP1 segment. Other formats embed exif data through
+    their encoders. Titled animations (see Titler) keep every frame in formats
+    which support animation, and only their first frame otherwise.
+
+    :param edited_image: the edited image
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :param exif: the exif data to embed
+    :param kwargs: a set of options
+    :return: the encoded image as a byte string
+    """
+    edited_image = _prepare_image(edited_image, image_format)
+    options = _get_encoder_options(image_format, **kwargs)
+    max_bytes = kwargs.get(KEY_MAX_BYTES)
+    if image_format == "JPEG":
+        segment = _build_app1_segment(exif)
+        if max_bytes is not None:
+            if len(segment) >= max_bytes:
+                logger.warning(
+                    f"The EXIF segment alone is {len(segment)} bytes which exceeds the budget of {max_bytes} bytes"
+                )
+            max_bytes = max(max_bytes - len(segment), 0)
+        data = _encode_within_budget(edited_image, image_format, options, max_bytes)
+        return _splice_jpeg_segment(data, segment)
+    options["exif"] = exif
+    if (frames := getattr(edited_image, "frames", None)) and image_format in ANIMATED_FORMATS:
+        options.update(save_all=True, append_images=[frames.rewind()], duration=frames.durations)
+        if frames.loop is not None:
+            options["loop"] = frames.loop
+    return _encode_within_budget(edited_image, image_format, options, max_bytes)
+
+
+def _encode_within_budget(
+        edited_image: Image.Image,
+        image_format: str,
+        options: dict,
+        max_bytes: Optional[int]
+) -> bytes:
+    """
+    Encodes an image, searching for the best quality within a byte budget if one is given.
+
+    :param edited_image: an image ready to be encoded
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :param options: a dictionary of encoder settings for Image.save
+    :param max_bytes: the maximum size of the encoded image in bytes or None
+    :return: the encoded image as a byte string
+    """
+    if max_bytes is not None and "quality" in options:
+        return _encode_to_budget(edited_image, image_format, options, max_bytes)
+    data = _encode(edited_image, image_format, options)
+    if max_bytes is not None and len(data) > max_bytes:
+        logger.warning(f"{image_format} output is {len(data)} bytes which exceeds the budget of {max_bytes} bytes")
+    return data
+
+
+def _encode(edited_image: Image.Image, image_format: str, options: dict) -> bytes:
+    """
+    Encodes an image into an in-memory buffer. Image.save keeps its settings
+    on the image itself (encoderinfo), so a copy is saved instead, which lets
+    several formats of the same image be encoded at once (see save_copies).
+
+    :param edited_image: an image ready to be encoded
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :param options: a dictionary of encoder settings for Image.save
+    :return: the encoded image as a byte string
+    """
+    buffer = io.BytesIO()
+    edited_image.copy().save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def _encode_to_budget(edited_image: Image.Image, image_format: str, options: dict, max_bytes: int) -> bytes:
+    """
+    Binary searches the encoder quality for the largest encoding that fits within a budget.
+    The search starts at the requested quality, so images which already fit are only
+    encoded once. If full chroma resolution forces a JPEG below a reasonable quality,
+    the search continues with 4:2:0 chroma subsampling. Encoding happens entirely in
+    memory, and the number of attempts is capped by MAX_ENCODE_ATTEMPTS. If nothing
+    fits, the smallest encoding is returned.
+
+    :param edited_image: an image ready to be encoded
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :param options: a dictionary of encoder settings for Image.save (must contain quality)
+    :param max_bytes: the maximum size of the encoded image in bytes
+    :return: the encoded image as a byte string
+    """
+    candidates = [options]
+    if image_format == "JPEG" and options.get("subsampling") == 0:
+        candidates.append({**options, "subsampling": 2})
+    attempts = 0
+    best, best_options, smallest = None, None, None
+    for candidate in candidates:
+        if best_options and best_options["quality"] >= SUBSAMPLING_QUALITY_THRESHOLD:
+            break
+        low = best_options["quality"] + 1 if best_options else 1
+        high = candidate["quality"]
+        quality = high
+        while low <= high and attempts < MAX_ENCODE_ATTEMPTS:
+            data = _encode(edited_image, image_format, {**candidate, "quality": quality})
+            attempts += 1
+            if len(data) <= max_bytes:
+                best, best_options = data, {**candidate, "quality": quality}
+                low = quality + 1
+            else:
+                high = quality - 1
+            if not smallest or len(data) < len(smallest):
+                smallest = data
+            quality = (low + high) // 2
+    if best:
+        logger.info(
+            f"Encoded {image_format} at quality {best_options['quality']} "
+            f"(subsampling {best_options.get('subsampling', '-')}) in {attempts} attempts: "
+            f"{len(best)} of {max_bytes} bytes"
+        )
+        return best
+    logger.warning(
+        f"{image_format} output is {len(smallest)} bytes after {attempts} attempts "
+        f"which exceeds the budget of {max_bytes} bytes"
+    )
+    return smallest
+
+
+def _prepare_image(edited_image: Image.Image, image_format: str) -> Image.Image:
+    """
+    Converts an image to a mode its encoder supports. PNG output with few enough
+    colors (e.g. flat graphics) is losslessly quantized to a palette image.
+
+    :param edited_image: the edited image
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :return: an image ready to be encoded
+    """
+    if image_format == "JPEG" and edited_image.mode not in ("RGB", "L", "CMYK"):
+        edited_image = edited_image.convert("RGB")
+    elif image_format == "WEBP" and edited_image.mode not in ("RGB", "RGBA"):
+        edited_image = edited_image.convert("RGBA" if "A" in edited_image.getbands() else "RGB")
+    elif image_format == "PNG" and edited_image.mode in ("RGB", "RGBA"):
+        if edited_image.getcolors(PALETTE_SIZE):
+            method = Image.FASTOCTREE if edited_image.mode == "RGBA" else Image.MEDIANCUT
+            edited_image = edited_image.quantize(colors=PALETTE_SIZE, method=method)
+    return edited_image
+
+
+def _get_encoder_options(image_format: str, **kwargs) -> dict:
+    """
+    Retrieves the encoder settings for a format from a set of options.
+
+    :param image_format: a Pillow format name (e.g. JPEG)
+    :param kwargs: a set of options
+    :return: a dictionary of encoder settings for Image.save
+    """
+    quality = kwargs.get(KEY_QUALITY) or DEFAULT_QUALITY
+    if image_format == "JPEG":
+        return {"quality": quality, "subsampling": 0, "optimize": True, "progressive": True}
+    if image_format == "WEBP":
+        return {"quality": quality, "method": 6}
+    if image_format == "PNG":
+        if (compress_level := kwargs.get(KEY_COMPRESS_LEVEL)) is not None:
+            return {"compress_level": compress_level}
+        return {"optimize": True}
+    return {}
+
+
+def _get_format(storage_path: str) -> str:
+    """
+    Gets the Pillow format name which matches the extension of a path.
+
+    :param storage_path: the path of the file to be created (or just its extension)
+    :return: a Pillow format name (e.g. JPEG)
+    """
+    extension = storage_path if storage_path.startswith(".") else Path(storage_path).suffix
+    return Image.registered_extensions().get(extension.lower(), "JPEG")
+
+
 def _generate_version_exif(image: Image.Image) -> bytes:
     """
-    Given an image and version, this function will place that vision in the EXIF data of the file.
+    Given an image, this function will place the software version in the UserComment
+    field of the EXIF data of the file.
 
-    Currently, this function is limited to files that already have EXIF data. Naturally, not
-    all files have EXIF data, so I'm not sure how useful this feature is. That said, titler's
-    a nice start!
+    Images without EXIF data share a minimal EXIF block which is built once per run.
+    Existing EXIF data is only parsed when it is present, so the version can be merged
+    into it. If the merged data no longer fits in a JPEG segment, its thumbnail is
+    dropped, and failing that, the minimal EXIF block is used instead.
 
     :param image: an image file
-    :return: the exif data as a byte string (empty string for images that didn't already have data)
+    :return: the exif data as a byte string (including the Exif header)
     """
-    exif_data = b""
-    version: str = pkg_resources.require("image-titler")[0].version
-    version = version.replace(".", SEPARATOR)
     if exif := image.info.get('exif'):
         exif_dict = piexif.load(exif)
-        exif_dict['Exif'][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(f'image-titler-v{version}')
+        exif_dict['Exif'][piexif.ExifIFD.UserComment] = _get_version_comment()
         exif_data = piexif.dump(exif_dict)
-    return exif_data
+        if len(exif_data) > MAX_SEGMENT_SIZE:
+            exif_dict['1st'], exif_dict['thumbnail'] = {}, None
+            exif_data = piexif.dump(exif_dict)
+        if len(exif_data) <= MAX_SEGMENT_SIZE:
+            return exif_data
+    return _build_version_exif()
+
+
+@functools.lru_cache(maxsize=None)
+def _build_version_exif() -> bytes:
+    """
+    Builds a minimal EXIF block which only contains the software version as a UserComment.
+    The block is a big-endian TIFF structure with an IFD0 that points to an Exif IFD
+    holding a single UserComment entry.
+
+    :return: the exif data as a byte string (including the Exif header)
+    """
+    comment = _get_version_comment()
+    ifd0_offset = 8
+    exif_ifd_offset = ifd0_offset + 2 + 12 + 4
+    comment_offset = exif_ifd_offset + 2 + 12 + 4
+    tiff = b"".join([
+        b"MM", struct.pack(">HI", 42, ifd0_offset),
+        struct.pack(">H", 1), struct.pack(">HHII", piexif.ImageIFD.ExifTag, 4, 1, exif_ifd_offset), struct.pack(">I", 0),
+        struct.pack(">H", 1), struct.pack(">HHII", piexif.ExifIFD.UserComment, 7, len(comment), comment_offset),
+        struct.pack(">I", 0),
+        comment
+    ])
+    return EXIF_HEADER + tiff
+
+
+@functools.lru_cache(maxsize=None)
+def _get_version_comment() -> bytes:
+    """
+    Gets the software version as an EXIF UserComment (e.g. image-titler-v2-0-1).
+
+    :return: the encoded user comment
+    """
+    return piexif.helper.UserComment.dump(f'image-titler{_get_version()}')
+
+
+def _build_app1_segment(exif: bytes) -> bytes:
+    """
+    Wraps exif data in a JPEG APP1 segment.
+
+    :param exif: the exif data as a byte string (including the Exif header)
+    :return: the APP1 segment or an empty byte string if there is no exif data
+    """
+    if not exif:
+        return b""
+    if not exif.startswith(EXIF_HEADER):
+        exif = EXIF_HEADER + exif
+    if len(exif) > MAX_SEGMENT_SIZE:
+        raise ValueError("EXIF data is too long")
+    return JPEG_APP1 + struct.pack(">H", len(exif) + 2) + exif
+
+
+def _splice_jpeg_segment(data: bytes, segment: bytes) -> bytes:
+    """
+    Inserts a segment into an encoded JPEG right after its start of image marker
+    (or after its JFIF APP0 segment if there is one).
+
+    :param data: an encoded JPEG
+    :param segment: the segment to insert
+    :return: the encoded JPEG with the segment inserted
+    """
+    if not segment:
+        return data
+    index = len(JPEG_SOI)
+    if data[index:index + 2] == JPEG_APP0:
+        index += 2 + struct.unpack(">H", data[index + 2:index + 4])[0]
+    return data[:index] + segment + data[index:]
 
 
 def _get_file_name(edited_image: Image.Image, **kwargs) -> str:
@@ -86,15 +567,19 @@ def _get_file_name(edited_image: Image.Image, **kwargs) -> str:
     return file_name
 
 
-def _get_extension(edited_image: Image.Image) -> str:
+def _get_extension(edited_image: Image.Image, image_format: Optional[str] = None) -> str:
     """
-    Gets the extension for the new image.
+    Gets the extension for the new image. A requested format takes
+    priority over the extension of the original file.
 
     :param edited_image: the edited image
+    :param image_format: a key of FORMAT_MAP or None
     :return: the file extension with the dot (e.g. ".jpg")
     """
     extension = ".jpg"
-    if hasattr(edited_image, 'filename'):
+    if image_format:
+        extension = FORMAT_MAP.get(image_format)
+    elif hasattr(edited_image, 'filename'):
         extension = Path(edited_image.filename).suffix
     return extension
 
@@ -115,6 +600,7 @@ def _get_index(index: int, **kwargs) -> str:
     return i
 
 
+@functools.lru_cache(maxsize=None)
 def _get_version() -> str:
     """
     Gets the version of the image-titler and places in a string as follows: -v{version}
@@ -140,7 +626,12 @@ def _get_output_path(**kwargs) -> str:
     return output_path
 
 
-def _generate_image_output_path(edited_image: Image.Image, index: int, **kwargs) -> str:
+def _generate_image_output_path(
+        edited_image: Image.Image,
+        index: int,
+        image_format: Optional[str] = None,
+        **kwargs
+) -> str:
     """
     A helper function which generates an image output path from an image and its options.
     If a title exists, this method will use the title as the file name.
@@ -149,11 +640,12 @@ def _generate_image_output_path(edited_image: Image.Image, index: int, **kwargs)
 
     :param edited_image: an image to be stored
     :param index: the index of this image in a set
+    :param image_format: a key of FORMAT_MAP or None to keep the original extension
     :return: the path of the file to be created
     """
     version: str = _get_version()
     file_name = _get_file_name(edited_image, **kwargs)
-    extension = _get_extension(edited_image)
+    extension = _get_extension(edited_image, image_format)
     index = _get_index(index, **kwargs)
     output_path = _get_output_path(**kwargs)
     storage_path = f'{output_path}{file_name}{version}{index}{extension}'
@@ -1,16 +1,32 @@
+import io
+import json
+import os
 import shutil
 import sys
+import tarfile
+import threading
+import time
+import zipfile
 from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch
 
 import pkg_resources
-from PIL import Image
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageStat
 from imagetitler import cli
-
-from imagetitler.draw import process_images
+from imagetitler.batch import run_batch, load_journal, merge_journals
+from imagetitler.cache import evict_base_images, evict_thumbnails, load_thumbnail, store_thumbnail
+from imagetitler.constants import SIZE_MAP, DEFAULT_FONT, DEFAULT_SIZE, TRC_ICON
+
+from imagetitler.draw import BASIC_LAYOUT, Titler, process_images, _draw_text, _get_appropriate_font_size, _get_glyph, \
+    _get_render_spec, _get_text_metrics, _layout_title, _load_font, _render_overlay, _resize_image
+from imagetitler.jobs import run_jobs
+from imagetitler.metrics import export_metrics, format_metrics, reset_metrics
 from imagetitler.parse import parse_input
-from imagetitler.store import save_copies
+from imagetitler.plan import plan_images
+from imagetitler.store import archive_copies, encode_copy, save_copies
+from imagetitler.variants import title_variants
+from imagetitler.watch import watch_folder
 
 CUSTOM_FONT = "imagetitler/assets/fonts/arial.ttf"
 CUSTOM_FONT_TALL = "imagetitler/assets/fonts/gadugi.ttf"
@@ -50,6 +66,17 @@ TEST_IMAGES = [
 TEST_DUMP = "imagetitler/tests/dump"
 TEST_SOLO_DUMP = TEST_DUMP + "/solo"
 TEST_BATCH_DUMP = TEST_DUMP + "/batch"
+TEST_CACHE_DUMP = TEST_DUMP + "/cache"
+TEST_JOURNAL_INPUT = TEST_DUMP + "/journal-input"
+TEST_JOURNAL_DUMP = TEST_DUMP + "/journal"
+TEST_WATCH_INPUT = TEST_DUMP + "/watch-input"
+TEST_WATCH_DUMP = TEST_DUMP + "/watch"
+TEST_JOBS_DUMP = TEST_DUMP + "/jobs"
+TEST_THUMBNAIL_DUMP = TEST_DUMP + "/thumbnails"
+TEST_METRICS_DUMP = TEST_DUMP + "/metrics"
+TEST_ARCHIVE_DUMP = TEST_DUMP + "/archive"
+TEST_VARIANTS_DUMP = TEST_DUMP + "/variants"
+TEST_PLAN_DUMP = TEST_DUMP + "/plan"
 SAMPLE_DUMP = "samples/v" + pkg_resources.require("image-titler")[0].version
 
 
@@ -379,6 +406,136 @@ class TestParseInput(TestUtilities):
             self.assertEqual(args.logo_path, None)
             self.assertEqual(args.title, None)
 
+    def test_format(self) -> None:
+        """
+        Tests that several output formats and a quality are properly stored.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "-F", "jpeg", "webp", "-q", "80"]):
+            args = parse_input()
+            self.assertEqual(args.format, ["JPEG", "WEBP"])
+            self.assertEqual(args.quality, 80)
+            self.assertEqual(args.title, None)
+
+    def test_resample(self) -> None:
+        """
+        Tests that the resample mode is properly stored.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--resample", "fast"]):
+            args = parse_input()
+            self.assertEqual(args.resample, "fast")
+            self.assertEqual(args.title, None)
+
+    def test_dry_run(self) -> None:
+        """
+        Tests that the dry run setting is properly set to True.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--dry_run"]):
+            args = parse_input()
+            self.assertEqual(args.dry_run, True)
+            self.assertEqual(args.batch, False)
+
+    def test_shard(self) -> None:
+        """
+        Tests that the shard is properly stored as an index and count.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--shard", "1/3"]):
+            args = parse_input()
+            self.assertEqual(args.shard, (1, 3))
+            self.assertEqual(args.command, None)
+
+    def test_batch_only_options(self) -> None:
+        """
+        Tests that the options which only apply to batches turn on batch mode.
+
+        :return: None
+        """
+        for option in (["--journal"], ["--resume"], ["--shard", "0/2"]):
+            with patch.object(sys, "argv", ["image-titler", *option]):
+                self.assertEqual(True, parse_input().batch)
+
+    def test_jobs_from(self) -> None:
+        """
+        Tests that the jobs from path is properly stored.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--jobs_from", "-"]):
+            args = parse_input()
+            self.assertEqual(args.jobs_from, "-")
+            self.assertEqual(args.batch, False)
+
+    def test_metrics_file(self) -> None:
+        """
+        Tests that the metrics file and interval are properly stored.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--metrics_file", "run.prom", "--metrics_interval", "15"]):
+            args = parse_input()
+            self.assertEqual(args.metrics_file, "run.prom")
+            self.assertEqual(args.metrics_interval, 15.0)
+
+    def test_metrics_interval_not_positive(self) -> None:
+        """
+        Tests that a metrics interval which isn't a positive number is rejected.
+
+        :return: None
+        """
+        for value in ("0", "-1", "nan", "inf"):
+            with patch.object(sys, "argv", ["image-titler", "--metrics_interval", value]), patch("sys.stderr"):
+                self.assertRaises(SystemExit, parse_input)
+
+    def test_watch_interval(self) -> None:
+        """
+        Tests that the watch interval is properly stored and must be a positive number.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "watch", "incoming", "--interval", "0.5"]):
+            self.assertEqual(parse_input().interval, 0.5)
+        for value in ("0", "-1", "nan"):
+            with patch.object(sys, "argv", ["image-titler", "watch", "incoming", "--interval", value]), patch("sys.stderr"):
+                self.assertRaises(SystemExit, parse_input)
+
+    def test_archive(self) -> None:
+        """
+        Tests that archives need a supported extension and can't be combined with journaled batches.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--archive", "images.tar.gz"]):
+            self.assertEqual("images.tar.gz", parse_input().archive)
+        for arguments in (["--archive", "images.rar"], ["--archive", "images.zip", "--journal"]):
+            with patch.object(sys, "argv", ["image-titler", *arguments]), patch("sys.stderr"):
+                self.assertRaises(SystemExit, parse_input)
+
+    def test_shard_out_of_range(self) -> None:
+        """
+        Tests that a shard index outside of the shard count is rejected.
+
+        :return: None
+        """
+        with patch.object(sys, "argv", ["image-titler", "--shard", "3/3"]), patch("sys.stderr"):
+            self.assertRaises(SystemExit, parse_input)
+
+    def test_max_bytes_not_positive(self) -> None:
+        """
+        Tests that a byte budget which isn't a positive integer is rejected.
+
+        :return: None
+        """
+        for value in ("0", "-100", "lots"):
+            with patch.object(sys, "argv", ["image-titler", "--max_bytes", value]), patch("sys.stderr"):
+                self.assertRaises(SystemExit, parse_input)
+
     def test_tier_free(self) -> None:
         """
         Tests that the free tier is properly stored.
@@ -435,6 +592,18 @@ class TestProcessImages(TestUtilities):
         self.images.extend(process_images(path=IMAGE_FOLDER, batch=True))
         self.assertEqual(len(TEST_IMAGES), len(self.images))
 
+    def test_many_images_shared_title(self) -> None:
+        """
+        Tests that the batch processing feature renders a shared title overlay only once.
+
+        :return: None
+        """
+        _render_overlay.cache_clear()
+        self.images.extend(process_images(path=IMAGE_FOLDER, batch=True, title="Test Shared Title"))
+        self.assertEqual(len(TEST_IMAGES), len(self.images))
+        self.assertEqual(1, _render_overlay.cache_info().misses)
+        self.assertEqual(len(TEST_IMAGES) - 1, _render_overlay.cache_info().hits)
+
     def test_one_line_title(self) -> None:
         """
         Tests that the split text algorithm properly handles single term titles.
@@ -485,6 +654,39 @@ class TestProcessImages(TestUtilities):
         self.images.extend(process_images(title="Test Custom Font", font=CUSTOM_FONT))
         self.assertEqual(1, len(self.images))
 
+    def test_cache_path(self) -> None:
+        """
+        Tests that a cached base image renders exactly like a freshly resized one,
+        and that the cache can be emptied through eviction.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_CACHE_DUMP, ignore_errors=True)
+        self.images.extend(process_images(path=DEFAULT_IMAGE, cache_path=TEST_CACHE_DUMP))
+        self.images.extend(process_images(path=DEFAULT_IMAGE, cache_path=TEST_CACHE_DUMP, title="Cached"))
+        self.images.extend(process_images(path=DEFAULT_IMAGE, title="Cached"))
+        self.assertEqual(1, len(list(Path(TEST_CACHE_DUMP).iterdir())))
+        self.assertIsNone(ImageChops.difference(self.images[1], self.images[2]).getbbox())
+        evict_base_images(TEST_CACHE_DUMP, max_bytes=0)
+        self.assertEqual(0, len(list(Path(TEST_CACHE_DUMP).iterdir())))
+
+    def test_damaged_cache_entry(self) -> None:
+        """
+        Tests that a truncated cache entry (e.g. after a crash) is treated as a miss,
+        so the image is resized again and the entry is replaced.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_CACHE_DUMP, ignore_errors=True)
+        self.images.extend(process_images(path=DEFAULT_IMAGE, cache_path=TEST_CACHE_DUMP))
+        entry = next(Path(TEST_CACHE_DUMP).iterdir())
+        entry_size = entry.stat().st_size
+        with open(entry, "r+b") as entry_file:
+            entry_file.truncate(1000)
+        self.images.extend(process_images(path=DEFAULT_IMAGE, cache_path=TEST_CACHE_DUMP))
+        self.assertIsNone(ImageChops.difference(self.images[0], self.images[1]).getbbox())
+        self.assertEqual(entry_size, entry.stat().st_size)
+
     def test_custom_font_strange_height(self) -> None:
         """
         Tests the vertical alignment of the text placement algorithm for customs fonts with a strange height.
@@ -495,6 +697,651 @@ class TestProcessImages(TestUtilities):
         self.assertEqual(1, len(self.images))
 
 
+class TestTitler(TestUtilities):
+    """
+    A test class for the draw.py file—specifically the reusable Titler.
+    """
+
+    def test_matches_process_images(self) -> None:
+        """
+        Tests that a titler renders exactly like process_images.
+
+        :return: None
+        """
+        titler = Titler(logo_path=TRC_ICON, tier="premium")
+        expected = process_images(path=DEFAULT_IMAGE, logo_path=TRC_ICON, tier="premium")[0]
+        for _ in range(2):
+            self.assertIsNone(ImageChops.difference(expected, titler.render(DEFAULT_IMAGE)).getbbox())
+
+    def test_render_many(self) -> None:
+        """
+        Tests that a titler renders several images with per-image titles and leaves opened images untouched.
+
+        :return: None
+        """
+        with Image.open(DEFAULT_IMAGE) as img:
+            original = img.copy()
+            edited_images = list(Titler().render_many([img, (DEFAULT_IMAGE, "Custom Title")]))
+            self.assertIsNone(ImageChops.difference(original, img).getbbox())
+        self.assertEqual(2, len(edited_images))
+        self.assertIsNotNone(ImageChops.difference(*edited_images).getbbox())
+
+    def test_animation(self) -> None:
+        """
+        Tests that every frame of an animation is titled with a single overlay render
+        and that frame durations and the loop count are kept.
+
+        :return: None
+        """
+        Path(TEST_DUMP).mkdir(parents=True, exist_ok=True)
+        animation_path = str(Path(TEST_DUMP, "animation.gif"))
+        frames = [Image.new("RGB", (800, 500), (index * 40, 90, 160)) for index in range(5)]
+        durations = [40, 60, 80, 100, 120]
+        frames[0].save(animation_path, save_all=True, append_images=frames[1:], duration=durations, loop=3)
+        _render_overlay.cache_clear()
+        edited_image = Titler(size="Twitter").render(animation_path)
+        for image_format in ["GIF", "WEBP"]:
+            with Image.open(io.BytesIO(encode_copy(edited_image, image_format))) as img:
+                self.assertEqual((len(frames), 3, SIZE_MAP.get("Twitter")), (img.n_frames, img.info["loop"], img.size))
+                for index, duration in enumerate(durations):
+                    img.seek(index)
+                    img.load()
+                    self.assertEqual(duration, img.info["duration"])
+        self.assertEqual(1, _render_overlay.cache_info().misses)
+
+    def test_render_spec(self) -> None:
+        """
+        Tests that render specs are immutable and that equal options make equal (hashable) specs.
+
+        :return: None
+        """
+        spec = _get_render_spec(size="YouTube", tier="premium")
+        self.assertEqual(spec, Titler(size="YouTube", tier="premium").spec)
+        self.assertEqual(hash(spec), hash(_get_render_spec(size="YouTube", tier="premium")))
+        self.assertEqual(SIZE_MAP.get("YouTube")[1] // 7, spec.bar_height)
+        self.assertNotEqual(spec, _get_render_spec(size="YouTube"))
+        with self.assertRaises(AttributeError):
+            spec.bar_height = 0
+
+    def test_glyph_cache(self) -> None:
+        """
+        Tests that text assembled from cached glyphs (kerned pairs included) renders
+        and measures exactly like ImageDraw.text at whole and fractional positions.
+
+        :return: None
+        """
+        font = _load_font(DEFAULT_FONT, 72)
+        _get_glyph.cache_clear()
+        for text in ["AVATAR To Wave", "Yo, LT's 3 Tips & Tricks!", "AVATAR To Wave"]:
+            for position in [(20, 10), (20.5, 10.5), (21.25, 9.75)]:
+                expected, actual = Image.new("RGBA", (1200, 120)), Image.new("RGBA", (1200, 120))
+                ImageDraw.Draw(expected).text(position, text, fill=(255, 255, 255), font=font)
+                _draw_text(ImageDraw.Draw(actual), position, text, font)
+                self.assertIsNone(ImageChops.difference(expected, actual).getbbox())
+            (width, _), (_, offset_y) = font.font.getsize(text)
+            self.assertEqual((width, offset_y), _get_text_metrics(text, font)[:2])
+        self.assertEqual(len(set("AVATAR To Wave" + "Yo, LT's 3 Tips & Tricks!")), _get_glyph.cache_info().currsize)
+
+    def test_layout_engine_fallback(self) -> None:
+        """
+        Tests that fonts which don't use the basic layout (e.g. Raqm, which shapes text)
+        are drawn and measured by Pillow itself, exactly like glyphs assembled from the cache.
+
+        :return: None
+        """
+        font = _load_font(DEFAULT_FONT, 72)
+        shaped_font = ImageFont.truetype(DEFAULT_FONT, 72)
+        shaped_font.layout_engine = BASIC_LAYOUT + 1  # any other engine (the core font still lays out text)
+        text, position = "AVATAR To Wave", (20.5, 10.5)
+        expected, actual = Image.new("RGBA", (1200, 120)), Image.new("RGBA", (1200, 120))
+        _draw_text(ImageDraw.Draw(expected), position, text, font)
+        _draw_text(ImageDraw.Draw(actual), position, text, shaped_font)
+        self.assertIsNone(ImageChops.difference(expected, actual).getbbox())
+        self.assertEqual(_get_text_metrics(text, font), _get_text_metrics(text, shaped_font))
+
+    def test_line_breaking(self) -> None:
+        """
+        Tests that titles are broken by rendered width and that long titles never overflow the image.
+
+        :return: None
+        """
+        spec = _get_render_spec()
+        max_width = spec.size[0] - spec.x_offset * 2
+        self.assertEqual(("iiii iiii iiii", "WWWWWWWW"), _layout_title("iiii iiii iiii WWWWWWWW", spec)[1])
+        self.assertEqual(("Minimalism",), _layout_title("Minimalism", spec)[1])
+        long_title = "The Complete Guide to Writing Incredibly Long Titles That Would Never Fit on a Thumbnail"
+        long_word = "Supercalifragilisticexpialidociousnesses" * 2
+        for title, line_count in [(long_title, 3), (long_word, 1)]:
+            font, lines = _layout_title(title, spec)
+            self.assertEqual(line_count, len(lines))
+            self.assertEqual(title.split(), " ".join(lines).split())
+            self.assertTrue(all(_get_text_metrics(line, font)[0] <= max_width for line in lines))
+        self.assertLess(_layout_title(long_word, spec)[0].size, _get_appropriate_font_size(long_word, spec).size)
+
+    def test_render_bytes(self) -> None:
+        """
+        Tests that a titler can return encoded images.
+
+        :return: None
+        """
+        data = Titler(size="YouTube").render(DEFAULT_IMAGE, image_format="PNG")
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual("PNG", img.format)
+            self.assertEqual(SIZE_MAP.get("YouTube"), img.size)
+
+    def test_render_in_memory(self) -> None:
+        """
+        Tests that encoded images and streams are titled in memory with titles derived from their names.
+
+        :return: None
+        """
+        data = Path(DEFAULT_IMAGE).read_bytes()
+        titler = Titler()
+        expected = titler.render(DEFAULT_IMAGE)
+        titler.render(data, image_format="JPEG", name="warm-up.jpg")
+        with patch("builtins.open", side_effect=AssertionError("touched the disk")):
+            view = titler.render(data, image_format="WEBP", name=Path(DEFAULT_IMAGE).name)
+            edited_image = titler.render(io.BytesIO(data), name=Path(DEFAULT_IMAGE).name)
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        with Image.open(io.BytesIO(view)) as img:
+            self.assertEqual("WEBP", img.format)
+        self.assertIsNone(ImageChops.difference(expected, edited_image).getbbox())
+        self.assertRaises(TypeError, titler.render, 42)
+
+
+class TestThumbnailCache(TestUtilities):
+    """
+    A test class for the thumbnail functions of the cache.py file.
+    """
+
+    def setUp(self) -> None:
+        """
+        Prepares an image to make thumbnails of and an empty cache.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_THUMBNAIL_DUMP, ignore_errors=True)
+        Path(TEST_THUMBNAIL_DUMP).mkdir(parents=True)
+        self.input_path = str(Path(TEST_THUMBNAIL_DUMP, "source.png"))
+        self.cache_path = str(Path(TEST_THUMBNAIL_DUMP, "cache"))
+        Image.new("RGB", (300, 200), (10, 20, 30)).save(self.input_path)
+
+    def test_thumbnails(self) -> None:
+        """
+        Tests that thumbnails round trip, miss once the original changes, and can be evicted.
+
+        :return: None
+        """
+        self.assertIsNone(load_thumbnail(self.input_path, (96, 96), self.cache_path))
+        thumbnail = Image.new("RGBA", (96, 64), (10, 20, 30, 255))
+        store_thumbnail(thumbnail, self.input_path, (96, 96), self.cache_path)
+        cached = load_thumbnail(self.input_path, (96, 96), self.cache_path)
+        self.assertIsNone(ImageChops.difference(thumbnail, cached).getbbox())
+        self.assertIsNone(load_thumbnail(self.input_path, (48, 48), self.cache_path))
+        stat = os.stat(self.input_path)
+        os.utime(self.input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNone(load_thumbnail(self.input_path, (96, 96), self.cache_path))
+        evict_thumbnails(self.cache_path, max_bytes=0)
+        self.assertEqual(0, len(list(Path(self.cache_path).iterdir())))
+
+    def test_read_only_cache(self) -> None:
+        """
+        Tests that cached thumbnails are still served when they can't be marked as used.
+
+        :return: None
+        """
+        thumbnail = Image.new("RGB", (96, 64), (10, 20, 30))
+        store_thumbnail(thumbnail, self.input_path, (96, 96), self.cache_path)
+        with patch("os.utime", side_effect=PermissionError("read-only cache")):
+            cached = load_thumbnail(self.input_path, (96, 96), self.cache_path)
+        self.assertIsNone(ImageChops.difference(thumbnail, cached).getbbox())
+
+
+class TestRunBatch(TestUtilities):
+    """
+    A test class for the batch.py file—specifically the only exposed function, run_batch.
+    """
+
+    def setUp(self) -> None:
+        """
+        Prepares a batch of images with one corrupt file and an empty output folder.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_JOURNAL_INPUT, ignore_errors=True)
+        shutil.rmtree(TEST_JOURNAL_DUMP, ignore_errors=True)
+        Path(TEST_JOURNAL_DUMP).mkdir(parents=True)
+        shutil.copytree(IMAGE_FOLDER, TEST_JOURNAL_INPUT)
+        Path(TEST_JOURNAL_INPUT, "corrupt.jpg").write_bytes(b"not an image")
+
+    def test_failure_isolation(self) -> None:
+        """
+        Tests that a corrupt image is reported without stopping the rest of the batch.
+
+        :return: None
+        """
+        report = run_batch(path=TEST_JOURNAL_INPUT, output_path=TEST_JOURNAL_DUMP, journal=True)
+        self.assertEqual(len(TEST_IMAGES), len(report["done"]))
+        self.assertEqual([str(Path(TEST_JOURNAL_INPUT, "corrupt.jpg"))], report["failed"])
+        entries = load_journal(str(Path(TEST_JOURNAL_DUMP, ".image-titler-journal.jsonl")))
+        self.assertEqual(len(TEST_IMAGES) + 1, len(entries))
+        for entry in entries:
+            for output in entry["outputs"]:
+                self.assertTrue(Path(output).exists())
+
+    def test_resume(self) -> None:
+        """
+        Tests that resuming a batch skips the images which are done and retries failures.
+
+        :return: None
+        """
+        run_batch(path=TEST_JOURNAL_INPUT, output_path=TEST_JOURNAL_DUMP, journal=True)
+        report = run_batch(path=TEST_JOURNAL_INPUT, output_path=TEST_JOURNAL_DUMP, resume=True)
+        self.assertEqual(len(TEST_IMAGES), len(report["skipped"]))
+        self.assertEqual(0, len(report["done"]))
+        self.assertEqual(1, len(report["failed"]))
+
+    def test_resume_elsewhere(self) -> None:
+        """
+        Tests that resuming a batch skips the images which are done even if the batch folder is reached by another path.
+
+        :return: None
+        """
+        run_batch(path=TEST_JOURNAL_INPUT, output_path=TEST_JOURNAL_DUMP, journal=True)
+        report = run_batch(path=os.path.abspath(TEST_JOURNAL_INPUT), output_path=TEST_JOURNAL_DUMP, resume=True)
+        self.assertEqual(len(TEST_IMAGES), len(report["skipped"]))
+        self.assertEqual(0, len(report["done"]))
+
+    def test_shards(self) -> None:
+        """
+        Tests that shards split a batch without overlap and that their journals merge into one report.
+
+        :return: None
+        """
+        reports = [
+            run_batch(path=TEST_JOURNAL_INPUT, output_path=TEST_JOURNAL_DUMP, shard=(index, 2))
+            for index in range(2)
+        ]
+        shard_paths = [set(report["done"] + report["failed"]) for report in reports]
+        self.assertFalse(shard_paths[0] & shard_paths[1])
+        self.assertEqual(len(TEST_IMAGES) + 1, len(shard_paths[0] | shard_paths[1]))
+        merged = merge_journals([
+            str(Path(TEST_JOURNAL_DUMP, f".image-titler-journal-{index}-of-2.jsonl")) for index in range(2)
+        ])
+        self.assertEqual({"done": len(TEST_IMAGES), "failed": 1}, merged["counts"])
+        self.assertEqual({}, merged["collisions"])
+        self.assertEqual(sorted(entry["index"] for entry in merged["done"]), [entry["index"] for entry in merged["done"]])
+
+    def test_merge_latest(self) -> None:
+        """
+        Tests that merged journals match inputs across mount points and keep the entry recorded last.
+
+        :return: None
+        """
+        journals = {
+            "rerun.jsonl": {"path": "/mnt/b/batch/a.jpg", "status": "done", "time": 2},
+            "stale.jsonl": {"path": "/mnt/a/batch/a.jpg", "status": "failed", "time": 1}
+        }
+        for name, entry in journals.items():
+            entry.update(index=0, relative_path="a.jpg")
+            Path(TEST_JOURNAL_DUMP, name).write_text(json.dumps(entry) + "\n")
+        merged = merge_journals([str(Path(TEST_JOURNAL_DUMP, name)) for name in journals])
+        self.assertEqual({"done": 1, "failed": 0}, merged["counts"])
+        self.assertEqual("/mnt/b/batch/a.jpg", merged["done"][0]["path"])
+
+
+class TestWatchFolder(TestUtilities):
+    """
+    A test class for the watch.py file—specifically the only exposed function, watch_folder.
+    """
+
+    def setUp(self) -> None:
+        """
+        Prepares an empty folder to watch and an empty output folder.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_WATCH_INPUT, ignore_errors=True)
+        shutil.rmtree(TEST_WATCH_DUMP, ignore_errors=True)
+        Path(TEST_WATCH_INPUT).mkdir(parents=True)
+        Path(TEST_WATCH_DUMP).mkdir(parents=True)
+
+    def watch_until(self, count: int, **kwargs) -> dict:
+        """
+        Watches the test folder until the journal holds count entries (or a timeout passes).
+
+        :param count: the number of journal entries to wait for
+        :param kwargs: a set of options
+        :return: the report of the watch
+        """
+        stop = threading.Event()
+        reports = list()
+        watcher = threading.Thread(target=lambda: reports.append(watch_folder(
+            stop, path=TEST_WATCH_INPUT, output_path=TEST_WATCH_DUMP, interval=0.1, **kwargs
+        )))
+        watcher.start()
+        journal_path = str(Path(TEST_WATCH_DUMP, ".image-titler-journal-watch.jsonl"))
+        deadline = time.monotonic() + 10
+        while len(load_journal(journal_path)) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.3)
+        stop.set()
+        watcher.join()
+        return reports[0]
+
+    def test_new_images(self) -> None:
+        """
+        Tests that images dropped into the folder are titled and that a restart doesn't redo them.
+
+        :return: None
+        """
+        for image in TEST_IMAGES[:2]:
+            shutil.copy(image.filename, TEST_WATCH_INPUT)
+        report = self.watch_until(2)
+        self.assertEqual(2, len(report["done"]))
+        self.assertEqual(2, len(list(Path(TEST_WATCH_DUMP).glob("*.jpg"))))
+        report = self.watch_until(2)
+        self.assertEqual(0, len(report["done"]))
+
+    def test_polling(self) -> None:
+        """
+        Tests that polling picks up new images and ignores files which aren't images.
+
+        :return: None
+        """
+        shutil.copy(DEFAULT_IMAGE, TEST_WATCH_INPUT)
+        Path(TEST_WATCH_INPUT, "notes.txt").write_text("not an image")
+        report = self.watch_until(1, polling=True)
+        self.assertEqual([str(Path(DEFAULT_IMAGE).name)], [Path(path).name for path in report["done"]])
+        self.assertEqual(0, len(report["failed"]))
+
+
+class TestRunJobs(TestUtilities):
+    """
+    A test class for the jobs.py file—specifically the only exposed function, run_jobs.
+    """
+
+    def setUp(self) -> None:
+        """
+        Prepares an empty output folder.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_JOBS_DUMP, ignore_errors=True)
+        Path(TEST_JOBS_DUMP).mkdir(parents=True)
+
+    def test_jobs(self) -> None:
+        """
+        Tests that every job gets a result line and that failures don't stop the stream.
+
+        :return: None
+        """
+        jobs = [json.dumps({"id": f"job-{index}", "path": image.filename}) for index, image in enumerate(TEST_IMAGES)]
+        jobs.append(json.dumps({"id": "missing", "path": "missing.jpg"}))
+        jobs.append("not json")
+        jobs.append(json.dumps({
+            "id": "custom",
+            "path": DEFAULT_IMAGE,
+            "title": "Custom Title",
+            "options": {"format": "png", "size": "YouTube"},
+            "output": str(Path(TEST_JOBS_DUMP, "custom.png"))
+        }))
+        results = io.StringIO()
+        counts = run_jobs(jobs, results, output_path=TEST_JOBS_DUMP)
+        self.assertEqual({"done": len(TEST_IMAGES) + 1, "failed": 2}, counts)
+        results = {result["id"]: result for result in map(json.loads, results.getvalue().splitlines())}
+        expected_ids = {f"job-{index}" for index in range(len(TEST_IMAGES))} | {"missing", len(TEST_IMAGES) + 1, "custom"}
+        self.assertEqual(expected_ids, set(results))
+        for result in results.values():
+            for output in result["outputs"]:
+                self.assertEqual(Path(output["path"]).stat().st_size, output["bytes"])
+        with Image.open(results["custom"]["outputs"][0]["path"]) as img:
+            self.assertEqual(("PNG", SIZE_MAP.get("YouTube")), (img.format, img.size))
+        self.assertIn("FileNotFoundError", results["missing"]["error"])
+
+    def test_broken_results(self) -> None:
+        """
+        Tests that a results stream which can't be written stops the run with its error
+        instead of reading more jobs.
+
+        :return: None
+        """
+        class BrokenResults(io.StringIO):
+            def write(self, text: str) -> int:
+                raise BrokenPipeError("results closed")
+
+        read_jobs = list()
+
+        def _jobs():
+            for index in range(100):
+                read_jobs.append(index)
+                yield json.dumps({"id": index, "path": "missing.jpg"})
+
+        with self.assertRaises(BrokenPipeError):
+            run_jobs(_jobs(), BrokenResults(), output_path=TEST_JOBS_DUMP)
+        self.assertLess(len(read_jobs), 100)
+
+    def test_jobs_from_stdin(self) -> None:
+        """
+        Tests that jobs read from stdin leave stdin open once the run ends.
+
+        :return: None
+        """
+        jobs = io.StringIO(json.dumps({"id": "stdin", "path": DEFAULT_IMAGE}) + "\n")
+        command = ["image-titler", "--jobs_from", "-", "-o", TEST_JOBS_DUMP]
+        with patch.object(sys, "argv", command), patch.object(sys, "stdin", jobs), patch("sys.stdout", io.StringIO()):
+            cli.main()
+        self.assertFalse(jobs.closed)
+
+
+class TestTitleVariants(TestUtilities):
+    """
+    A test class for the variants.py file—specifically the only exposed function, title_variants.
+    """
+
+    def test_worker_processes(self) -> None:
+        """
+        Tests that variants drawn by worker processes on the shared background match
+        images titled one at a time and that the workers' metrics reach the parent.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_VARIANTS_DUMP, ignore_errors=True)
+        Path(TEST_VARIANTS_DUMP).mkdir(parents=True)
+        titles = ["First Variant", "Second Variant", "A Much Longer Third Variant Of The Title"]
+        reset_metrics()
+        storage_paths = title_variants(
+            titles, workers=2, path=DEFAULT_IMAGE, output_path=TEST_VARIANTS_DUMP, format=["PNG"], tier="premium"
+        )
+        self.assertEqual(len(titles), len(storage_paths))
+        for index, (title, path) in enumerate(zip(titles, storage_paths)):
+            self.assertTrue(Path(path).name.startswith(title.lower().replace(" ", "-") + "-v"))
+            self.assertTrue(path.endswith(f"-i{index}.png"))
+        titler = Titler(tier="premium")
+        for title, path in zip(titles, storage_paths):
+            with Image.open(path) as variant:
+                self.assertIsNone(ImageChops.difference(titler.render(DEFAULT_IMAGE, title), variant.convert("RGB")).getbbox())
+        self.assertIn('imagetitler_outputs_total{size="WordPress",format="PNG"} 3', format_metrics())
+
+
+class TestExportMetrics(TestUtilities):
+    """
+    A test class for the metrics.py file—specifically the exported statistics of a run.
+    """
+
+    def test_run(self) -> None:
+        """
+        Tests that a run exports its images, outputs, bytes, and stage latencies labelled by size and format.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_METRICS_DUMP, ignore_errors=True)
+        Path(TEST_METRICS_DUMP).mkdir(parents=True)
+        metrics_file = str(Path(TEST_METRICS_DUMP, "run.prom"))
+        reset_metrics()
+        with export_metrics(metrics_file):
+            images = process_images(path=DEFAULT_IMAGE, size="YouTube")
+            storage_paths = save_copies(images, output_path=TEST_METRICS_DUMP, size="YouTube", format=["PNG"])
+        samples = dict(
+            line.rsplit(" ", 1) for line in Path(metrics_file).read_text().splitlines() if not line.startswith("#")
+        )
+        self.assertEqual("1", samples['imagetitler_images_total{size="YouTube"}'])
+        self.assertEqual("1", samples['imagetitler_outputs_total{size="YouTube",format="PNG"}'])
+        written_bytes = samples['imagetitler_written_bytes_total{size="YouTube",format="PNG"}']
+        self.assertEqual(Path(storage_paths[0]).stat().st_size, int(written_bytes))
+        self.assertEqual("1", samples['imagetitler_render_seconds_count{stage="overlay",size="YouTube"}'])
+        self.assertEqual("1", samples['imagetitler_save_seconds_bucket{stage="encode",size="YouTube",format="PNG",le="+Inf"}'])
+
+    def test_failed_periodic_writes(self) -> None:
+        """
+        Tests that periodic writes keep going (and are logged) after a write fails.
+
+        :return: None
+        """
+        metrics_file = str(Path(TEST_METRICS_DUMP, "missing", "run.prom"))
+        with self.assertLogs("imagetitler.metrics", "WARNING") as logs, self.assertRaises(OSError):
+            with export_metrics(metrics_file, 0.01):
+                time.sleep(0.2)
+        self.assertGreater(len(logs.output), 1)
+
+
+class TestPlanImages(TestUtilities):
+    """
+    A test class for the plan.py file—specifically the only exposed function, plan_images.
+    """
+
+    def setUp(self) -> None:
+        """
+        Prepares an empty folder for the files a plan is checked against.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_PLAN_DUMP, ignore_errors=True)
+        Path(TEST_PLAN_DUMP).mkdir(parents=True)
+
+    def test_one_image(self) -> None:
+        """
+        Tests that a single image is planned with a title derived from its file name.
+
+        :return: None
+        """
+        plan = plan_images(path=DEFAULT_IMAGE)
+        self.assertEqual(1, len(plan))
+        self.assertTrue(plan[0]["valid"])
+        self.assertEqual("Welcome to the Image Titler by the Renegade Coder", plan[0]["title"])
+        self.assertTrue(plan[0]["split"])
+        self.assertEqual(plan[0]["title"], " ".join(plan[0]["lines"]))
+
+    def test_many_images(self) -> None:
+        """
+        Tests that a batch with a shared title is planned without collisions.
+
+        :return: None
+        """
+        plan = plan_images(path=IMAGE_FOLDER, batch=True, title="Test Plan", format=["JPEG", "WEBP"])
+        self.assertEqual(len(TEST_IMAGES), len(plan))
+        self.assertEqual(2 * len(TEST_IMAGES), len({output for entry in plan for output in entry["outputs"]}))
+        self.assertFalse(any(entry["collisions"] for entry in plan))
+
+    def test_invalid_image(self) -> None:
+        """
+        Tests that files which aren't images are reported as invalid.
+
+        :return: None
+        """
+        invalid_path = Path(TEST_PLAN_DUMP) / "not-an-image.jpg"
+        invalid_path.write_text("not an image")
+        plan = plan_images(path=str(invalid_path))
+        self.assertFalse(plan[0]["valid"])
+        self.assertEqual([], plan[0]["outputs"])
+
+    def test_collisions(self) -> None:
+        """
+        Tests that outputs which already exist are reported as collisions.
+
+        :return: None
+        """
+        paths = save_copies(TEST_IMAGES, output_path=TEST_PLAN_DUMP, title="Test Collision")
+        plan = plan_images(path=DEFAULT_IMAGE, output_path=TEST_PLAN_DUMP, title="Test Collision")
+        self.assertEqual(paths, plan[0]["collisions"])
+
+
+class TestResizeImage(TestUtilities):
+    """
+    A test class for the resizing step of draw.py.
+    """
+
+    @staticmethod
+    def _resize_with_thumbnail(img: Image.Image, size: tuple) -> Image.Image:
+        """
+        Resizes an image the way the image-titler originally did (shrink in place, then crop).
+
+        :param img: an image to be resized
+        :param size: the target size
+        :return: a resized image
+        """
+        img = img.copy()
+        img.thumbnail((size[0], img.size[1]))
+        return img.crop((0, 0, size[0], size[1]))
+
+    def assert_similar(self, expected: Image.Image, actual: Image.Image) -> None:
+        """
+        Verifies that two images have the same size and nearly the same pixels.
+
+        :param expected: the reference image
+        :param actual: the image under test
+        :return: None
+        """
+        self.assertEqual(expected.size, actual.size)
+        difference = ImageStat.Stat(ImageChops.difference(expected, actual))
+        for channel_mean in difference.mean:
+            self.assertLess(channel_mean, 2)
+
+    def test_matches_thumbnail_and_crop(self) -> None:
+        """
+        Tests that the single pass resize matches the original resize and crop for every preset.
+
+        :return: None
+        """
+        for path in [DEFAULT_IMAGE, FREE_IMAGE, CUSTOM_FONT_IMAGE]:
+            with Image.open(path) as img:
+                for size_key, size in SIZE_MAP.items():
+                    self.assert_similar(self._resize_with_thumbnail(img, size), _resize_image(img, size=size_key))
+
+    def test_source_untouched(self) -> None:
+        """
+        Tests that resizing leaves the original image as it was.
+
+        :return: None
+        """
+        with Image.open(DEFAULT_IMAGE) as img:
+            original_size = img.size
+            resized_img = _resize_image(img)
+            self.assertEqual(original_size, img.size)
+            self.assertEqual(SIZE_MAP[DEFAULT_SIZE], resized_img.size)
+
+    def test_resample_modes(self) -> None:
+        """
+        Tests that every resampling mode produces the target size and stays close to the default mode.
+
+        :return: None
+        """
+        with Image.open(DEFAULT_IMAGE) as img:
+            balanced_img = _resize_image(img, resample="balanced")
+            for resample_key in ["fast", "best"]:
+                self.assert_similar(balanced_img, _resize_image(img, resample=resample_key))
+
+    def test_small_image_is_padded(self) -> None:
+        """
+        Tests that images smaller than the target size are padded rather than enlarged.
+
+        :return: None
+        """
+        img = Image.new("RGB", (600, 300), TRC_RED[:3])
+        self.assert_similar(self._resize_with_thumbnail(img, SIZE_MAP[DEFAULT_SIZE]), _resize_image(img))
+
+
 class TestSaveCopies(TestUtilities):
     """
     A test class for the store.py file which consists of a single
@@ -576,6 +1423,72 @@ class TestSaveCopies(TestUtilities):
         self.assertEqual(len(TEST_IMAGES), len(self.paths))
         self.verify_existence()
 
+    def test_many_formats(self) -> None:
+        """
+        Tests the scenario when several output formats are requested. It should
+        save one copy of the image per format, each with the matching extension.
+
+        :return: None
+        """
+        self.paths.extend(save_copies(TEST_IMAGES, format=["JPEG", "PNG", "WEBP"], quality=80))
+        self.assertEqual([".jpg", ".png", ".webp"], [Path(path).suffix for path in self.paths])
+        self.assertEqual(["JPEG", "PNG", "WEBP"], [Image.open(path).format for path in self.paths])
+        self.verify_existence()
+
+    def test_version_exif(self) -> None:
+        """
+        Tests the scenario when images with and without EXIF data are saved.
+        It should stamp the software version in the EXIF data of every file.
+
+        :return: None
+        """
+        version = pkg_resources.require("image-titler")[0].version.replace(".", "-")
+        images = [Image.open(DEFAULT_IMAGE), Image.open(FREE_IMAGE)]
+        self.assertNotIn("exif", images[0].info)
+        self.paths.extend(save_copies(images, batch=True))
+        for path in self.paths:
+            with Image.open(path) as saved_image:
+                user_comment = saved_image.getexif().get_ifd(0x8769).get(0x9286)
+                self.assertTrue(user_comment.endswith(f"image-titler-v{version}".encode()))
+
+    def test_max_bytes(self) -> None:
+        """
+        Tests the scenario when a byte budget is provided. It should save
+        each lossy format at a size within that budget.
+
+        :return: None
+        """
+        self.paths.extend(save_copies(TEST_IMAGES, format=["JPEG", "WEBP"], max_bytes=50000))
+        self.assertEqual(2, len(self.paths))
+        for path in self.paths:
+            self.assertLessEqual(Path(path).stat().st_size, 50000)
+
+    def test_max_bytes_below_exif(self) -> None:
+        """
+        Tests the scenario when a byte budget can't even hold the EXIF data of a JPEG.
+        It should warn about the budget and still save the smallest encoding.
+
+        :return: None
+        """
+        with self.assertLogs("imagetitler.store", "WARNING") as logs:
+            self.paths.extend(save_copies(TEST_IMAGES, format=["JPEG"], max_bytes=10))
+        self.assertIn("EXIF segment alone", logs.output[0])
+        self.verify_existence()
+
+    def test_flat_color_png(self) -> None:
+        """
+        Tests the scenario when a flat-color image is saved as a PNG. It should
+        be stored as a palette image without losing any colors.
+
+        :return: None
+        """
+        flat_image = Image.new("RGB", (100, 100), TRC_RED[:3])
+        flat_image.paste(VF_BLUE[:3], (0, 0, 50, 50))
+        self.paths.extend(save_copies([flat_image], format=["PNG"]))
+        with Image.open(self.paths[0]) as saved_image:
+            self.assertEqual("P", saved_image.mode)
+            self.assertEqual(sorted(flat_image.getcolors()), sorted(saved_image.convert("RGB").getcolors()))
+
     def test_special_characters_in_title(self) -> None:
         """
         Tests the scenario when a title is provided with a special character in it.
@@ -586,3 +1499,53 @@ class TestSaveCopies(TestUtilities):
         self.paths.extend(save_copies(TEST_IMAGES, title="Test Special Chars?"))
         self.assertEqual(1, len(self.paths))
         self.verify_existence()
+
+
+class TestArchiveCopies(TestUtilities):
+    """
+    A test class for the store.py file—specifically the streaming archive sink, archive_copies().
+    """
+
+    def setUp(self) -> None:
+        """
+        Resets the archive folder.
+
+        :return: None
+        """
+        shutil.rmtree(TEST_ARCHIVE_DUMP, ignore_errors=True)
+        Path(TEST_ARCHIVE_DUMP).mkdir(parents=True)
+
+    def test_tar(self) -> None:
+        """
+        Tests that a compressed tar holds one member per image and format,
+        named and encoded like the files save_copies would create.
+
+        :return: None
+        """
+        archive_path = str(Path(TEST_ARCHIVE_DUMP, "images.tar.gz"))
+        options = dict(title="Test Archive", batch=True, format=["JPEG", "PNG"])
+        member_names = archive_copies(iter(TEST_IMAGES), archive_path, **options)
+        expected_names = [Path(path).name for path in save_copies(TEST_IMAGES, output_path=TEST_ARCHIVE_DUMP, **options)]
+        self.assertEqual(expected_names, member_names)
+        with tarfile.open(archive_path) as archive:
+            self.assertEqual(member_names, archive.getnames())
+            for member_name in member_names:
+                data = archive.extractfile(member_name).read()
+                self.assertEqual(Path(TEST_ARCHIVE_DUMP, member_name).read_bytes(), data)
+
+    def test_zip(self) -> None:
+        """
+        Tests that a zip holds a single image outside batch mode and that
+        unsupported extensions are refused without leaving files behind.
+
+        :return: None
+        """
+        archive_path = str(Path(TEST_ARCHIVE_DUMP, "images.zip"))
+        member_names = archive_copies(TEST_IMAGES, archive_path, format=["WEBP"])
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertEqual(member_names, archive.namelist())
+            self.assertEqual(1, len(member_names))
+            self.assertEqual("WEBP", Image.open(io.BytesIO(archive.read(member_names[0]))).format)
+        with self.assertRaises(ValueError):
+            archive_copies(TEST_IMAGES, str(Path(TEST_ARCHIVE_DUMP, "images.rar")))
+        self.assertEqual(["images.zip"], os.listdir(TEST_ARCHIVE_DUMP))
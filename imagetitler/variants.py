@@ -0,0 +1,162 @@
+"""
+The many-titles backend to the image-titler script.
+
+Variants (e.g. for A/B tests) put many titles on the same background. The
+background is decoded, resized, and given its logo once, then placed in
+shared memory, so worker processes neither decode it again nor receive it
+pickled. Each worker draws on a zero-copy view of the shared pixels, so a
+variant only costs its overlay and its encoding.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, List, Optional
+
+from PIL import Image
+
+from imagetitler.constants import *
+from imagetitler.draw import Titler, RenderSpec, _draw_logo, _draw_overlay, _get_base_image, _open_image
+from imagetitler.metrics import IMAGES, RENDER_SECONDS, increment, merge_metrics, take_metrics, timed
+from imagetitler.store import save_copy
+
+SHARED_MODES = {"RGB": "RGBX", "RGBA": "RGBA"}  # modes which Image.frombuffer can map without copying
+
+logger = logging.getLogger(__name__)
+
+_shared_background = dict()  # the background of a worker process (see _attach_background)
+
+
+def title_variants(titles: Iterable[str], workers: Optional[int] = None, **kwargs) -> List[str]:
+    """
+    Titles a single image (the path option) once per title and saves each variant.
+    The typical list of options apply (see parse_input), and variants are named
+    like a batch sharing one title would be (e.g. hello-world-v2-3-2-i3.jpg).
+
+    Backgrounds are shared as RGB (or RGBA if they have an alpha band). Animated
+    images can't be shared, so their variants are titled one at a time instead.
+
+    :param titles: an iterable of titles
+    :param workers: the number of worker processes (defaults to the number of CPUs)
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a list of storage paths (one per title and format)
+    """
+    titles = [title for title in titles if title]
+    titler = Titler(**kwargs)
+    options = {**titler.options, KEY_BATCH: True}
+    img = _open_image(kwargs.get(KEY_PATH) or TRC_IMAGE)
+    if getattr(img, "is_animated", False):
+        return [
+            storage_path
+            for index, title in enumerate(titles)
+            for storage_path in save_copy(titler.render(img, title), index, **{**options, KEY_TITLE: title})
+        ]
+    with timed(RENDER_SECONDS, stage="resize", size=options[KEY_SIZE]):
+        background = _get_base_image(img, **options)
+        if background.mode not in SHARED_MODES:
+            background = background.convert("RGBA" if "A" in background.getbands() else "RGB")
+        if titler.logo:
+            _draw_logo(background, titler.logo, titler.spec)
+    filename = getattr(img, "filename", None)
+    shared_mode = SHARED_MODES[background.mode]
+    data = background.tobytes("raw", shared_mode)
+    memory = shared_memory.SharedMemory(create=True, size=len(data))
+    try:
+        memory.buf[:len(data)] = data
+        del data
+        background_args = (memory.name, background.mode, background.size, background.info, filename)
+        workers = min(workers or os.cpu_count() or 1, len(titles))
+        if workers <= 1:
+            _attach_background(*background_args, titler.spec, options)
+            try:
+                storage_paths = [path for index, title in enumerate(titles) for path in _render_variant(index, title)]
+            finally:
+                _detach_background()
+        else:
+            with ProcessPoolExecutor(workers, initializer=_attach_background, initargs=(
+                    *background_args, titler.spec, options
+            )) as executor:
+                storage_paths = list()
+                for variant_paths, snapshot in executor.map(_render_variant_in_worker, range(len(titles)), titles):
+                    storage_paths.extend(variant_paths)
+                    merge_metrics(snapshot)
+    finally:
+        memory.close()
+        memory.unlink()
+    logger.info(f"{len(titles)} variants of {filename or 'the default image'}")
+    return storage_paths
+
+
+def _attach_background(
+        memory_name: str,
+        mode: str,
+        size: tuple,
+        info: dict,
+        filename: Optional[str],
+        spec: RenderSpec,
+        options: dict
+) -> None:
+    """
+    Attaches to a shared background and wraps its pixels in a read-only view
+    (no pixels are copied). Runs once per worker process.
+
+    :param memory_name: the name of the shared memory block
+    :param mode: the mode of the variants (RGB or RGBA)
+    :param size: the size of the background
+    :param info: the info of the background (e.g. its EXIF data)
+    :param filename: the file name of the source image or None
+    :param spec: the render spec
+    :param options: a set of options
+    :return: None
+    """
+    memory = shared_memory.SharedMemory(memory_name)
+    shared_mode = SHARED_MODES[mode]
+    view = Image.frombuffer(shared_mode, size, memory.buf, "raw", shared_mode, 0, 1)
+    _shared_background.update(
+        memory=memory, view=view, mode=mode, info=info, filename=filename, spec=spec, options=options
+    )
+
+
+def _detach_background() -> None:
+    """
+    Releases the view of a shared background, so its memory can be closed.
+
+    :return: None
+    """
+    view, memory = _shared_background.pop("view"), _shared_background.pop("memory")
+    del view
+    memory.close()
+    _shared_background.clear()
+
+
+def _render_variant(index: int, title: str) -> List[str]:
+    """
+    Titles and saves one variant of the shared background. The view is only read:
+    each variant draws on its own copy in the mode of the variants.
+
+    :param index: the index of the variant
+    :param title: the title of the variant
+    :return: a list of storage paths (one per format)
+    """
+    options = {**_shared_background["options"], KEY_TITLE: title}
+    with timed(RENDER_SECONDS, stage="overlay", size=options[KEY_SIZE]):
+        edited_image = _shared_background["view"].convert(_shared_background["mode"])
+        edited_image = _draw_overlay(edited_image, title, _shared_background["spec"])
+    increment(IMAGES, size=options[KEY_SIZE])
+    edited_image.info.update(_shared_background["info"])
+    if filename := _shared_background["filename"]:
+        edited_image.filename = filename  # Keeps the extension of the source
+    return save_copy(edited_image, index, **options)
+
+
+def _render_variant_in_worker(index: int, title: str) -> tuple:
+    """
+    Titles and saves one variant in a worker process, handing the metrics
+    it recorded to the parent (see merge_metrics).
+
+    :param index: the index of the variant
+    :param title: the title of the variant
+    :return: a (storage paths, metrics snapshot) tuple
+    """
+    storage_paths = _render_variant(index, title)
+    return storage_paths, take_metrics()
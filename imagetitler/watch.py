@@ -0,0 +1,221 @@
+"""
+The watch-folder backend to the image-titler script.
+
+A watched folder is titled incrementally: new and changed images are processed
+once they finish writing, and each result is recorded in a journal in the output
+folder, so a restarted watch only processes what changed while it was down.
+Everything runs in one process with a single Titler, so fonts, overlays,
+and the logo stay cached between images.
+"""
+import ctypes
+import ctypes.util
+import logging
+import select
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from imagetitler.batch import STATUS_DONE, STATUS_FAILED, load_journal, _append_entry, _process_entry, _stop_on_signals
+from imagetitler.constants import *
+from imagetitler.draw import Titler
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len (followed by the name)
+IN_BUFFER_SIZE = 1 << 16
+
+WATCH_EXTENSIONS = {extension for _, extensions in FILE_TYPES for extension in extensions} | set(FORMAT_MAP.values())
+
+logger = logging.getLogger(__name__)
+
+
+def watch_folder(stop: Optional[threading.Event] = None, **kwargs) -> dict:
+    """
+    Watches a folder and titles its images as they arrive. The typical list of options
+    apply (see parse_input), and images are saved exactly like a batch would name them.
+    Changes are detected with inotify where available. Otherwise (or with the polling
+    option), the folder is scanned every interval. Either way, a file is only processed
+    once its size and modification time have held still for an interval.
+
+    Images which the journal records as done with the same size and modification
+    time are never processed again. Outputs are ignored, so the output folder may
+    be the watched folder. The watch runs until SIGINT or SIGTERM is received
+    (or the stop event is set).
+
+    :param stop: an optional event which stops the watch when set
+    :param kwargs: a set of keyword arguments (see parse_input for options)
+    :return: a report of the watch (lists of done and failed paths plus errors by path)
+    """
+    watch_path = os.path.abspath(kwargs.get(KEY_PATH) or os.curdir)
+    interval = kwargs.get(KEY_INTERVAL)
+    if interval is None:
+        interval = DEFAULT_WATCH_INTERVAL
+    kwargs[KEY_BATCH] = True
+    journal_path = os.path.join(kwargs.get(KEY_OUTPUT_PATH) or "", WATCH_JOURNAL_FILE_NAME)
+    entries = load_journal(journal_path)
+    processed = {
+        entry.get("path"): tuple(entry.get("signature") or ())
+        for entry in entries if entry.get("status") == STATUS_DONE
+    }
+    outputs = {os.path.abspath(output) for entry in entries for output in entry.get("outputs", [])}
+    index = len(entries)
+    titler = Titler(**kwargs)
+    pending: Dict[str, Optional[tuple]] = dict()
+    report = {STATUS_DONE: list(), STATUS_FAILED: list(), "errors": dict()}
+    stop = stop or threading.Event()
+    with open(journal_path, "a") as journal, _stop_on_signals(stop):
+        logger.info(f"Watching {watch_path} (journal: {journal_path})")
+        for changed_paths in _watch_changes(watch_path, interval, stop, kwargs.get(KEY_POLLING)):
+            now = time.monotonic()
+            for path in changed_paths:
+                if _is_watched_file(path, outputs):
+                    pending.setdefault(path, None)
+            for path in list(pending):
+                signature = _get_signature(path)
+                if signature is None or signature == processed.get(path):
+                    del pending[path]
+                elif pending[path] is None or pending[path][0] != signature:
+                    pending[path] = (signature, now)  # still being written (or just noticed)
+                elif now - pending[path][1] >= interval:
+                    del pending[path]
+                    entry = _process_entry(titler, index, path, **kwargs)
+                    entry["signature"] = list(signature)
+                    _append_entry(journal, entry)
+                    index += 1
+                    report[entry["status"]].append(path)
+                    if entry["error"]:
+                        report["errors"][path] = entry["error"]
+                        logger.error(f"Failed {path}: {entry['error']}")
+                    else:
+                        processed[path] = signature
+                        outputs.update(os.path.abspath(output) for output in entry["outputs"])
+                        logger.info(f"Titled {path}")
+    logger.info(f"{len(report[STATUS_DONE])} done, {len(report[STATUS_FAILED])} failed (journal: {journal_path})")
+    return report
+
+
+def _watch_changes(watch_path: str, interval: float, stop: threading.Event, polling: bool) -> Iterator[List[str]]:
+    """
+    Yields the paths which may have changed in a folder at least once per interval
+    until the stop event is set. Every file is yielded first, so files which arrived
+    while nothing was watching are caught.
+
+    :param watch_path: the folder to watch
+    :param interval: the maximum time between yields in seconds
+    :param stop: the event which ends the watch
+    :param polling: True to scan the folder instead of using inotify
+    :return: an iterator of lists of paths (which may be empty)
+    """
+    fd = None if polling else _open_inotify(watch_path)
+    try:
+        snapshot = _scan_folder(watch_path)
+        yield list(snapshot)
+        while not stop.is_set():
+            if fd is not None:
+                yield _read_inotify_events(fd, watch_path, interval)
+            else:
+                stop.wait(interval)
+                previous, snapshot = snapshot, _scan_folder(watch_path)
+                yield [path for path, signature in snapshot.items() if previous.get(path) != signature]
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def _open_inotify(watch_path: str) -> Optional[int]:
+    """
+    Opens an inotify instance which reports files that are closed after writing
+    or moved into a folder. inotify is only available on Linux.
+
+    :param watch_path: the folder to watch
+    :return: the inotify file descriptor or None if inotify is unavailable
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(watch_path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_inotify_events(fd: int, watch_path: str, timeout: float) -> List[str]:
+    """
+    Waits up to timeout seconds for inotify events and returns the paths they name.
+
+    :param fd: the inotify file descriptor
+    :param watch_path: the watched folder
+    :param timeout: the maximum time to wait in seconds
+    :return: a list of paths (empty if nothing happened)
+    """
+    paths = list()
+    readable, _, _ = select.select([fd], [], [], timeout)
+    if not readable:
+        return paths
+    try:
+        buffer = os.read(fd, IN_BUFFER_SIZE)
+    except BlockingIOError:
+        return paths
+    offset = 0
+    while offset < len(buffer):
+        _, _, _, length = IN_EVENT_HEADER.unpack_from(buffer, offset)
+        offset += IN_EVENT_HEADER.size
+        name = buffer[offset:offset + length].rstrip(b"\0")
+        offset += length
+        if name:
+            paths.append(os.path.join(watch_path, os.fsdecode(name)))
+    return paths
+
+
+def _scan_folder(watch_path: str) -> Dict[str, tuple]:
+    """
+    Lists the files of a folder along with their signatures. Only
+    directory entries are read, so no file is opened.
+
+    :param watch_path: the folder to scan
+    :return: a dictionary of paths to signatures
+    """
+    snapshot = dict()
+    with os.scandir(watch_path) as scanner:
+        for entry in scanner:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue
+    return snapshot
+
+
+def _get_signature(path: str) -> Optional[tuple]:
+    """
+    Gets the signature of a file: its modification time and size.
+
+    :param path: the path of a file
+    :return: the signature or None if the file is gone
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _is_watched_file(path: str, outputs: set) -> bool:
+    """
+    Determines whether a file should be titled. Hidden files (e.g. journals),
+    files which aren't images (e.g. partial writes), and outputs are ignored.
+
+    :param path: the path of a file
+    :param outputs: the absolute paths of the outputs so far
+    :return: True if the file should be titled
+    """
+    name = os.path.basename(path)
+    return not name.startswith(".") \
+        and os.path.splitext(name)[1].lower() in WATCH_EXTENSIONS \
+        and path not in outputs
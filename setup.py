@@ -19,6 +19,7 @@ setuptools.setup(
         "console_scripts": [
             'image-titler = imagetitler.cli:main',
             'image_titler = imagetitler.cli:main',  # For backwards compatibility
+            'image-titler-bench = imagetitler.bench:main',
         ],
         "gui_scripts": [
             'image-titler-gui = imagetitler.gui:main',
@@ -31,7 +32,7 @@ setuptools.setup(
     ],
     install_requires=[
         'titlecase',
-        'pillow>=6.0.0',
+        'pillow>=8.0.0',
         'pathvalidate',
         'piexif',
         'matplotlib'